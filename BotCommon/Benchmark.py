@@ -0,0 +1,117 @@
+import random
+import re
+import timeit
+from types import SimpleNamespace
+
+import numpy as np
+
+from scripts_of_tribute.board import UniqueCard
+from scripts_of_tribute.enums import CardType, MoveEnum, PatronId, PlayerEnum
+
+from BotCommon.Heuristics import CalculateFavor, CalculateMaxMinAverageCoin, CalculateMaxMinAveragePowerAndPrestige, MMHVR_plain_values, \
+    WeightedUtilityFunction_MMHVR_plain, WeightedUtilityFunction_MMHVR_plain_batch, CompiledEvaluator, utilityFunction_MMHVR, \
+    DeriveHandFeatures, MMHVR_plain_features
+from BotCommon.EvaluationCache import EvaluationCache
+from HeuristicLearning.ActivationFunctions import ACTIVATION_NAMES
+
+
+# Micro-benchmarks of the heuristic evaluation, they do not need the engine: python -m BotCommon.Benchmark
+
+EFFECTS = ["GAIN_COIN 1", "GAIN_COIN 2", "GAIN_COIN 3", "GAIN_POWER 1", "GAIN_POWER 2", "GAIN_POWER 4",
+           "GAIN_PRESTIGE 1", "GAIN_PRESTIGE 3", "DRAW 1", "OPP_DISCARD 1", "HEAL 2", ""]
+
+def MakeCard(unique_id: int, rng: random.Random) -> UniqueCard:
+    # the effect at index 0 is played with the card, the next ones are its combos
+    effects = [rng.choice(EFFECTS) for _ in range(rng.randint(1, 4))]
+    return UniqueCard(f"card {unique_id % 60}", PatronId.TREASURY, 3, CardType.ACTION, -1, False, unique_id, effects)
+
+def MakeState(cards: int = 30, seed: int = 1) -> SimpleNamespace:
+    # the parts of a GameState the MMHVR features and the evaluation cache read
+    rng = random.Random(seed)
+    deck = [MakeCard(uid, random.Random(uid % 60)) for uid in range(cards)]
+    rng.shuffle(deck)
+    player = SimpleNamespace(player_id=PlayerEnum.PLAYER1, draw_pile=deck[:cards // 2], hand=deck[cards // 2:cards // 2 + 5],
+                             cooldown_pile=deck[cards // 2 + 5:], coins=3, power=2, prestige=10)
+    patrons = {patron: rng.choice([PlayerEnum.PLAYER1, PlayerEnum.PLAYER2, PlayerEnum.NO_PLAYER_SELECTED]) for patron in list(PatronId)[:4]}
+    return SimpleNamespace(current_player=player, enemy_player=SimpleNamespace(prestige=12), patron_states=SimpleNamespace(patrons=patrons),
+                           end_game_state=None)
+
+def RegexHandStatistics(game_state, regex):
+    # the regex parsing and full sort used before the card effect table, kept as the baseline
+    cards = game_state.current_player.draw_pile + game_state.current_player.hand + game_state.current_player.cooldown_pile
+    pattern = re.compile(rf"({regex}) (\d+)")
+    valid_card = [(card, int(pattern.match(effect).group(2))) for card in cards for effect in card.effects if pattern.match(effect)]
+    cards_sorted = sorted(valid_card, key=lambda x: x[1], reverse=True)
+    top_5_hand = sum(n for _, n in cards_sorted[:5])
+    bottom_5_hand = sum(n for _, n in cards_sorted[-5:])
+    average_singleCard = sum(n for _, n in cards_sorted) / len(cards_sorted) if cards_sorted else 0
+    return top_5_hand, bottom_5_hand, (top_5_hand + bottom_5_hand) / 2, average_singleCard
+
+def RegexFeatures(game_state) -> list:
+    return [*RegexHandStatistics(game_state, "GAIN_COIN"), *RegexHandStatistics(game_state, "GAIN_POWER|GAIN_PRESTIGE"),
+            game_state.current_player.prestige, game_state.current_player.power,
+            CalculateFavor(game_state, game_state.current_player.player_id), game_state.current_player.coins, game_state.enemy_player.prestige]
+
+def Fresh(game_state):
+    # drops the hand features memoized on the state, so that every call computes them
+    vars(game_state).pop("hand_features", None)
+    return game_state
+
+def PlayFirstCard(game_state) -> tuple[SimpleNamespace, SimpleNamespace]:
+    # the state after playing the first card of the hand and the move, effects left out
+    player = game_state.current_player
+    card = player.hand[0]
+    child_player = SimpleNamespace(**{**vars(player), "hand": player.hand[1:], "coins": player.coins + 1})
+    move = SimpleNamespace(command=MoveEnum.PLAY_CARD, cardUniqueId=card.unique_id)
+    return Fresh(SimpleNamespace(**{**vars(game_state), "current_player": child_player})), move
+
+def BenchmarkHandStatistics(cards: int = 30, number: int = 2000) -> dict[str, float]:
+    game_state = MakeState(cards)
+    expected = RegexFeatures(game_state)
+    if list(MMHVR_plain_values(game_state)) != expected:
+        raise ValueError(f"features differ from the baseline: {list(MMHVR_plain_values(game_state))} != {expected}")
+    child_state, move = PlayFirstCard(game_state)
+    if not DeriveHandFeatures(game_state, move, child_state) or MMHVR_plain_features(child_state) != RegexFeatures(child_state):
+        raise ValueError("derived features differ from the baseline")
+
+    def derived():
+        DeriveHandFeatures(game_state, move, Fresh(child_state))
+        return MMHVR_plain_values(child_state)
+
+    results = {
+        "regex coin": timeit.timeit(lambda: RegexHandStatistics(game_state, "GAIN_COIN"), number=number),
+        "table coin": timeit.timeit(lambda: CalculateMaxMinAverageCoin(game_state), number=number),
+        "regex power and prestige": timeit.timeit(lambda: RegexHandStatistics(game_state, "GAIN_POWER|GAIN_PRESTIGE"), number=number),
+        "table power and prestige": timeit.timeit(lambda: CalculateMaxMinAveragePowerAndPrestige(game_state), number=number),
+        "regex MMHVR_plain": timeit.timeit(lambda: RegexFeatures(game_state), number=number),
+        "table MMHVR_plain": timeit.timeit(lambda: MMHVR_plain_values(Fresh(game_state)), number=number),
+        "incremental MMHVR_plain": timeit.timeit(derived, number=number),
+    }
+    return {name: seconds / number * 1e6 for name, seconds in results.items()} # microseconds per call
+
+def BenchmarkBatchEvaluation(states: int = 16, number: int = 500) -> dict[str, float]:
+    # the weighted evaluation of an evolved individual, state by state and as one feature matrix
+    game_states = [MakeState(30, seed) for seed in range(states)]
+    rng = random.Random(0)
+    weights = np.array([rng.uniform(-1, 1) for _ in range(13)])
+    functions = [rng.choice(ACTIVATION_NAMES) for _ in range(13)]
+    compiled = CompiledEvaluator(weights, functions)
+    cache = EvaluationCache(WeightedUtilityFunction_MMHVR_plain)
+    results = {
+        "unweighted MMHVR": timeit.timeit(lambda: [utilityFunction_MMHVR(Fresh(gs)) for gs in game_states], number=number),
+        "state by state": timeit.timeit(lambda: [WeightedUtilityFunction_MMHVR_plain(Fresh(gs), weights, functions) for gs in game_states], number=number),
+        "batch": timeit.timeit(lambda: WeightedUtilityFunction_MMHVR_plain_batch([Fresh(gs) for gs in game_states], weights, functions), number=number),
+        "compiled": timeit.timeit(lambda: [compiled(Fresh(gs)) for gs in game_states], number=number),
+        "compiled batch": timeit.timeit(lambda: compiled.Batch([Fresh(gs) for gs in game_states]), number=number),
+        "cache hit": timeit.timeit(lambda: [cache(Fresh(gs), weights, functions) for gs in game_states], number=number),
+    }
+    return {name: seconds / number / states * 1e6 for name, seconds in results.items()} # microseconds per state
+
+
+if __name__ == "__main__":
+    for cards in [15, 30, 60]:
+        timings = BenchmarkHandStatistics(cards)
+        print(f"{cards:3d} cards: " + ", ".join(f"{name} {us:.1f}us" for name, us in timings.items()))
+    for states in [4, 16, 64]:
+        timings = BenchmarkBatchEvaluation(states)
+        print(f"{states:3d} states: " + ", ".join(f"{name} {us:.1f}us per state" for name, us in timings.items()))
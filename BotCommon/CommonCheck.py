@@ -5,6 +5,8 @@ from scripts_of_tribute.board import GameState
 from scripts_of_tribute.enums import MoveEnum
 from scripts_of_tribute.move import BasicMove, SimpleCardMove, MakeChoiceMoveUniqueCard, MakeChoiceMoveUniqueEffect
 
+from BotCommon.Heuristics import CarryHandFeatures
+
 
 def CheckForGoalState(game_state, player_id) -> bool:
     return game_state.end_game_state is not None and game_state.end_game_state.winner == player_id
@@ -12,6 +14,14 @@ def CheckForGoalState(game_state, player_id) -> bool:
 def obtain_move_semantic_id(move:BasicMove) -> tuple[int,int|tuple]:
     if move is None:
         return None,None
+    # computed once per move object, the searches ask for it on every node and every lookup
+    try:
+        return move.semantic_id
+    except AttributeError:
+        move.semantic_id = compute_move_semantic_id(move)
+        return move.semantic_id
+
+def compute_move_semantic_id(move:BasicMove) -> tuple[int,int|tuple]:
     if hasattr(move, 'cardUniqueId'):
         return move.command.value, move.cardUniqueId
     elif hasattr(move, 'patronId'):
@@ -23,6 +33,47 @@ def obtain_move_semantic_id(move:BasicMove) -> tuple[int,int|tuple]:
     else:
         return move.command.value, -1
 
+def obtain_state_semantic_id(game_state:GameState) -> tuple:
+    # canonical id of a state: piles are compared as multisets so permuted move orders reaching the same state collide
+    def pile(cards) -> tuple:
+        return tuple(sorted(card.unique_id for card in cards))
+
+    def agents(agent_list) -> tuple:
+        return tuple(sorted((agent.representing_card.unique_id, agent.currentHP, agent.activated) for agent in agent_list))
+
+    def choice(pending_choice) -> tuple | None:
+        if pending_choice is None:
+            return None
+        options = pending_choice.possible_options
+        if hasattr(options, 'possible_cards'):
+            options = pile(options.possible_cards)
+        else:
+            options = tuple(options.possible_effects)
+        return pending_choice.choice_follow_up, pending_choice.min_choices, pending_choice.max_choices, options
+
+    player = game_state.current_player
+    enemy  = game_state.enemy_player
+    winner = game_state.end_game_state.winner if game_state.end_game_state is not None else None
+    return (player.player_id, game_state.board_state, winner, choice(game_state.pending_choice),
+            pile(player.hand), pile(player.played), pile(player.cooldown_pile), pile(player.draw_pile), pile(player.known_upcoming_draws),
+            agents(player.agents), player.coins, player.power, player.prestige, player.patron_calls,
+            enemy.prestige, enemy.power, agents(enemy.agents),
+            tuple(sorted((patron.value, player_enum.value) for patron, player_enum in game_state.patron_states.patrons.items())),
+            pile(game_state.tavern_available_cards), tuple(game_state.upcoming_effects))
+
+def obtain_evaluation_fingerprint(game_state:GameState) -> tuple:
+    # the parts of a state the heuristics read, cheaper than obtain_state_semantic_id: the piles as sets (unique ids
+    # do not repeat, the order is not read), resources, patron favor, the enemy prestige and the winner for utility_boost
+    player = game_state.current_player
+    winner = game_state.end_game_state.winner if game_state.end_game_state is not None else None
+    return (player.player_id, winner,
+            frozenset([card.unique_id for card in player.hand]),
+            frozenset([card.unique_id for card in player.draw_pile]),
+            frozenset([card.unique_id for card in player.cooldown_pile]),
+            player.coins, player.power, player.prestige,
+            frozenset(game_state.patron_states.patrons.items()),
+            game_state.enemy_player.prestige)
+
 
 def NewPossibleMoveAvailable(moves:list[BasicMove]) -> bool:
     return not (len(moves) == 1 and moves[0].command == MoveEnum.END_TURN)
@@ -49,21 +100,23 @@ def MatchCommand(move: BasicMove, move_list: list[BasicMove]):
 def IsPriorMoves(move: BasicMove) -> bool:
     return isinstance(move, SimpleCardMove) and move.command != MoveEnum.BUY_CARD
 
-def MakePriorChoice(game_state:GameState, possible_moves: list[BasicMove], heuristic) -> MakeChoiceMoveUniqueEffect | None:
+def MakePriorChoice(game_state:GameState, possible_moves: list[BasicMove], batch_heuristic) -> MakeChoiceMoveUniqueEffect | None:
+    # batch_heuristic scores all the resulting states in one call, see BotCommon.Heuristics.BatchEvaluationFunction
     choice = [mv for mv in possible_moves if isinstance(mv, MakeChoiceMoveUniqueEffect)]
     if len(choice) != len(possible_moves):
         return None
 
-    best_move_value = float('-inf')
-    best_move = None
+    return BestMove(game_state, choice, batch_heuristic)
 
-    for move in choice:
-        new_game_state,_ = game_state.apply_move(move)
-        move_value = heuristic(new_game_state)
-        if move_value > best_move_value:
-            best_move_value = move_value
-            best_move = move
-    return best_move
+def BestMove(game_state:GameState, moves: list[BasicMove], batch_heuristic, seed: int | None = None) -> BasicMove | None:
+    # the move whose next state scores best, the first one on ties
+    if len(moves) == 0:
+        return None
+    new_game_states = [game_state.apply_move(move, seed)[0] for move in moves]
+    for move, new_game_state in zip(moves, new_game_states):
+        CarryHandFeatures(game_state, move, new_game_state)
+    move_values = np.asarray(batch_heuristic(new_game_states), dtype=np.float64)
+    return moves[int(np.argmax(move_values))]
 
 
 def depth_sample(game_state: GameState, possible_moves:list[BasicMove]) -> tuple[int, list[float]]:
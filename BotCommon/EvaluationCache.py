@@ -0,0 +1,104 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable
+
+import numpy as np
+from scripts_of_tribute.board import GameState
+
+from BotCommon.CommonCheck import obtain_evaluation_fingerprint
+from BotCommon.Heuristics import BatchEvaluationFunction, CompiledEvaluator, utilityFunction_PrestigeAndPower, utilityFunction_MMHVR, \
+    utilityFunction_MMHVR_plain, WeightedUtilityFunction_MMHVR, WeightedUtilityFunction_MMHVR_plain
+
+
+# Memoized evaluation function, keyed by obtain_evaluation_fingerprint: the same state is scored again and again
+# (prior choices, the greedy fallback, BoundedDS leaves reached by other move orders, playouts ending the turn alike).
+# One cache per bot: the arguments the bot passes along (weights, activations, player id) are the same on every
+# call and are not part of the key. Entries are evicted least recently used first, the statistics cover one game.
+class EvaluationCache:
+    def __init__(self, evaluation_function: Callable, batch_evaluation_function: Callable = None, max_size: int = 20000):
+        self.EvaluationFunction = evaluation_function
+        self.BatchEvaluationFunction = batch_evaluation_function if batch_evaluation_function is not None else BatchEvaluationFunction(evaluation_function)
+        self.MaxSize = max_size
+        self.Entries: OrderedDict[tuple, float] = OrderedDict()
+        self.Hits = 0
+        self.Misses = 0
+        self.Evictions = 0
+        self.Lock = Lock()
+
+    def __call__(self, game_state: GameState, *args, **kwargs) -> float:
+        key = obtain_evaluation_fingerprint(game_state)
+        with self.Lock:
+            utility = self.Entries.get(key)
+            if utility is not None:
+                self.Entries.move_to_end(key)
+                self.Hits += 1
+                return utility
+
+        utility = self.EvaluationFunction(game_state, *args, **kwargs)
+        with self.Lock:
+            self.Misses += 1
+            self.Store(key, utility)
+        return utility
+
+    def Batch(self, game_states: list[GameState], *args, **kwargs) -> np.ndarray:
+        # the states missing from the cache are evaluated together by the batch evaluation function
+        keys = [obtain_evaluation_fingerprint(game_state) for game_state in game_states]
+        utilities = np.empty(len(game_states), dtype=np.float64)
+        missing = []
+        with self.Lock:
+            for i, key in enumerate(keys):
+                utility = self.Entries.get(key)
+                if utility is None:
+                    missing.append(i)
+                else:
+                    self.Entries.move_to_end(key)
+                    utilities[i] = utility
+            self.Hits += len(keys) - len(missing)
+        if len(missing) == 0:
+            return utilities
+
+        utilities[missing] = self.BatchEvaluationFunction([game_states[i] for i in missing], *args, **kwargs)
+        with self.Lock:
+            self.Misses += len(missing)
+            for i in missing:
+                self.Store(keys[i], float(utilities[i]))
+        return utilities
+
+    def Store(self, key: tuple, utility: float) -> None:
+        # called with the lock held
+        self.Entries[key] = utility
+        self.Entries.move_to_end(key)
+        if len(self.Entries) > self.MaxSize:
+            self.Entries.popitem(last=False)
+            self.Evictions += 1
+
+    def HitRate(self) -> float:
+        total = self.Hits + self.Misses
+        return self.Hits / total if total > 0 else 0.0
+
+    def AsDict(self) -> dict:
+        return {"evaluation_cache_hits": self.Hits, "evaluation_cache_misses": self.Misses,
+                "evaluation_cache_hit_rate": round(self.HitRate(), 4), "evaluation_cache_evictions": self.Evictions}
+
+    def Clear(self) -> None:
+        # at the end of a game: the card ids of the next one make the entries useless
+        with self.Lock:
+            self.Entries.clear()
+            self.Hits = 0
+            self.Misses = 0
+            self.Evictions = 0
+
+
+# the heuristics reading nothing but the fields obtain_evaluation_fingerprint covers; any other evaluation function
+# (one reading the tavern, the agents or the opponent's board) would be served stale utilities
+FINGERPRINTED_EVALUATION_FUNCTIONS = {utilityFunction_PrestigeAndPower, utilityFunction_MMHVR, utilityFunction_MMHVR_plain,
+                                      WeightedUtilityFunction_MMHVR, WeightedUtilityFunction_MMHVR_plain}
+
+def IsFingerprinted(evaluation_function: Callable) -> bool:
+    return isinstance(evaluation_function, CompiledEvaluator) or evaluation_function in FINGERPRINTED_EVALUATION_FUNCTIONS
+
+def MakeEvaluationCache(evaluation_function: Callable, batch_evaluation_function: Callable = None, max_size: int | None = 20000) -> EvaluationCache | None:
+    # None when disabled (max_size 0 or None) or when the fingerprint does not cover what the function reads
+    if not max_size or not IsFingerprinted(evaluation_function):
+        return None
+    return EvaluationCache(evaluation_function, batch_evaluation_function, max_size)
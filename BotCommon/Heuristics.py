@@ -1,12 +1,14 @@
 ﻿import re
+from bisect import bisect_left, insort
 from typing import Callable
 
 import numpy as np
 
-from scripts_of_tribute.board import GameState
-from scripts_of_tribute.enums import PlayerEnum
+from scripts_of_tribute.board import GameState, UniqueCard
+from scripts_of_tribute.enums import MoveEnum, PlayerEnum
+from scripts_of_tribute.move import BasicMove
 
-from HeuristicLearning.ActivationFunctions import ACTIVATION_FUNCTION_NAME_MAP
+from HeuristicLearning.ActivationFunctions import ACTIVATION_FUNCTION_NAME_MAP, SCALAR_ACTIVATION_FUNCTION_NAME_MAP, Linear
 
 def utility_boost (game_state, utility, player_id):
     if game_state.end_game_state is not None:
@@ -21,34 +23,174 @@ def utilityFunction_PrestigeAndPower(game_state, *args, **kwargs):
     utility = game_state.current_player.prestige + game_state.current_player.power
     return utility
 
-def HandStatistics(game_state: GameState, regex):
-    cards = game_state.current_player.draw_pile + game_state.current_player.hand + game_state.current_player.cooldown_pile
-    pattern = re.compile(rf"({regex}) (\d+)")
-
-    valid_card = [
-        (card, int(pattern.match(effect).group(2)))
-        for card in cards
-        for effect in card.effects
-        if pattern.match(effect)
-    ]
-    if valid_card is [] or valid_card is None:
-        print("no valid card founded")
-        return 0,0,0,0
+# Effects counted by the hand statistics, an effect string reads like "GAIN_COIN 2"
+EFFECT_AMOUNT_PATTERN = re.compile(r"(\w+) (\d+)")
+COIN_EFFECTS = frozenset({"GAIN_COIN"})
+POWER_AND_PRESTIGE_EFFECTS = frozenset({"GAIN_POWER", "GAIN_PRESTIGE"})
+
+
+# Coin and power/prestige amounts of every card, parsed from its effect strings the first time the card is seen.
+# The effects of a card only depend on its name, so the table stays valid from one game to the next.
+class CardEffectCatalog:
+    def __init__(self):
+        self.Amounts: dict[str, tuple[tuple[int, ...], tuple[int, ...]]] = {}
+
+    def Add(self, card: UniqueCard) -> tuple[tuple[int, ...], tuple[int, ...]]:
+        matches = [m for m in (EFFECT_AMOUNT_PATTERN.match(effect) for effect in card.effects) if m is not None]
+        amounts = (tuple(int(m.group(2)) for m in matches if m.group(1) in COIN_EFFECTS),
+                   tuple(int(m.group(2)) for m in matches if m.group(1) in POWER_AND_PRESTIGE_EFFECTS))
+        self.Amounts[card.name] = amounts
+        return amounts
+
+    def Lookup(self, card: UniqueCard) -> tuple[tuple[int, ...], tuple[int, ...]]:
+        amounts = self.Amounts.get(card.name)
+        return amounts if amounts is not None else self.Add(card)
+
+
+# shared by all the evaluations of the process, like SIMULATION_CACHE
+CARD_EFFECTS = CardEffectCatalog()
+
 
-    cards_sorted = sorted(valid_card, key=lambda x: x[1], reverse=True)
+def HandAmounts(game_state: GameState) -> tuple[list[int], list[int]]:
+    # coin and power/prestige amounts of the cards in draw pile, hand and cooldown pile, one pass over the piles
+    player = game_state.current_player
+    coins, power_and_prestige = [], []
+    amounts_by_name, add = CARD_EFFECTS.Amounts, CARD_EFFECTS.Add
+    for pile in (player.draw_pile, player.hand, player.cooldown_pile):
+        for card in pile:
+            amounts = amounts_by_name.get(card.name) or add(card)
+            coins += amounts[0]
+            power_and_prestige += amounts[1]
+    return coins, power_and_prestige
 
-    top_5_hand = sum(n for _, n in cards_sorted[:5])
-    bottom_5_hand = sum(n for _, n in cards_sorted[-5:])
-    average_singleCard = sum(n for _, n in cards_sorted) / len(cards_sorted) if cards_sorted else 0
+def AmountStatistics(amounts: list[int]):
+    if len(amounts) == 0:
+        return 0,0,0,0
+    # a hand holds a few dozen amounts: one sort of the plain ints in place beats two heap selections
+    amounts.sort()
+    top_5_hand = sum(amounts[-5:])
+    bottom_5_hand = sum(amounts[:5])
+    average_singleCard = sum(amounts) / len(amounts)
     average_Hand = (top_5_hand + bottom_5_hand)/ 2
 
     return top_5_hand,bottom_5_hand, average_Hand,average_singleCard
 
+# Incremental hand statistics: the sorted amounts of the piles are memoized on the GameState (like move.semantic_id)
+# and a child state derives them from its parent's when the move only moves a known card in or out of the piles.
+# Draws and reshuffles move cards between draw pile, hand and cooldown pile and leave the amounts unchanged.
+class HandFeatures:
+    __slots__ = ("Coins", "PowerAndPrestige", "CoinTotal", "PowerAndPrestigeTotal", "Cards", "Parent", "Card", "Direction")
+
+    def __init__(self, coins: list[int] | None, power_and_prestige: list[int] | None, cards: int):
+        self.Coins = coins # sorted, None until a derived state is evaluated
+        self.PowerAndPrestige = power_and_prestige # sorted, None until a derived state is evaluated
+        self.CoinTotal = sum(coins) if coins is not None else 0
+        self.PowerAndPrestigeTotal = sum(power_and_prestige) if power_and_prestige is not None else 0
+        self.Cards = cards # in draw pile, hand and cooldown pile
+        # a derived state only records the card moved from its parent: most simulated states are never evaluated
+        self.Parent: HandFeatures | None = None
+        self.Card: UniqueCard | None = None
+        self.Direction = 0
+
+    @staticmethod
+    def SortedStatistics(amounts: list[int], total: int):
+        if len(amounts) == 0:
+            return 0,0,0,0
+        top_5_hand = sum(amounts[-5:])
+        bottom_5_hand = sum(amounts[:5])
+        return top_5_hand,bottom_5_hand, (top_5_hand + bottom_5_hand)/ 2, total / len(amounts)
+
+    def Statistics(self) -> tuple:
+        if self.Coins is None:
+            self.Materialize()
+        return self.SortedStatistics(self.Coins, self.CoinTotal) + self.SortedStatistics(self.PowerAndPrestige, self.PowerAndPrestigeTotal)
+
+    def Moved(self, card: UniqueCard, direction: int) -> 'HandFeatures':
+        # the features once the card is added to the piles (direction 1) or removed from them (direction -1)
+        child = HandFeatures(None, None, self.Cards + direction)
+        coins, power_and_prestige = CARD_EFFECTS.Lookup(card)
+        child.CoinTotal = self.CoinTotal + direction * sum(coins)
+        child.PowerAndPrestigeTotal = self.PowerAndPrestigeTotal + direction * sum(power_and_prestige)
+        child.Parent, child.Card, child.Direction = self, card, direction
+        return child
+
+    def Materialize(self) -> None:
+        # replays the moved cards from the nearest evaluated ancestor, no pass over the piles
+        moves = []
+        ancestor = self
+        while ancestor.Coins is None:
+            moves.append((ancestor.Card, ancestor.Direction))
+            ancestor = ancestor.Parent
+        coins, power_and_prestige = list(ancestor.Coins), list(ancestor.PowerAndPrestige)
+        for card, direction in reversed(moves):
+            card_coins, card_power_and_prestige = CARD_EFFECTS.Lookup(card)
+            MoveAmounts(coins, card_coins, direction)
+            MoveAmounts(power_and_prestige, card_power_and_prestige, direction)
+        self.Coins, self.PowerAndPrestige = coins, power_and_prestige
+        self.Parent = self.Card = None
+
+def MoveAmounts(amounts: list[int], card_amounts: tuple[int, ...], direction: int) -> None:
+    for amount in card_amounts:
+        if direction > 0:
+            insort(amounts, amount)
+        else:
+            del amounts[bisect_left(amounts, amount)]
+
+def PileCount(game_state: GameState) -> int:
+    player = game_state.current_player
+    return len(player.draw_pile) + len(player.hand) + len(player.cooldown_pile)
+
+def HandFeaturesOf(game_state: GameState) -> HandFeatures:
+    try:
+        return game_state.hand_features
+    except AttributeError:
+        coins, power_and_prestige = HandAmounts(game_state)
+        coins.sort()
+        power_and_prestige.sort()
+        game_state.hand_features = HandFeatures(coins, power_and_prestige, PileCount(game_state))
+        return game_state.hand_features
+
+def DeriveHandFeatures(parent_state: GameState, move: BasicMove, child_state: GameState) -> bool:
+    # True when the child's hand features are known without a pass over its piles: playing a card takes it out of
+    # the hand, buying one brings it from the tavern into the piles. Any other move, or pile sizes telling that an
+    # effect created, destroyed or moved other cards, leaves the child to a full recomputation when it is evaluated
+    if getattr(child_state, "hand_features", None) is not None:
+        return True
+    if move.command == MoveEnum.PLAY_CARD:
+        pile, direction = parent_state.current_player.hand, -1
+    elif move.command == MoveEnum.BUY_CARD:
+        pile, direction = parent_state.tavern_available_cards, 1
+    else:
+        return False
+    if child_state.current_player.player_id != parent_state.current_player.player_id:
+        return False
+    for card in pile:
+        if card.unique_id == move.cardUniqueId:
+            break
+    else:
+        return False
+    parent_features = HandFeaturesOf(parent_state)
+    if PileCount(child_state) != parent_features.Cards + direction:
+        return False
+    child_state.hand_features = parent_features.Moved(card, direction)
+    return True
+
+def CarryHandFeatures(parent_state: GameState, move: BasicMove, child_state: GameState) -> None:
+    # called on every simulated move: the features follow the states of a turn once its first state has them,
+    # see PrimeHandFeatures; nothing is computed for the bots whose evaluation does not read them
+    if getattr(parent_state, "hand_features", None) is not None:
+        DeriveHandFeatures(parent_state, move, child_state)
+
+def PrimeHandFeatures(game_state: GameState, evaluation_function: Callable) -> None:
+    # the state a bot is asked to play from starts the chain when its evaluation reads the MMHVR hand statistics
+    if UsesHandFeatures(evaluation_function):
+        HandFeaturesOf(game_state)
+
 def CalculateMaxMinAverageCoin(game_state: GameState):
-    return HandStatistics(game_state,"GAIN_COIN")
+    return AmountStatistics(HandAmounts(game_state)[0])
 
 def CalculateMaxMinAveragePowerAndPrestige( game_state: GameState):
-    return HandStatistics(game_state, "GAIN_POWER|GAIN_PRESTIGE")
+    return AmountStatistics(HandAmounts(game_state)[1])
 
 def CalculateFavor(game_state:GameState, player_id):
     patron_favor = game_state.patron_states.patrons.items()
@@ -67,38 +209,44 @@ def CalculateCoinLeft(game_state: GameState):
 
 
 #MINMAX HAND VALUE RATING
-def MMHVR_plain_values(game_state: GameState) ->np.ndarray:
-        top_hand_coin,bottom_hand_coin, average_Hand_coin, average_singleCard_coin = CalculateMaxMinAverageCoin(game_state)
-        top_hand_PEP,bottom_hand_PEP, average_Hand_PEP, average_singleCard_PEP = CalculateMaxMinAveragePowerAndPrestige(game_state)
+MMHVR_DIMENSION = 13
+
+def MMHVR_plain_features(game_state: GameState) -> list:
+        (top_hand_coin,bottom_hand_coin, average_Hand_coin, average_singleCard_coin,
+         top_hand_PEP,bottom_hand_PEP, average_Hand_PEP, average_singleCard_PEP) = HandFeaturesOf(game_state).Statistics()
         favor     = CalculateFavor(game_state, game_state.current_player.player_id)
         coin_left = CalculateCoinLeft(game_state)
         prestige  = game_state.current_player.prestige
         power     = game_state.current_player.power
 
-
-        param   = np.array([top_hand_coin,bottom_hand_coin, average_Hand_coin, average_singleCard_coin,
-                            top_hand_PEP,bottom_hand_PEP, average_Hand_PEP, average_singleCard_PEP,
-                            prestige, power,
-                            favor, coin_left, game_state.enemy_player.prestige])
-
+        return [top_hand_coin,bottom_hand_coin, average_Hand_coin, average_singleCard_coin,
+                top_hand_PEP,bottom_hand_PEP, average_Hand_PEP, average_singleCard_PEP,
+                prestige, power,
+                favor, coin_left, game_state.enemy_player.prestige]
+
+def MMHVR_transform(values: np.ndarray) -> np.ndarray:
+        # the MMHVR shaping of the plain features, on one feature vector or on an (N, 13) matrix
+        param = np.array(values, dtype=np.float64)
+        param[..., 0]  = np.log(param[..., 0])
+        param[..., 4]  = param[..., 4]**1.3
+        param[..., 10] = np.sign(param[..., 10]) * param[..., 10]**2
+        param[..., 11] = -param[..., 11]
+        param[..., 12] = -param[..., 12]**1.1
         return param
 
+def MMHVR_plain_values(game_state: GameState) ->np.ndarray:
+        return np.array(MMHVR_plain_features(game_state), dtype=np.float64)
+
 #MINMAX HAND VALUE RATING
 def MMHVR_values(game_state: GameState ) ->np.ndarray:
-        top_hand_coin,bottom_hand_coin, average_Hand_coin, average_singleCard_coin = CalculateMaxMinAverageCoin(game_state)
-        top_hand_PEP,bottom_hand_PEP, average_Hand_PEP, average_singleCard_PEP = CalculateMaxMinAveragePowerAndPrestige(game_state)
-        favor     = CalculateFavor(game_state, game_state.current_player.player_id)
-        coin_left = CalculateCoinLeft(game_state)
-        prestige  = game_state.current_player.prestige
-        power     = game_state.current_player.power
-
+        return MMHVR_transform(MMHVR_plain_features(game_state))
 
-        param   = np.array([np.log(top_hand_coin),bottom_hand_coin, average_Hand_coin, average_singleCard_coin,
-                            top_hand_PEP**1.3,bottom_hand_PEP, average_Hand_PEP, average_singleCard_PEP,
-                            prestige, power,
-                            np.sign(favor) * favor**2, -coin_left, -game_state.enemy_player.prestige**1.1])
+def MMHVR_plain_matrix(game_states: list[GameState]) -> np.ndarray:
+        # (N, 13) feature matrix, one row per state
+        return np.array([MMHVR_plain_features(game_state) for game_state in game_states], dtype=np.float64).reshape(-1, MMHVR_DIMENSION)
 
-        return param
+def MMHVR_matrix(game_states: list[GameState]) -> np.ndarray:
+        return MMHVR_transform(MMHVR_plain_matrix(game_states))
 
 def utilityFunction_MMHVR(game_state: GameState, *args, **kwargs):
     return np.sum(MMHVR_values(game_state))
@@ -109,18 +257,34 @@ def utilityFunction_MMHVR_plain(game_state: GameState, *args, **kwargs):
 
 
 GameStateEvaluator = Callable[[GameState], np.ndarray]
+GameStatesEvaluator = Callable[[list[GameState]], np.ndarray]
 
-def CalculateWeightedUtility(utility_function:GameStateEvaluator, game_state: GameState, weights:np.ndarray = None, functions =None) -> float:
-
-    param =  utility_function(game_state)
-    param_dimension = param.shape[0]
+def ActivationGroups(functions: list[str]) -> list[tuple[Callable, np.ndarray]]:
+    # the dimensions sharing an activation function, so that it is applied once per group
+    groups: dict[str, list[int]] = {}
+    for i, name in enumerate(functions):
+        groups.setdefault(name, []).append(i)
+    return [(ACTIVATION_FUNCTION_NAME_MAP[name], np.array(dimensions)) for name, dimensions in groups.items()]
 
+def WeightAndActivate(param: np.ndarray, weights:np.ndarray = None, functions =None) -> np.ndarray:
+    # one feature vector or an (N, 13) matrix, the weights and activations apply along the last axis
     weighted_values = weights * param if weights is not None  else param
     if functions is not None:
-        for i in range(param_dimension):
-            act_fun =  ACTIVATION_FUNCTION_NAME_MAP[functions[i]]
-            weighted_values[i] = act_fun(weighted_values[i])
-    return float(np.sum(weighted_values))
+        for act_fun, dimensions in ActivationGroups(functions):
+            weighted_values[..., dimensions] = act_fun(weighted_values[..., dimensions])
+    return weighted_values
+
+def CalculateWeightedUtility(utility_function:GameStateEvaluator, game_state: GameState, weights:np.ndarray = None, functions =None) -> float:
+    return float(np.sum(WeightAndActivate(utility_function(game_state), weights, functions)))
+
+def CalculateWeightedUtilities(matrix_function:GameStatesEvaluator, game_states: list[GameState], weights:np.ndarray = None, functions =None) -> np.ndarray:
+    return WeightAndActivate(matrix_function(game_states), weights, functions).sum(axis=1)
+
+def BoostUtilities(game_states: list[GameState], utilities: np.ndarray, player_id) -> np.ndarray:
+    for i, game_state in enumerate(game_states):
+        if game_state.end_game_state is not None:
+            utilities[i] = utility_boost(game_state, utilities[i], player_id)
+    return utilities
 
 
 GameStateEvaluatorUtility = Callable[[GameState,], float]
@@ -141,4 +305,100 @@ def WeightedUtilityFunction_MMHVR_plain(game_state: GameState, weights:np.ndarra
     if player_id is not None:
         utility = utility_boost(game_state, utility, player_id)
 
-    return utility
\ No newline at end of file
+    return utility
+
+
+#=========================Batched evaluation========================
+# the same evaluation functions over a list of states, returning one utility per state:
+# the features of all the states are stacked in one matrix and weighted, activated and summed with vectorized ops
+GameStatesEvaluatorUtility = Callable[[list[GameState],], np.ndarray]
+
+def utilityFunction_PrestigeAndPower_batch(game_states: list[GameState], *args, **kwargs) -> np.ndarray:
+    return np.fromiter((gs.current_player.prestige + gs.current_player.power for gs in game_states), dtype=np.float64, count=len(game_states))
+
+def utilityFunction_MMHVR_batch(game_states: list[GameState], *args, **kwargs) -> np.ndarray:
+    return MMHVR_matrix(game_states).sum(axis=1)
+
+def utilityFunction_MMHVR_plain_batch(game_states: list[GameState], *args, **kwargs) -> np.ndarray:
+    return MMHVR_plain_matrix(game_states).sum(axis=1)
+
+def WeightedUtilityFunction_MMHVR_batch(game_states: list[GameState], weights:np.ndarray = None, functions =None, player_id = None, *args, **kwargs) -> np.ndarray:
+    utilities = CalculateWeightedUtilities(MMHVR_matrix, game_states, weights, functions)
+    return BoostUtilities(game_states, utilities, player_id) if player_id is not None else utilities
+
+def WeightedUtilityFunction_MMHVR_plain_batch(game_states: list[GameState], weights:np.ndarray = None, functions =None, player_id = None, *args, **kwargs) -> np.ndarray:
+    utilities = CalculateWeightedUtilities(MMHVR_plain_matrix, game_states, weights, functions)
+    return BoostUtilities(game_states, utilities, player_id) if player_id is not None else utilities
+
+
+BATCH_EVALUATION_FUNCTIONS: dict[Callable, GameStatesEvaluatorUtility] = {
+    utilityFunction_PrestigeAndPower:    utilityFunction_PrestigeAndPower_batch,
+    utilityFunction_MMHVR:               utilityFunction_MMHVR_batch,
+    utilityFunction_MMHVR_plain:         utilityFunction_MMHVR_plain_batch,
+    WeightedUtilityFunction_MMHVR:       WeightedUtilityFunction_MMHVR_batch,
+    WeightedUtilityFunction_MMHVR_plain: WeightedUtilityFunction_MMHVR_plain_batch,
+}
+
+# the evaluation functions reading the hand statistics, see HandFeatures
+HAND_FEATURES_EVALUATION_FUNCTIONS = {utilityFunction_MMHVR, utilityFunction_MMHVR_plain, WeightedUtilityFunction_MMHVR, WeightedUtilityFunction_MMHVR_plain}
+
+def UsesHandFeatures(evaluation_function: Callable) -> bool:
+    return isinstance(evaluation_function, CompiledEvaluator) or evaluation_function in HAND_FEATURES_EVALUATION_FUNCTIONS
+
+def BatchEvaluationFunction(evaluation_function: Callable) -> GameStatesEvaluatorUtility:
+    # the batched counterpart of an evaluation function, other functions are applied state by state
+    if isinstance(evaluation_function, CompiledEvaluator):
+        return evaluation_function.Batch
+    batch_evaluation_function = BATCH_EVALUATION_FUNCTIONS.get(evaluation_function)
+    if batch_evaluation_function is not None:
+        return batch_evaluation_function
+
+    def state_by_state(game_states: list[GameState], *args, **kwargs) -> np.ndarray:
+        return np.fromiter((evaluation_function(gs, *args, **kwargs) for gs in game_states), dtype=np.float64, count=len(game_states))
+    return state_by_state
+
+
+#=========================Compiled evaluation========================
+# WeightedUtilityFunction_MMHVR(_plain) with its weights and activations fixed for the whole game, e.g. an evolved
+# Individual: the dimensions are grouped by activation once and the linear ones fold into a single weight vector.
+# A single state is scored on plain floats, (weight, dimension, activation) terms precomputed; a batch on the matrix.
+class CompiledEvaluator:
+    def __init__(self, weights: np.ndarray = None, functions: list[str] = None, plain: bool = True):
+        weights = np.ones(MMHVR_DIMENSION) if weights is None else np.asarray(weights, dtype=np.float64)
+        functions = functions if functions is not None else ["linear"] * MMHVR_DIMENSION
+        self.Plain = plain
+        self.LinearWeights = np.zeros(MMHVR_DIMENSION)
+        self.Groups: list[tuple[Callable, np.ndarray, np.ndarray]] = [] # activation, dimensions, their weights
+        self.LinearTerms: list[tuple[float, int]] = [] # weight, dimension
+        self.ActivatedTerms: list[tuple[float, int, Callable]] = [] # weight, dimension, scalar activation
+        for act_fun, dimensions in ActivationGroups(functions):
+            if act_fun is Linear:
+                self.LinearWeights[dimensions] = weights[dimensions]
+                self.LinearTerms += [(float(weights[i]), i) for i in dimensions.tolist()]
+            else:
+                self.Groups.append((act_fun, dimensions, weights[dimensions]))
+                self.ActivatedTerms += [(float(weights[i]), i, SCALAR_ACTIVATION_FUNCTION_NAME_MAP[functions[i]]) for i in dimensions.tolist()]
+
+    def Evaluate(self, game_state: GameState, player_id = None) -> float:
+        param = MMHVR_plain_features(game_state) if self.Plain else MMHVR_values(game_state).tolist()
+        utility = 0.0
+        for weight, i in self.LinearTerms:
+            utility += weight * param[i]
+        for weight, i, act_fun in self.ActivatedTerms:
+            utility += act_fun(weight * param[i])
+        return utility_boost(game_state, utility, player_id) if player_id is not None else utility
+
+    def EvaluateBatch(self, game_states: list[GameState], player_id = None) -> np.ndarray:
+        param = MMHVR_plain_matrix(game_states) if self.Plain else MMHVR_matrix(game_states)
+        utilities = param @ self.LinearWeights
+        for act_fun, dimensions, weights in self.Groups:
+            utilities += act_fun(param[:, dimensions] * weights).sum(axis=1)
+        return BoostUtilities(game_states, utilities, player_id) if player_id is not None else utilities
+
+    # the signatures of the evaluation functions, the bots take the evaluator in their place;
+    # the weights and functions they pass along are already compiled in and ignored
+    def __call__(self, game_state: GameState, weights:np.ndarray = None, functions =None, player_id = None, *args, **kwargs) -> float:
+        return self.Evaluate(game_state, player_id)
+
+    def Batch(self, game_states: list[GameState], weights:np.ndarray = None, functions =None, player_id = None, *args, **kwargs) -> np.ndarray:
+        return self.EvaluateBatch(game_states, player_id)
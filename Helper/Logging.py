@@ -1,9 +1,10 @@
 ﻿from datetime import datetime
+import json
 import os
 
 from scripts_of_tribute.board import EndGameState, GameState
 
-from Helper import LOG_FOLDER_NAME, LOG_ENABLED_FILE, LOG_ENABLED_PRINT
+from Helper import LOG_FOLDER_NAME, LOG_ENABLED_FILE, LOG_ENABLED_PRINT, METRICS_FOLDER_NAME, METRICS_ENABLED_FILE
 
 
 def LogEndOfGame(bot_name:str, end_game_state: EndGameState, final_state: GameState):
@@ -30,6 +31,21 @@ def LogEndOfGame(bot_name:str, end_game_state: EndGameState, final_state: GameSt
 
     except Exception as e:
         PrintLog("ERROR",f"Failed to save game log: {e}",0)
+
+
+def LogSearchMetrics(bot_name: str, record: dict):
+    # appended to metrics/<bot_name>.jsonl, one line per game, to compare the searches across bot versions
+    if not METRICS_ENABLED_FILE:
+        return
+    os.makedirs(METRICS_FOLDER_NAME, exist_ok=True)
+    filepath = os.path.join(METRICS_FOLDER_NAME, f"{bot_name}.jsonl")
+    record = {"bot": bot_name, "time": datetime.now().isoformat(timespec="seconds"), **record}
+
+    try:
+        with open(filepath, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    except Exception as e:
+        PrintLog("ERROR",f"Failed to save search metrics: {e}",0)
         
         
         
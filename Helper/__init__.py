@@ -4,3 +4,6 @@ LOG_FOLDER_NAME = "logs"
 LOG_ENABLED_FILE = False
 LOG_ENABLED_PRINT = False
 
+METRICS_FOLDER_NAME = "metrics"
+METRICS_ENABLED_FILE = False # one json line per game and bot, see LogSearchMetrics
+
@@ -1,3 +1,5 @@
+import math
+
 import numpy as np
 
 def Linear(x: np.ndarray) -> np.ndarray:
@@ -30,3 +32,21 @@ ACTIVATION_FUNCTION_NAME_MAP = {
 }
 
 ACTIVATION_NAMES = list(ACTIVATION_FUNCTION_NAME_MAP.keys())
+
+# the same functions on a single float, where the numpy calls would cost more than the math (see CompiledEvaluator)
+def SigmoidScalar(x: float) -> float:
+    return 1 / (1 + math.exp(-x)) if x > -700 else 0.0
+
+def LeakyReLUScalar(x: float, alpha: float = 0.01) -> float:
+    return x if x > 0 else alpha * x
+
+def ELUScalar(x: float, alpha: float = 1.0) -> float:
+    return x if x > 0 else alpha * (math.exp(x) - 1)
+
+SCALAR_ACTIVATION_FUNCTION_NAME_MAP = {
+    "linear": Linear,
+    "tanh": math.tanh,
+    "sigmoid": SigmoidScalar,
+    "leaky_relu": LeakyReLUScalar,
+    "elu": ELUScalar,
+}
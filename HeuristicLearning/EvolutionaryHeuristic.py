@@ -7,7 +7,7 @@ from typing import Callable, List
 import numpy as np
 from tqdm import tqdm
 
-from BotCommon.Heuristics import utilityFunction_MMHVR_plain
+from BotCommon.Heuristics import CompiledEvaluator, utilityFunction_MMHVR_plain
 from Helper.GameManager import RunGames
 from HeuristicLearning import CHECK_POINTS_PATH, INDIVIDUALS_PATH, RESULTS_PATH
 from HeuristicLearning.ActivationFunctions import ACTIVATION_NAMES, Linear
@@ -22,6 +22,10 @@ class Individual:
         self.NumOfGames = 0
         self.ID = random.getrandbits(128)
 
+    def Compile(self, plain: bool = True) -> CompiledEvaluator:
+        # the evaluation function of this individual, to pass to the bots in place of WeightedUtilityFunction_MMHVR(_plain)
+        return CompiledEvaluator(self.weights, self.activations, plain)
+
     # ===========================IO======================
     def save(self, filename: str, version: int) -> None:
         filename = os.path.join(INDIVIDUALS_PATH, filename)
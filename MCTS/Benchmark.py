@@ -0,0 +1,88 @@
+import random
+import timeit
+
+import numpy as np
+
+from MCTS.MCTSNode import MCTSNode, Backpropagate, BackpropagatePath, BackpropagatePaths, SelectChild
+
+
+# Micro-benchmarks of the tree bookkeeping, they do not need the engine: python -m MCTS.Benchmark
+
+def BuildChain(depth: int) -> list[MCTSNode]:
+    # a single turn chain root -> ... -> leaf, like a sequence of card plays
+    path = [MCTSNode(None, None)]
+    for _ in range(depth):
+        path.append(MCTSNode(path[-1], None))
+    return path
+
+def RecursiveBackpropagate(node: MCTSNode, utilityValue: float) -> None:
+    # the per-ancestor recursion used before BackpropagatePath, kept as the baseline
+    node.NumberOfVisits += 1
+    node.AverageUtility += (utilityValue - node.AverageUtility) / node.NumberOfVisits
+    node.MaxUtility = utilityValue if utilityValue > node.MaxUtility else node.MaxUtility
+    node.TotalUtility += utilityValue
+    if node.ParentNode is not None:
+        RecursiveBackpropagate(node.ParentNode, utilityValue)
+
+def BuildStar(children: int, rng: random.Random) -> MCTSNode:
+    # a root with visited children, the statistics spread like after a few hundred iterations
+    root = MCTSNode(None, None)
+    for _ in range(children):
+        child = MCTSNode(root, None)
+        root.AddChild(child)
+        child.NumberOfVisits = rng.randint(1, 50)
+        child.TotalUtility = child.NumberOfVisits * rng.uniform(-1, 1)
+        root.NumberOfVisits += child.NumberOfVisits
+    return root
+
+def NumpyScalarUcb(total_utility: float, number_of_visit: int, parents_number_of_visit: int, c: float = np.sqrt(2)) -> float:
+    # calculate_ucb before it moved to math on Python floats
+    if number_of_visit == 0 or parents_number_of_visit == 0:
+        return float('inf')
+    return total_utility / number_of_visit + c * np.sqrt(np.log(parents_number_of_visit) / number_of_visit)
+
+def PerChildSelectChild(children: list[MCTSNode]) -> MCTSNode:
+    # the UCB1 of every child computed one by one, used before the vectorized SelectChild, kept as the baseline
+    parent_visits = children[0].ParentNode.NumberOfVisits
+    ucb1s = {child: NumpyScalarUcb(child.TotalUtility, child.NumberOfVisits, parent_visits) for child in children}
+    max_val = max(ucb1s.values())
+    return random.choice([c for c, v in ucb1s.items() if v == max_val])
+
+def BenchmarkSelection(children: int = 50, number: int = 2000) -> dict[str, float]:
+    root = BuildStar(children, random.Random(children))
+    if PerChildSelectChild(root.Children) is not SelectChild(root.Children, root):
+        raise ValueError("the vectorized selection differs from the baseline")
+    results = {
+        "per child": timeit.timeit(lambda: PerChildSelectChild(root.Children), number=number),
+        "vectorized": timeit.timeit(lambda: SelectChild(root.Children, root), number=number),
+    }
+    return {name: seconds / number * 1e6 for name, seconds in results.items()} # microseconds per call
+
+def BenchmarkBackpropagation(depth: int = 20, batch_size: int = 8, number: int = 2000) -> dict[str, float]:
+    path = BuildChain(depth)
+    leaf = path[-1]
+    # batch_size leaves hanging from the same chain, as produced by a leaf parallel iteration
+    leaves = [MCTSNode(path[-2], None) for _ in range(batch_size)]
+    utilities = [random.random() for _ in range(batch_size)]
+
+    def one_by_one(backpropagate):
+        for node, utilityValue in zip(leaves, utilities):
+            backpropagate(node, utilityValue)
+
+    results = {
+        "recursive": timeit.timeit(lambda: RecursiveBackpropagate(leaf, 0.5), number=number),
+        "iterative": timeit.timeit(lambda: Backpropagate(leaf, 0.5), number=number),
+        "path": timeit.timeit(lambda: BackpropagatePath(path, 0.5), number=number),
+        f"recursive x{batch_size}": timeit.timeit(lambda: one_by_one(RecursiveBackpropagate), number=number),
+        f"batched x{batch_size}": timeit.timeit(lambda: BackpropagatePaths([(path[:-1] + [node], [u]) for node, u in zip(leaves, utilities)]), number=number),
+    }
+    return {name: seconds / number * 1e6 for name, seconds in results.items()} # microseconds per call
+
+
+if __name__ == "__main__":
+    for children in [10, 50, 200]:
+        timings = BenchmarkSelection(children)
+        print(f"{children:3d} children: " + ", ".join(f"{name} {us:.1f}us" for name, us in timings.items()))
+    for depth in [5, 20, 60]:
+        timings = BenchmarkBackpropagation(depth)
+        print(f"depth {depth:3d}: " + ", ".join(f"{name} {us:.1f}us" for name, us in timings.items()))
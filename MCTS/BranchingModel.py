@@ -0,0 +1,85 @@
+import os
+from threading import Lock
+
+import numpy as np
+from scripts_of_tribute.board import GameState
+from scripts_of_tribute.move import BasicMove
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BRANCHING_MODEL_PATH = os.path.join(BASE_DIR, "Models", "branching_model.npz")
+
+
+def TotalFactor(b: list[int]) -> float:
+    # 1 + 1/b0 + 1/(b0*b1) + ... : how many decisions of the turn share the remaining time, weighted by their subtree
+    factor = 1
+    total_factor = 1
+    for i in range(len(b) - 1):
+        factor /= b[i]
+        total_factor += factor
+    return total_factor
+
+
+# Learned model of how the rest of a turn branches, used to split the time budget without simulating the turn.
+# Samples are the branching sequences of the playouts (and of the turns actually played), aggregated by the
+# features of the state they start from; a coarser key on the number of moves alone backs off the exact one.
+class BranchingModel:
+    def __init__(self, path: str = BRANCHING_MODEL_PATH, min_samples: int = 3):
+        self.Path = path
+        self.MinSamples = min_samples
+        self.Stats: dict[tuple, np.ndarray] = {} # features -> [samples, sum of total factor, sum of depth]
+        self.Lock = Lock()
+        self.Loaded = False
+
+    @staticmethod
+    def Features(game_state: GameState, possible_moves: list[BasicMove]) -> tuple[int, int, int]:
+        player = game_state.current_player
+        return len(player.hand), min(player.coins, 12), min(len(possible_moves) - 1, 20)
+
+    @staticmethod
+    def CoarseFeatures(features: tuple[int, int, int]) -> tuple[int, int, int]:
+        return -1, -1, features[2]
+
+    def Update(self, features: tuple[int, int, int], b: list[int]) -> None:
+        if len(b) == 0:
+            return
+        sample = np.array([1.0, TotalFactor(b), len(b)])
+        with self.Lock:
+            for key in (features, self.CoarseFeatures(features)):
+                stats = self.Stats.get(key)
+                if stats is None:
+                    self.Stats[key] = sample.copy()
+                else:
+                    stats += sample
+
+    def Observe(self, game_state: GameState, possible_moves: list[BasicMove], b: list[int]) -> None:
+        self.Update(self.Features(game_state, possible_moves), b)
+
+    def Predict(self, features: tuple[int, int, int]) -> tuple[float, float] | None:
+        # (expected total factor, expected number of decisions left in the turn), None when nothing was learned yet
+        for key, min_samples in ((features, self.MinSamples), (self.CoarseFeatures(features), 1)):
+            stats = self.Stats.get(key)
+            if stats is not None and stats[0] >= min_samples:
+                return float(stats[1] / stats[0]), float(stats[2] / stats[0])
+        return None
+
+    # =========================IO========================
+    def Save(self) -> None:
+        os.makedirs(os.path.dirname(self.Path), exist_ok=True)
+        with self.Lock:
+            keys = np.array(list(self.Stats.keys()), dtype=np.int64).reshape(-1, 3)
+            stats = np.array(list(self.Stats.values()), dtype=np.float64).reshape(-1, 3)
+        np.savez(self.Path, keys=keys, stats=stats)
+
+    def Load(self) -> bool:
+        # once per process, the bots of a match share the model
+        if self.Loaded or not os.path.isfile(self.Path):
+            return False
+        self.Loaded = True
+        data = np.load(self.Path)
+        with self.Lock:
+            self.Stats = {tuple(int(v) for v in key): stats.copy() for key, stats in zip(data["keys"], data["stats"])}
+        return True
+
+
+# shared by all the searches and bots of the process, like SIMULATION_CACHE
+BRANCHING_MODEL = BranchingModel()
@@ -1,3 +1,4 @@
+import math
 import time
 
 import numpy as np
@@ -6,16 +7,19 @@ from scripts_of_tribute.board import GameState
 from scripts_of_tribute.move import BasicMove
 from scripts_of_tribute.enums import MoveEnum
 from BotCommon.CommonCheck import CheckForGoalState
+from MCTS.BranchingModel import BRANCHING_MODEL, BranchingModel, TotalFactor
+from MCTS.SimulationCache import CachedApplyMove
 
 
-def calculate_ucb(total_utility:float, number_of_visit:int, parents_number_of_visit:int, c:float = np.sqrt(2)) -> float:
+def calculate_ucb(total_utility:float, number_of_visit:int, parents_number_of_visit:int, c:float = math.sqrt(2)) -> float:
     if number_of_visit == 0 or parents_number_of_visit == 0:
         return float('inf') # If no playouts, return infinity to encourage exploration on never seen nodes
 
+    # math on Python floats, np.log/np.sqrt on scalars are much slower
     exploitation_term = total_utility / number_of_visit
-    exploration_term = np.log(parents_number_of_visit) / number_of_visit
+    exploration_term = math.log(parents_number_of_visit) / number_of_visit
 
-    return exploitation_term + c * np.sqrt(exploration_term)
+    return exploitation_term + c * math.sqrt(exploration_term)
 
 
 def deterministic_test(game_state: GameState, parent_move: BasicMove):
@@ -33,52 +37,73 @@ def deterministic_test(game_state: GameState, parent_move: BasicMove):
         if len(ps2) != len(ps21):
             pass
 
-def playout(move: BasicMove, game_state: GameState, player_id, b = None) -> GameState:
+def playout(move: BasicMove, game_state: GameState, player_id, b = None, max_depth: int | None = None, policy = None, observe: bool = True) -> GameState:
+    # the branching met along the playout is a sample for the BranchingModel, keyed by the first state reached;
+    # observe False leaves it to the caller, give_time records the same playout from the turn's own state
+    # with max_depth the playout is truncated after that many random moves, the caller scores the state reached
+    first_state, first_moves, branching = None, None, []
+    truncated = False
+    successor = None # the state the policy reached with the move, played instead of simulating the move again
     while not (CheckForGoalState(game_state, player_id) or move.command == MoveEnum.END_TURN):
+        if max_depth is not None and first_state is not None and len(branching) >= max_depth: # the tree move is always applied
+            truncated = True
+            break
         try:
-            game_state, possible_moves = game_state.apply_move(move)
+            game_state, possible_moves = successor if successor is not None else CachedApplyMove(game_state, move)
+            successor = None
         except Exception as e:
             print(e)
             raise ValueError ("problems with apply_move")
+        if first_state is None:
+            first_state, first_moves = game_state, possible_moves
         if len(possible_moves) == 1:
             move = possible_moves[0]
             continue
-        if b is not None:
-            b.append(len(possible_moves)-1)
+        branching.append(len(possible_moves)-1)
 
-        move = random.choice([m for m in possible_moves if m.command != MoveEnum.END_TURN])
+        if policy is None:
+            move = random.choice([m for m in possible_moves if m.command != MoveEnum.END_TURN])
+        else: # informed playouts, see PlayoutPolicy
+            move, successor = policy(game_state, possible_moves, random)
+
+    if b is not None:
+        b += branching
+    if observe and first_state is not None and len(first_moves) > 1 and not truncated:
+        BRANCHING_MODEL.Observe(first_state, first_moves, branching)
     return game_state
 
 
-def calculate_time_to_give(b: list[int], remaining_time: int) -> int:
-    n = len(b)
-    if n < 1:
-        raise ValueError("b must have at least one element in calculate_time_to_give")
+def playout_cutoff(playout_depth: int | None, adaptive: bool, start_time: float, given_time_ms: int) -> int | None:
+    # None plays until END_TURN; adaptive scales the cutoff with the share of the budget left, so late iterations are cheaper
+    if playout_depth is None or not adaptive:
+        return playout_depth
+    remaining_share = 1 - (time.perf_counter() - start_time) * 1000 / given_time_ms
+    return max(1, round(playout_depth * remaining_share))
 
-    factor = 1
-    total_factor = 1
-    for i in range(n - 1):
-        factor /= b[i]
-        total_factor += factor
 
-    return int(remaining_time / total_factor)
+def calculate_time_to_give(b: list[int], remaining_time: int) -> int:
+    if len(b) < 1:
+        raise ValueError("b must have at least one element in calculate_time_to_give")
+    return int(remaining_time / TotalFactor(b))
 
 def give_time(game_state: GameState, possible_moves:list[BasicMove], remaining_time: int, player_id) -> int:
     start = time.perf_counter()
     if len(possible_moves) <= 1:
         raise ValueError("b must have at least two elements in give_time")
 
-    time_to_give = []
-    for move in possible_moves:
-        if move.command == MoveEnum.END_TURN:
-            continue
+    features = BranchingModel.Features(game_state, possible_moves)
+    prediction = BRANCHING_MODEL.Predict(features)
+    if prediction is not None:
+        total_factor, _ = prediction
+    else:
+        # nothing learned for this kind of turn yet: a single playout instead of one per move
+        moves = [m for m in possible_moves if m.command != MoveEnum.END_TURN]
+        if len(moves) == 0:
+            raise ValueError("No valid moves found to allocate time to.")
         b: list[int] = [len(possible_moves)-1] # minus 1 for the end-of-turn move
-        playout(move, game_state, player_id, b)
-        t_0 = calculate_time_to_give(b, remaining_time)
-        time_to_give.append(t_0)
+        playout(random.choice(moves), game_state, player_id, b, observe=False) # recorded once, below
+        BRANCHING_MODEL.Update(features, b)
+        total_factor = TotalFactor(b)
 
     execution_time_ms = (time.perf_counter() - start) * 1000
-    if len(time_to_give) == 0:
-        raise ValueError("No valid moves found to allocate time to.")
-
-    return min(time_to_give) - int(execution_time_ms)
\ No newline at end of file
+    return int(remaining_time / total_factor) - int(execution_time_ms)
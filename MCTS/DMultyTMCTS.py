@@ -1,5 +1,6 @@
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
 
 import numpy as np
@@ -7,11 +8,18 @@ from scripts_of_tribute.board import GameState
 from scripts_of_tribute.move import BasicMove
 
 from Helper.Logging import PrintLog
-from MCTS.MCTSNode import MCTSNode, Backpropagate, Playout, SelectChild
+from MCTS.Common import playout_cutoff
+from MCTS.MCTSNode import MCTSNode, EnforceMemoryBudget, BackpropagatePath, ExpandNodes, Playout, SelectChild
+from MCTS.SearchMetrics import SearchMetrics
+from MCTS.StoppingRule import StoppingRule
 
 # Determinized multy Tree MCTS
 class DMultyTCTS:
-    def __init__(self, game_state: GameState, possible_moves: list[BasicMove], eval_function : Callable, tree_count:int= 5, tree_seeds:list[int]=None):
+    def __init__(self, game_state: GameState, possible_moves: list[BasicMove], eval_function : Callable, tree_count:int= 5, tree_seeds:list[int]=None, root_nodes:list[MCTSNode | None]=None,
+                 root_parallel: bool = False, max_workers: int = None, stopping_rule: StoppingRule = None,
+                 playout_depth: int | None = None, adaptive_playout_depth: bool = False,
+                 playout_policy: Callable = None, max_nodes: int | None = None, max_states: int | None = None,
+                 expansion_workers: int = 0):
         self.EvaluationFunction = eval_function
         self.PossibleMoves = possible_moves
         self.GameState = game_state
@@ -21,6 +29,32 @@ class DMultyTCTS:
         if len (self.TreeSeeds) < tree_count: # fill in random seeds if not enough provided
             self.TreeSeeds += [random.randint(0, 2**30) for _ in range(tree_count - len(self.TreeSeeds))]
 
+        # every tree draws its expansions and playouts from its own generator: the trees searched in parallel
+        # would otherwise race on the global one, and reseeding it per playout would correlate them
+        self.TreeRngs = [random.Random(seed) for seed in self.TreeSeeds]
+
+        # subtrees kept from a previous search, see MCTSNode.Reroot; None entries are rebuilt from scratch
+        self.RootNodes: list[MCTSNode | None] = root_nodes if root_nodes is not None else [None] * self.TreeCount
+
+        # root parallelization: every (root, seed) tree is searched by its own worker under the same time budget.
+        # Threads are used since GameState holds the engine connection and cannot be sent to another process,
+        # apply_move releases the GIL while it waits for the engine.
+        self.RootParallel = root_parallel
+        self.MaxWorkers = max_workers if max_workers is not None else tree_count
+        self.IterationsDone = 0
+        self.Metrics = SearchMetrics()
+        self.PlayoutDepth = playout_depth # random moves before a playout is cut and scored, None plays until END_TURN
+        self.AdaptivePlayoutDepth = adaptive_playout_depth
+        self.PlayoutPolicy = playout_policy # None plays uniformly random moves, see PlayoutPolicy
+        self.StoppingRule = stopping_rule # None searches until the iteration or time budget is spent
+        # memory budget of the tree, see EnforceMemoryBudget; None is unbounded
+        self.MaxNodes = max_nodes
+        self.MaxStates = max_states
+        # the first expansion of every root child on every tree seed is generated in one concurrent burst by that many
+        # workers, 0 (the default) leaves the root children to the trees' own iterations
+        self.ExpansionWorkers = expansion_workers
+        self.StoppedEarly = False
+
         self.EarlyStopping = False
         self.ElapsedTimeMs = 0
 
@@ -29,42 +63,130 @@ class DMultyTCTS:
         self.EarlyStopping = given_time_ms - self.ElapsedTimeMs < buffer_time
         return self.EarlyStopping
 
+    def CheckForSettledDecision(self, iteration: int) -> bool:
+        # the statistics of the same root move are pooled over the trees, their root children follow PossibleMoves
+        if self.StoppingRule is None or not self.StoppingRule.ShouldCheck(iteration):
+            return self.StoppedEarly
+        visits, total_utility, squared_utility, open_moves = 0, 0, 0, False
+        for root_node in self.RootNodes:
+            store = root_node.Store
+            indices = np.fromiter((child.Index for child in root_node.Children), dtype=np.int64, count=len(root_node.Children))
+            visits = visits + store.Visits[indices]
+            total_utility = total_utility + store.TotalUtility[indices]
+            squared_utility = squared_utility + store.SquaredUtility[indices]
+            open_moves = open_moves | np.array([not child.IsComplete() for child in root_node.Children])
+        candidates = (visits > 0) | open_moves # moves no tree can visit anymore are left out, as in IsSettledNodes
+        self.StoppedEarly = self.StoppedEarly or self.StoppingRule.IsSettled(visits[candidates], total_utility[candidates], squared_utility[candidates])
+        return self.StoppedEarly
+
+    # =========================Single Tree Step========================
+    def TreeIteration(self, head: MCTSNode, seed: int, rng: random.Random, playout_depth: int | None = None) -> bool:
+        metrics = self.Metrics
+        if head.Store.OverBudget():
+            EnforceMemoryBudget(head)
+
+        lap = time.perf_counter()
+        # Selection
+        selected_child_node = SelectChild(head.GenIncompleteChildren(), head)
+        path = [head, selected_child_node]
+        while selected_child_node is not None and (selected_child_node.IsExpanded() or selected_child_node.IsTerminal()):
+            selected_child_node = SelectChild(selected_child_node.GenIncompleteChildren(), selected_child_node)
+            path.append(selected_child_node)
+
+        if selected_child_node is None:
+            return False # the tree is fully explored
+        metrics.ObserveDepth(len(path))
+        lap = metrics.Lap("selection", lap)
+
+        # Expansion
+        child = selected_child_node.ProgressiveExpand(seed, rng=rng)
+        lap = metrics.Lap("expansion", lap)
+        if child is None:
+            return True
+
+        # Simulation and Backpropagation
+        terminal_game_state = Playout(child, self.EvaluationFunction, seed, rng, max_depth=playout_depth, policy=self.PlayoutPolicy)
+        lap = metrics.Lap("playout", lap)
+        utilityValue = self.EvaluationFunction(terminal_game_state)
+        lap = metrics.Lap("evaluation", lap)
+        BackpropagatePath(path + [child], utilityValue)
+        metrics.Lap("backpropagation", lap)
+        return True
+
+    def SearchTree(self, head: MCTSNode, seed: int, rng: random.Random, max_iterations: int, start_time: float, given_time_ms: int) -> int:
+        for i in range(max_iterations):
+            if self.EarlyStopping or self.CheckForEarlyStopping(start_time, given_time_ms):
+                return i
+            if self.CheckForSettledDecision(i):
+                return i
+            if not self.TreeIteration(head, seed, rng, playout_cutoff(self.PlayoutDepth, self.AdaptivePlayoutDepth, start_time, given_time_ms)):
+                PrintLog("MCTS", f"tree with seed {seed} fully explored at iteration {i + 1}/{max_iterations}", 2)
+                return i
+        return max_iterations
+
+    def ExpandRootChildren(self, root_nodes: list[MCTSNode]) -> None:
+        # each tree would spend its first iterations expanding its root children on its seed, one engine round-trip
+        # at a time; these expansions do not depend on each other and are generated together, across the trees
+        requests = [(child, seed) for root_node, seed in zip(root_nodes, self.TreeSeeds)
+                    for child in root_node.Children if not child.IsTerminal() and not child.IsComplete()]
+        if len(requests) < 2:
+            return
+        lap = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.ExpansionWorkers) as executor:
+            registered = ExpandNodes(requests, executor)
+        self.Metrics.Lap("expansion", lap)
+        PrintLog("MCTS", f"{registered} root children states generated in one burst", 2)
 
     # =========================MCTS Main Function========================
     def MonteCarloSearch(self, max_iterations: int, given_time_ms: int) -> BasicMove:
         PrintLog("MCTS", f"Starting MCTS with {max_iterations} iterations and {given_time_ms} ms time limit", 2)
         start_time = time.perf_counter()
+        self.Metrics.Begin(sum(root_node.Store.Allocated for root_node in self.RootNodes if root_node is not None))
 
-        root_nodes:list[MCTSNode] = []
         for t in range(self.TreeCount):
-            node = MCTSNode(None, None)  # root has no parent
-            node.ExpandRoot(self.GameState, self.PossibleMoves)
-            root_nodes.append(node)  # ;root has no parent
-
-        for i in range(max_iterations):  # selection, expansion, simulation(Playout), backpropagation
-            for head, seed in zip(root_nodes, self.TreeSeeds):
-                if self.EarlyStopping or self.CheckForEarlyStopping(start_time, given_time_ms):
+            if self.RootNodes[t] is None:
+                node = MCTSNode(None, None)  # root has no parent
+                node.ExpandRoot(self.GameState, self.PossibleMoves)
+                self.RootNodes[t] = node  # ;root has no parent
+        root_nodes:list[MCTSNode] = self.RootNodes
+        for root_node in root_nodes:
+            root_node.Store.MaxNodes, root_node.Store.MaxStates = self.MaxNodes, self.MaxStates
+            root_node.Store.ResetPeaks()
+        if self.ExpansionWorkers > 0:
+            self.ExpandRootChildren(root_nodes)
+
+        if self.RootParallel:
+            with ThreadPoolExecutor(max_workers=self.MaxWorkers) as executor:
+                futures = [executor.submit(self.SearchTree, head, seed, rng, max_iterations, start_time, given_time_ms)
+                           for head, seed, rng in zip(root_nodes, self.TreeSeeds, self.TreeRngs)]
+                self.IterationsDone = sum(future.result() for future in futures)
+        else:
+            fully_explored = [False] * self.TreeCount
+            for i in range(max_iterations):  # selection, expansion, simulation(Playout), backpropagation
+                if all(fully_explored):
+                    PrintLog("MCTS",f"the trees are fully explored, stopping at iteration {i + 1}/{max_iterations}, elapsed time: {int(self.ElapsedTimeMs)}/{given_time_ms - 150} ms",2)
+                    break
+                if self.CheckForSettledDecision(i):
+                    PrintLog("MCTS", f"Decision settled at iteration {i + 1}/{max_iterations}, elapsed time: {int(self.ElapsedTimeMs)}/{given_time_ms} ms", 2)
+                    break
+                for t, (head, seed, rng) in enumerate(zip(root_nodes, self.TreeSeeds, self.TreeRngs)):
+                    if self.EarlyStopping or self.CheckForEarlyStopping(start_time, given_time_ms):
+                        break
+                    if fully_explored[t]:
+                        continue
+                    fully_explored[t] = not self.TreeIteration(head, seed, rng, playout_cutoff(self.PlayoutDepth, self.AdaptivePlayoutDepth, start_time, given_time_ms))
+                    self.IterationsDone += 1
+
+                if self.EarlyStopping:
                     PrintLog("MCTS",
                              f"Early stopping at iteration {i + 1}/{max_iterations}, elapsed time: {int(self.ElapsedTimeMs)}/{given_time_ms - 150} ms",
                              2)
                     break
 
-                # Selection
-                selected_child_node = SelectChild(head.Children)
-                while selected_child_node is not None and (selected_child_node.IsExpanded() or selected_child_node.IsTerminal()):
-                    selected_child_node = SelectChild(selected_child_node.GenIncompleteChildren())
-
-                if selected_child_node is None:
-                    PrintLog("MCTS",f"the tree is fully explored, stopping at iteration {i + 1}/{max_iterations}, elapsed time: {int(self.ElapsedTimeMs)}/{given_time_ms - 150} ms",2)
-                    break
-
-                # Expansion
-                child = selected_child_node.ProgressiveExpand(seed)
-
-                # Simulation and Backpropagation
-                terminal_game_state = Playout(child, self.EvaluationFunction, seed)
-                utilityValue = self.EvaluationFunction(terminal_game_state)
-                Backpropagate(child, utilityValue)
+        # the trees are searched side by side, their peaks add up
+        self.Metrics.ObserveMemory(sum(root_node.Store.PeakNodes for root_node in root_nodes), sum(root_node.Store.PeakStates for root_node in root_nodes))
+        self.Metrics.End(self.IterationsDone, sum(root_node.Store.Allocated for root_node in root_nodes), self.StoppedEarly)
+        PrintLog("MCTS", f"{self.IterationsDone} iterations over {self.TreeCount} trees ({'root parallel' if self.RootParallel else 'interleaved'})", 2)
 
         # mediate the results of all trees
         utilities = []
@@ -75,5 +197,3 @@ class DMultyTCTS:
         avg_utilities = np.mean(utilities, axis=0)
         max_idex = np.argmax(avg_utilities)
         return self.PossibleMoves[max_idex]
-
-
@@ -1,5 +1,6 @@
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
 
 import numpy as np
@@ -7,11 +8,20 @@ from scripts_of_tribute.board import GameState
 from scripts_of_tribute.move import BasicMove
 
 from Helper.Logging import PrintLog
-from MCTS.MCTSNode import MCTSNode, Backpropagate, Playout, SelectChild
+from MCTS.Common import playout_cutoff
+from MCTS.MCTSNode import MCTSNode, EnforceMemoryBudget, BackpropagatePath, Playout, SelectChild, UpdateRave
+from MCTS.RaveTable import RaveTable
+from MCTS.SearchMetrics import SearchMetrics
+from MCTS.StoppingRule import StoppingRule
+from MCTS.SeedPool import SeedPool
+from MCTS.TranspositionTable import TranspositionTable
 
 # Determinized single Tree MCTS
 class DSingleTMCTS:
-    def __init__(self, game_state: GameState, possible_moves: list[BasicMove], eval_function : Callable, visit_threshold=5, seed_count=1000, seeds:list[int]=None):
+    def __init__(self, game_state: GameState, possible_moves: list[BasicMove], eval_function : Callable, visit_threshold=5, seed_count=1000, seeds:list[int]=None, use_transposition_table: bool = True, root_node: MCTSNode = None, stopping_rule: StoppingRule = None,
+                 playout_depth: int | None = None, adaptive_playout_depth: bool = False,
+                 playout_policy: Callable = None, max_nodes: int | None = None, max_states: int | None = None,
+                 rave: bool = False, rave_k: float = 50, expansion_burst: int = 1):
         self.EvaluationFunction = eval_function
         self.PossibleMoves = possible_moves
         self.GameState = game_state
@@ -20,7 +30,25 @@ class DSingleTMCTS:
         self.Seeds = seeds if seeds is not None else []
         if len (self.Seeds) < seed_count: # fill in random seeds if not enough provided
             self.Seeds += [random.randint(0, 2 ** 30) for _ in range(seed_count - len(self.Seeds))]
-
+        self.SeedPool = SeedPool(self.Seeds)
+
+        self.UseTranspositionTable = use_transposition_table
+        self.RootNode = root_node # a subtree kept from a previous search, see MCTSNode.Reroot
+        self.PlayoutDepth = playout_depth # random moves before a playout is cut and scored, None plays until END_TURN
+        self.AdaptivePlayoutDepth = adaptive_playout_depth
+        self.PlayoutPolicy = playout_policy # None plays uniformly random moves, see PlayoutPolicy
+        self.StoppingRule = stopping_rule # None searches until the iteration or time budget is spent
+        # memory budget of the tree, see EnforceMemoryBudget; None is unbounded
+        self.MaxNodes = max_nodes
+        self.MaxStates = max_states
+        self.Rave = rave # all-moves-as-first statistics blended in the selection, see RaveTable
+        self.RaveK = rave_k
+        # unused seeds a node expands on at once, their states are generated concurrently, see MCTSNode.ExpandSeeds;
+        # every seed counts in the widening test (VisitThreshold * len(GameStates)), so a burst above 1 widens less often
+        self.ExpansionBurst = expansion_burst
+        self.StoppedEarly = False
+        self.IterationsDone = 0
+        self.Metrics = SearchMetrics()
         self.EarlyStopping = False
         self.ElapsedTimeMs = 0
 
@@ -34,9 +62,19 @@ class DSingleTMCTS:
     def MonteCarloSearch(self, max_iterations: int, given_time_ms: int) -> BasicMove:
         PrintLog("MCTS", f"Starting MCTS with {max_iterations} iterations and {given_time_ms} ms time limit", 2)
         start_time = time.perf_counter()
-
-        root = MCTSNode(None, None)
-        root.ExpandRoot(self.GameState, self.PossibleMoves)
+        metrics = self.Metrics
+        metrics.Begin(self.RootNode.Store.Allocated if self.RootNode is not None else 0)
+
+        if self.RootNode is None:
+            self.RootNode = MCTSNode(None, None)
+            self.RootNode.Store.MaxExpansion = len(self.Seeds) # a node is complete once expanded on every seed
+            self.RootNode.ExpandRoot(self.GameState, self.PossibleMoves)
+        root = self.RootNode
+        root.Store.MaxNodes, root.Store.MaxStates = self.MaxNodes, self.MaxStates
+        root.Store.ResetPeaks()
+        root.Store.Rave = (root.Store.Rave or RaveTable(self.RaveK)) if self.Rave else None # kept with a reused tree
+        transposition_table = TranspositionTable() if self.UseTranspositionTable else None
+        executor = ThreadPoolExecutor(max_workers=self.ExpansionBurst) if self.ExpansionBurst > 1 else None
 
         for i in range(max_iterations):
             if self.EarlyStopping or self.CheckForEarlyStopping(start_time, given_time_ms):
@@ -45,17 +83,28 @@ class DSingleTMCTS:
                          2)
                 break
 
+            if self.StoppingRule is not None and self.StoppingRule.Check(i, root.Children):
+                PrintLog("MCTS", f"Decision settled at iteration {i + 1}/{max_iterations}, elapsed time: {int(self.ElapsedTimeMs)}/{given_time_ms} ms", 2)
+                self.StoppedEarly = True
+                break
+
+            if root.Store.OverBudget():
+                dropped = EnforceMemoryBudget(root)
+                if transposition_table is not None:
+                    transposition_table.Discard(dropped)
+                self.SeedPool.Forget(dropped)
+
+            self.IterationsDone += 1
+            lap = time.perf_counter()
             # Selection
-            selected_child_node = SelectChild(root.Children)
-            used_seed = selected_child_node.GameStates.keys()
-            unused_seed = [seed for seed in self.Seeds if seed not in used_seed]
+            selected_child_node = SelectChild(root.GenIncompleteChildren(), root)
+            path = [root, selected_child_node]
             while selected_child_node is not None and (selected_child_node.IsExpanded() or selected_child_node.IsTerminal()):
-                selected_child_node = SelectChild(selected_child_node.GenIncompleteChildren(len(self.Seeds)))
+                selected_child_node = SelectChild(selected_child_node.GenIncompleteChildren(), path[-1])
                 if selected_child_node is None:
                     continue
-                used_seed = selected_child_node.GameStates.keys()
-                unused_seed = [seed for seed in self.Seeds if seed not in used_seed]
-                if selected_child_node.NumberOfVisits > self.VisitThreshold * len(used_seed) and len(unused_seed) > 0:
+                path.append(selected_child_node)
+                if selected_child_node.NumberOfVisits > self.VisitThreshold * len(selected_child_node.GameStates) and self.SeedPool.HasUnused(selected_child_node):
                     break # this break when the node is never expanded before the threshold is reached and there are still unused seeds
 
 
@@ -65,20 +114,43 @@ class DSingleTMCTS:
                          2)
                 break
 
+            metrics.ObserveDepth(len(path))
+            lap = metrics.Lap("selection", lap)
+
             if self.CheckForEarlyStopping(start_time, given_time_ms):
                continue
 
             # Expansion
-            seed = random.choice(unused_seed)  # pick one determinization randomly
-            child = selected_child_node.ProgressiveExpand(seed)
+            seed = self.SeedPool.Draw(selected_child_node)  # pick one unused determinization randomly
+            if seed is None:
+                continue
+            if executor is not None: # more determinizations in the same burst, they cost one round-trip of wall-clock time
+                seeds = [seed] + [s for s in (self.SeedPool.Draw(selected_child_node) for _ in range(self.ExpansionBurst - 1)) if s is not None]
+                if len(selected_child_node.ExpandSeeds(seeds, executor, transposition_table)) == 0:
+                    metrics.Lap("expansion", lap)
+                    continue # merged into a transposition, as ProgressiveExpand returning None
+            child = selected_child_node.ProgressiveExpand(seed, transposition_table)
+            lap = metrics.Lap("expansion", lap)
+            if child is None:
+                continue
 
             if self.CheckForEarlyStopping(start_time, given_time_ms):
                continue
 
             # Simulation and Backpropagation
-            terminal_game_state = Playout(child, self.EvaluationFunction, seed)
+            max_depth = playout_cutoff(self.PlayoutDepth, self.AdaptivePlayoutDepth, start_time, given_time_ms)
+            played = [] if root.Store.Rave is not None else None
+            terminal_game_state = Playout(child, self.EvaluationFunction, seed, max_depth=max_depth, policy=self.PlayoutPolicy, played=played)
+            lap = metrics.Lap("playout", lap)
             utilityValue = self.EvaluationFunction(terminal_game_state)
-            Backpropagate(child, utilityValue)
+            lap = metrics.Lap("evaluation", lap)
+            BackpropagatePath(path + [child], utilityValue)
+            UpdateRave(path + [child], played, [utilityValue])
+            metrics.Lap("backpropagation", lap)
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        metrics.ObserveMemory(root.Store.PeakNodes, root.Store.PeakStates)
+        metrics.End(self.IterationsDone, root.Store.Allocated, self.StoppedEarly)
 
         avg_utilities = [child.AverageUtility for child in root.Children]
         best_index = int(np.argmax(avg_utilities))
@@ -1,18 +1,35 @@
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
 
 from scripts_of_tribute.board import GameState
 from scripts_of_tribute.move import BasicMove
 
 from Helper.Logging import PrintLog
-from MCTS.MCTSNode import MCTSNode, Backpropagate, Playout, SelectChild
+from MCTS.Common import playout_cutoff
+from MCTS.MCTSNode import MCTSNode, BackpropagatePath, BackpropagatePaths, Playout, ParallelPlayouts, SelectChild
+from MCTS.SearchMetrics import SearchMetrics
+from MCTS.StoppingRule import StoppingRule
 
 
 class FlatMCTS:
-    def __init__(self, game_state: GameState, possible_moves: list[BasicMove], eval_function : Callable):
+    def __init__(self, game_state: GameState, possible_moves: list[BasicMove], eval_function : Callable, root_node: MCTSNode = None,
+                 leaf_parallel: int = 1, max_workers: int = None, stopping_rule: StoppingRule = None,
+                 playout_depth: int | None = None, adaptive_playout_depth: bool = False,
+                 playout_policy: Callable = None):
         self.GameState = game_state
         self.EvaluationFunction = eval_function
         self.PossibleMoves = possible_moves
+        self.RootNode = root_node # a subtree kept from a previous search, see MCTSNode.Reroot
+        self.LeafParallel = leaf_parallel # playouts run concurrently from the selected child, 1 keeps them serial
+        self.MaxWorkers = max_workers
+        self.PlayoutDepth = playout_depth # random moves before a playout is cut and scored, None plays until END_TURN
+        self.AdaptivePlayoutDepth = adaptive_playout_depth
+        self.PlayoutPolicy = playout_policy # None plays uniformly random moves, see PlayoutPolicy
+        self.StoppingRule = stopping_rule # None searches until the iteration or time budget is spent
+        self.StoppedEarly = False
+        self.IterationsDone = 0
+        self.Metrics = SearchMetrics()
         self.EarlyStopping = False
         self.ElapsedTimeMs = 0
 
@@ -22,13 +39,22 @@ class FlatMCTS:
         self.EarlyStopping = given_time_ms - self.ElapsedTimeMs < buffer_time
         return self.EarlyStopping
 
+    def RemainingTimeS(self, start_time: float, given_time_ms: int, buffer_time:int = 150) -> float:
+        return max(0.0, (given_time_ms - buffer_time - (time.perf_counter() - start_time) * 1000) / 1000)
+
     #=========================MCTS Main Function========================
     def MonteCarloSearch(self, max_iterations:int, given_time_ms:int) -> BasicMove:
         PrintLog("MCTS", f"Starting MCTS with {max_iterations} iterations and {given_time_ms} ms time limit", 2)
         start_time = time.perf_counter()
+        metrics = self.Metrics
+        metrics.Begin(self.RootNode.Store.Allocated if self.RootNode is not None else 0)
 
-        root_node = MCTSNode(None, None)  # ;root has no parent
-        root_node.ExpandRoot(self.GameState, self.PossibleMoves)
+        if self.RootNode is None:
+            self.RootNode = MCTSNode(None, None)  # ;root has no parent
+            self.RootNode.ExpandRoot(self.GameState, self.PossibleMoves)
+        root_node = self.RootNode
+        root_node.Store.ResetPeaks()
+        executor = ThreadPoolExecutor(max_workers=self.MaxWorkers) if self.LeafParallel > 1 else None
 
         for i in range(max_iterations): #selection, expansion, simulation(Playout), backpropagation
 
@@ -36,13 +62,39 @@ class FlatMCTS:
                 PrintLog("MCTS", f"Early stopping at iteration {i+1}/{max_iterations}, elapsed time: {int(self.ElapsedTimeMs)}/{given_time_ms-150} ms", 2)
                 break
 
+            if self.StoppingRule is not None and self.StoppingRule.Check(i, root_node.Children):
+                PrintLog("MCTS", f"Decision settled at iteration {i + 1}/{max_iterations}, elapsed time: {int(self.ElapsedTimeMs)}/{given_time_ms} ms", 2)
+                self.StoppedEarly = True
+                break
+
+            self.IterationsDone += 1
+            lap = time.perf_counter()
             # Selection
             selected_child_node = SelectChild(root_node.Children)
+            lap = metrics.Lap("selection", lap)
             # EXPANSION is skipped in FlatMCTS, we only have one layer of children
             # Simulation and Backpropagation
-            terminal_game_state = Playout(selected_child_node, self.EvaluationFunction)
+            max_depth = playout_cutoff(self.PlayoutDepth, self.AdaptivePlayoutDepth, start_time, given_time_ms)
+            if executor is not None:
+                batches = ParallelPlayouts([selected_child_node], self.EvaluationFunction, executor, self.LeafParallel,
+                                           timeout_s=self.RemainingTimeS(start_time, given_time_ms), max_depth=max_depth, policy=self.PlayoutPolicy)
+                lap = metrics.Lap("playout", lap) # the parallel playouts score their own states
+                BackpropagatePaths([([root_node, child], utilityValues) for child, utilityValues in batches])
+                metrics.Lap("backpropagation", lap)
+                continue
+
+            terminal_game_state = Playout(selected_child_node, self.EvaluationFunction, max_depth=max_depth, policy=self.PlayoutPolicy)
+            lap = metrics.Lap("playout", lap)
             utilityValue = self.EvaluationFunction(terminal_game_state)
-            Backpropagate(selected_child_node,utilityValue)
+            lap = metrics.Lap("evaluation", lap)
+            BackpropagatePath([root_node, selected_child_node], utilityValue)
+            metrics.Lap("backpropagation", lap)
+
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        metrics.ObserveDepth(1 if self.IterationsDone > 0 else 0) # a single layer of children
+        metrics.ObserveMemory(root_node.Store.PeakNodes, root_node.Store.PeakStates)
+        metrics.End(self.IterationsDone, root_node.Store.Allocated, self.StoppedEarly)
 
         best_move = max(root_node.Children, key=lambda c: (c.AverageUtility, c.NumberOfVisits))
         return best_move.Move
@@ -0,0 +1,47 @@
+import random
+
+from scripts_of_tribute.board import GameState
+from scripts_of_tribute.move import BasicMove
+
+from BotCommon.CommonCheck import obtain_move_semantic_id
+from MCTS.Common import calculate_ucb
+from MCTS.StoppingRule import StoppingRule
+from MCTS.mcts2 import MCTS2, Node, NotRootNode, RootNode
+
+
+# Single observer information set MCTS: one tree keyed by move semantic id for all the determinizations.
+# Every iteration samples a seed and descends with it, only the children whose move is legal in that
+# determinization compete, and UCB counts how often a child was available instead of the parent visits.
+# Unlike DMultyTCTS the statistics of a move are shared by all the seeds and no node stores a GameState,
+# the states of the path are replayed through the simulation cache.
+class ISMCTS(MCTS2):
+    def __init__(self, game_state: GameState, possible_moves: list[BasicMove], player_id, evaluation_function, seed: int = None, root: RootNode = None,
+                 seed_count: int = 5, seeds: list[int] = None, stopping_rule: StoppingRule = None, playout_depth: int | None = None,
+                 adaptive_playout_depth: bool = False, playout_policy = None):
+        # no transposition table: it is keyed by states, which differ from one determinization to the other
+        super().__init__(game_state, possible_moves, player_id, evaluation_function, None, False, root, stopping_rule,
+                         playout_depth, adaptive_playout_depth, playout_policy)
+        rng = random.Random(seed)
+        self.seeds = seeds if seeds is not None else [rng.randint(0, 2**30) for _ in range(seed_count)]
+
+    def iteration(self):
+        self.seed = random.choice(self.seeds) # the determinization of this iteration
+        super().iteration()
+
+    @staticmethod
+    def selection(parent: Node, possible_moves: list[BasicMove]) -> tuple[NotRootNode, BasicMove]:
+        best_node, best_move = None, None
+        best_ucb = float('-inf')
+        for move in possible_moves:
+            node = parent.children.get(obtain_move_semantic_id(move))
+            if node is None:
+                continue
+            node.availability += 1
+            ucb = calculate_ucb(node.total_utility, node.number_of_playouts, node.availability)
+            if ucb > best_ucb:
+                best_node, best_move = node, move
+                best_ucb = ucb
+
+        if best_node is None:
+            raise ValueError("no actual child found")
+        return best_node, best_move
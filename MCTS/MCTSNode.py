@@ -1,12 +1,19 @@
 import random
+from concurrent.futures import Executor, wait
+from threading import Event
 from typing import Callable
 
+import numpy as np
 from scripts_of_tribute.board import GameState
 from scripts_of_tribute.enums import MoveEnum
 from scripts_of_tribute.move import BasicMove
 
-from BotCommon.CommonCheck import obtain_move_semantic_id
+from BotCommon.CommonCheck import obtain_move_semantic_id, obtain_state_semantic_id
+from MCTS.BranchingModel import BRANCHING_MODEL
 from MCTS.Common import calculate_ucb
+from MCTS.NodeStore import NodeStore
+from MCTS.SimulationCache import CachedApplyMove
+from MCTS.TranspositionTable import TranspositionTable
 
 
 class MCTSNode:
@@ -18,147 +25,566 @@ class MCTSNode:
         self.MoveSeed: int | None     = moveSeed
         self.Children: list[MCTSNode] = []
         self.UnexpandedPossibleMoves: list[BasicMove] = []
+        # persistent indexes by move semantic id, kept in sync with Children and UnexpandedPossibleMoves;
+        # a move whose child was merged into a transposition maps to the known node;
+        # a pending move maps to the seeds whose state offers it, the determinizations disagree on drawn cards
+        self.ChildIndex: dict[tuple, MCTSNode] = {}
+        self.PendingMoveIds: dict[tuple, dict[int | None, None]] = {} # the seeds as an ordered set
 
-        self.NumberOfVisits = 0
-        self.MaxUtility     = 0
-        self.AverageUtility = 0.0
-        self.TotalUtility   = 0.0
+        # the statistics live in the NodeStore shared by the whole tree
+        self.Store: NodeStore = parent.Store if parent is not None else NodeStore()
+        self.Index: int       = self.Store.Allocate(parent.Index if parent is not None else -1, self)
+        # a GameState evicted by EnforceMemoryBudget stays as a None value, GetGameState replays it from the parent;
+        # the states handed over by a transposition come from another path and cannot be replayed
+        self.PinnedSeeds: set[int | None] | None = None
 
-        self.IsComplete_value = False
+        # completeness is kept up to date by the expansions: a node completing removes itself from the
+        # IncompleteChildren of the nodes that list it as a child, which may complete them in turn
+        self.Parents: list[MCTSNode] = [parent] if parent is not None else []
+        self.IncompleteChildren: dict[MCTSNode, None] = {} # ordered set
+        self.IsComplete_value = move is not None and move.command == MoveEnum.END_TURN
+
+    ##=========================Statistics========================
+    @property
+    def NumberOfVisits(self):
+        return self.Store.Visits[self.Index]
+
+    @NumberOfVisits.setter
+    def NumberOfVisits(self, value):
+        self.Store.Visits[self.Index] = value
+
+    @property
+    def TotalUtility(self):
+        return self.Store.TotalUtility[self.Index]
+
+    @TotalUtility.setter
+    def TotalUtility(self, value):
+        self.Store.TotalUtility[self.Index] = value
+
+    @property
+    def AverageUtility(self):
+        return self.Store.AverageUtility[self.Index]
+
+    @AverageUtility.setter
+    def AverageUtility(self, value):
+        self.Store.AverageUtility[self.Index] = value
+
+    @property
+    def MaxUtility(self):
+        return self.Store.MaxUtility[self.Index]
+
+    @MaxUtility.setter
+    def MaxUtility(self, value):
+        self.Store.MaxUtility[self.Index] = value
 
     ##=========================Node kind check========================
     def IsLeaf(self):
         return len(self.Children) == 0
 
     def IsTerminal(self) -> bool:
-        return self.Move.command == MoveEnum.END_TURN
+        return self.Move is not None and self.Move.command == MoveEnum.END_TURN
+
+    def IsDescendantOf(self, node: 'MCTSNode') -> bool:
+        ancestor = self.ParentNode
+        while ancestor is not None:
+            if ancestor is node:
+                return True
+            ancestor = ancestor.ParentNode
+        return False
 
-    ##===============================================================
+    ##=========================Game states========================
     def GenerateNextState(self, seed: int|None = None) -> tuple[GameState, list[BasicMove]]:
-        parent_state = self.ParentNode.GameStates.get(self.MoveSeed)
+        parent_state = self.ParentNode.GetGameState(self.MoveSeed)
         if parent_state is None:
             raise ValueError(f"No GameState available for seed {seed}")
-        return parent_state.apply_move(self.Move, seed)
+        return CachedApplyMove(parent_state, self.Move, seed)
 
-    def Ucb1Value(self) -> float:
+    def GetGameState(self, seed: int | None) -> GameState | None:
+        game_state = self.GameStates.get(seed)
+        if game_state is None and seed in self.GameStates: # evicted, replayed from the nearest ancestor still holding its state
+            game_state, _ = self.GenerateNextState(seed)
+            self.SetGameState(seed, game_state)
+        return game_state
+
+    def SetGameState(self, seed: int | None, game_state: GameState, replayable: bool = True) -> None:
+        if self.GameStates.get(seed) is None:
+            self.Store.StateCount += 1
+            self.Store.PeakStates = max(self.Store.PeakStates, self.Store.StateCount)
+            if not replayable:
+                self.PinnedSeeds = (self.PinnedSeeds or set()) | {seed}
+            elif seed is not None and self.ParentNode is not None and (self.PinnedSeeds is None or seed not in self.PinnedSeeds):
+                self.Store.CachedStates[self.Index] += 1
+        self.GameStates[seed] = game_state
+
+    def EvictStates(self) -> int:
+        # drops the states that can be replayed, the seeds stay as keys so the node keeps counting as expanded on them
         if self.ParentNode is None:
+            return 0 # a root has nothing to replay from
+        evicted = 0
+        for seed, game_state in self.GameStates.items():
+            if game_state is not None and seed is not None and (self.PinnedSeeds is None or seed not in self.PinnedSeeds):
+                self.GameStates[seed] = None
+                evicted += 1
+        self.Store.CachedStates[self.Index] -= evicted
+        self.Store.StateCount -= evicted
+        return evicted
+
+    def ReleaseStates(self) -> None:
+        self.Store.StateCount -= sum(1 for game_state in self.GameStates.values() if game_state is not None)
+        self.Store.CachedStates[self.Index] = 0
+        self.GameStates = {}
+        self.PinnedSeeds = None
+
+    def Ucb1Value(self, parent: 'MCTSNode' = None) -> float:
+        # with transpositions a node can be reached from several parents, the one on the current path is used
+        parent = parent if parent is not None else self.ParentNode
+        if parent is None:
             raise ValueError("Parent node is not set, cannot calculate UCB1 value on the root node")
-        return calculate_ucb(self.TotalUtility, self.NumberOfVisits, self.ParentNode.NumberOfVisits)
+        rave = self.Store.Rave
+        if rave is None or self.NumberOfVisits == 0:
+            return calculate_ucb(self.TotalUtility, self.NumberOfVisits, parent.NumberOfVisits)
+        value = rave.BlendOne(self.MoveSemanticId, self.NumberOfVisits, self.TotalUtility)
+        return calculate_ucb(value * self.NumberOfVisits, self.NumberOfVisits, parent.NumberOfVisits)
 
     #=========================Tree Structure========================
     def AddChild(self, child_node: 'MCTSNode') -> None:
         self.Children.append(child_node)
+        self.ChildIndex[child_node.MoveSemanticId] = child_node
+        if not child_node.IsComplete_value:
+            self.IncompleteChildren[child_node] = None
 
     def AddChildMove(self, move: BasicMove, seed:int|None = None) -> 'MCTSNode':
         child_node = MCTSNode(parent=self, move=move, moveSeed=seed)
-        self.Children.append(child_node)
+        self.AddChild(child_node)
         return child_node
 
+    def GetChild(self, move: BasicMove) -> 'MCTSNode | None':
+        return self.ChildIndex.get(obtain_move_semantic_id(move))
+
+    def AddUnexpandedMoves(self, possible_moves: list[BasicMove], seed: int | None = None) -> None:
+        for move in possible_moves:
+            semantic_id = obtain_move_semantic_id(move)
+            if semantic_id in self.ChildIndex:
+                continue
+            seeds = self.PendingMoveIds.get(semantic_id)
+            if seeds is None:
+                self.UnexpandedPossibleMoves.append(move)
+                self.PendingMoveIds[semantic_id] = {seed: None}
+            else:
+                seeds[seed] = None
+
+    def PopUnexpandedMove(self, rng: random.Random = random, seed: int | None = None) -> tuple[BasicMove, int | None]:
+        # a move offered by the state of seed when there is one, otherwise any pending move;
+        # returns it with a seed whose state offers it, the child has to be played from that state
+        moves = self.UnexpandedPossibleMoves
+        legal = [i for i, move in enumerate(moves) if seed in self.PendingMoveIds[obtain_move_semantic_id(move)]]
+        i = rng.choice(legal) if len(legal) > 0 else rng.randrange(len(moves))
+        # swap with the last one so the removal does not shift the list
+        moves[i], moves[-1] = moves[-1], moves[i]
+        move = moves.pop()
+        seeds = self.PendingMoveIds.pop(obtain_move_semantic_id(move))
+        return move, seed if seed in seeds else next(iter(seeds))
+
+    def RedirectChild(self, child_node: 'MCTSNode', known_node: 'MCTSNode') -> None:
+        # a collapsed node (see CollapseSubtree) can be merged while other parents reach it through their own move
+        semantic_id = child_node.MoveSemanticId if child_node.ParentNode is self else next(key for key, node in self.ChildIndex.items() if node is child_node)
+        self.ChildIndex[semantic_id] = known_node
+        self.IncompleteChildren.pop(child_node, None)
+        if known_node in self.Children:
+            self.Children.remove(child_node)
+        else:
+            self.Children[self.Children.index(child_node)] = known_node
+            known_node.Parents.append(self)
+            if not known_node.IsComplete_value:
+                self.IncompleteChildren[known_node] = None
+        child_node.Parents.remove(self)
+        if len(child_node.Parents) == 0:
+            child_node.Store.Free([child_node.Index]) # merged before it was expanded, nothing hangs below it
+        self.UpdateCompleteness()
+
+    def ResolveTransposition(self, game_state: GameState, possible_moves: list[BasicMove], seed: int | None, transposition_table: TranspositionTable | None) -> 'MCTSNode':
+        # root children are never merged, the searches read the best move from them
+        if transposition_table is None or self.ParentNode is None or self.ParentNode.ParentNode is None:
+            return self
+        known_node = transposition_table.GetOrRegister(game_state, self)
+        if known_node is self or self.IsDescendantOf(known_node):
+            return self # a move leaving the state unchanged would otherwise close a cycle
+        for parent in list(self.Parents):
+            parent.RedirectChild(self, known_node)
+        if seed not in known_node.GameStates:
+            known_node.SetGameState(seed, game_state, replayable=False)
+            known_node.AddUnexpandedMoves(possible_moves, seed)
+            if len(known_node.UnexpandedPossibleMoves) > 0:
+                known_node.MarkIncomplete()
+            known_node.UpdateCompleteness()
+        return known_node
+
     def ExpandRoot(self, game_state: GameState, possible_moves: list[BasicMove]) -> None:
-        self.GameStates[None] = game_state
+        self.SetGameState(None, game_state)
         for move in possible_moves:
             _ = self.AddChildMove(move, None)
+        self.UpdateCompleteness()
+
+    def Reroot(self, moves: list[BasicMove], game_state: GameState, possible_moves: list[BasicMove]) -> 'MCTSNode | None':
+        # follows the moves played since this root was searched and makes the reached subtree the new root
+        node = self
+        for move in moves:
+            node = node.GetChild(move)
+            if node is None:
+                return None
+
+        # the subtree was simulated on a determinization, it is reused only if the real state matches it
+        state_id = obtain_state_semantic_id(game_state)
+        if node is not self and not any(obtain_state_semantic_id(node.GetGameState(seed)) == state_id for seed in list(node.GameStates)):
+            return None
+
+        known_children = {semantic_id: child for semantic_id, child in node.ChildIndex.items() if child.ParentNode is node and child.MoveSemanticId == semantic_id}
+        node.ParentNode = None
+        node.Parents = []
+        node.Store.ParentIndex[node.Index] = -1
+        node.Move = None
+        node.MoveSemanticId = obtain_move_semantic_id(None)
+        node.MoveSeed = None
+        node.ReleaseStates()
+        node.SetGameState(None, game_state)
+        node.UnexpandedPossibleMoves = []
+        node.ChildIndex = {}
+        node.PendingMoveIds = {}
+        node.IsComplete_value = False
+        node.IncompleteChildren = {}
+        node.Children = []
+        for move in possible_moves: # children follow the order of possible_moves, the searches rely on it
+            child = known_children.get(obtain_move_semantic_id(move))
+            if child is None:
+                node.AddChildMove(move, None)
+                continue
+            # refresh the move object, as mcts2.NotRootNode.update_parent_move does
+            child.Move = move
+            child.MoveSeed = None
+            node.AddChild(child)
+        node.UpdateCompleteness()
+        ReleaseUnreachable(node)
+        return node
 
-    def Expand(self, seed: int | None = None) -> list['MCTSNode']:
+    def Expand(self, seed: int | None = None, transposition_table: TranspositionTable = None) -> list['MCTSNode']:
         if seed in self.GameStates:
             raise ValueError("seed already preset cannot expand again")
         node_generated = []
-        self.GameStates[seed], possible_moves = self.GenerateNextState(seed)
+        game_state, possible_moves = self.GenerateNextState(seed)
+        if len(self.GameStates) == 0 and self.ResolveTransposition(game_state, possible_moves, seed, transposition_table) is not self:
+            return node_generated # the state is already in the tree, next selections will go through the known node
+        self.SetGameState(seed, game_state)
         for move in self.GetChildrenNotAlreadyConsidered(possible_moves):
             node = self.AddChildMove(move, seed)
             node_generated.append(node)
+        self.UpdateCompleteness()
         return node_generated
 
-    def ProgressiveExpand(self, seed: int | None = None) -> 'MCTSNode':
+    def RegisterState(self, seed: int | None, game_state: GameState, possible_moves: list[BasicMove], transposition_table: TranspositionTable = None) -> bool:
+        # False when the state is already in the tree, next selections will go through the known node
+        if len(self.GameStates) == 0 and self.ResolveTransposition(game_state, possible_moves, seed, transposition_table) is not self:
+            return False
+        self.SetGameState(seed, game_state)
+        self.AddUnexpandedMoves(possible_moves, seed)
+        return True
+
+    def ExpandSeeds(self, seeds: list[int], executor: Executor, transposition_table: TranspositionTable = None) -> list[int]:
+        # the states of several determinizations are independent engine round-trips from the same parent state:
+        # they are generated concurrently and registered together, returns the seeds registered
+        seeds = [seed for seed in seeds if seed not in self.GameStates]
+        parent_state = self.ParentNode.GetGameState(self.MoveSeed) # replayed here if evicted, not from the workers
+        if parent_state is None:
+            raise ValueError(f"No GameState available for seed {self.MoveSeed}")
+        results = executor.map(lambda seed: CachedApplyMove(parent_state, self.Move, seed), seeds) if len(seeds) > 1 \
+            else [CachedApplyMove(parent_state, self.Move, seed) for seed in seeds]
+        registered = []
+        for seed, (game_state, possible_moves) in zip(seeds, results):
+            if not self.RegisterState(seed, game_state, possible_moves, transposition_table):
+                return registered # merged into a known node, which the remaining states belong to as well
+            registered.append(seed)
+        self.UpdateCompleteness()
+        return registered
+
+    def ProgressiveExpand(self, seed: int | None = None, transposition_table: TranspositionTable = None, rng: random.Random = random) -> 'MCTSNode':
         if seed not in self.GameStates:
-            self.GameStates[seed], newUnexpandedPossibleMoves = self.GenerateNextState(seed)
-            self.UnexpandedPossibleMoves += self.GetChildrenNotAlreadyConsidered(newUnexpandedPossibleMoves)
+            game_state, newUnexpandedPossibleMoves = self.GenerateNextState(seed)
+            if not self.RegisterState(seed, game_state, newUnexpandedPossibleMoves, transposition_table):
+                return None # the state is already in the tree, next selections will go through the known node
         if len(self.UnexpandedPossibleMoves) == 0:
+            self.UpdateCompleteness()
             return None
-        move = random.choice(self.UnexpandedPossibleMoves)
-        self.UnexpandedPossibleMoves.remove(move)
-        return self.AddChildMove(move,seed)
+        move, move_seed = self.PopUnexpandedMove(rng, seed) # a move drawn under another seed may not exist in this one
+        child = self.AddChildMove(move, move_seed)
+        self.UpdateCompleteness()
+        return child
 
     def IsExpanded(self, times:int=1) -> bool:
         return  len(self.GameStates.keys()) >= times and len(self.UnexpandedPossibleMoves) == 0
 
-    def IsComplete(self, max_expansion: int = 1) -> bool:
-        if not self.IsComplete_value:
-            self.IsComplete_value = (
-                    self.IsTerminal() or
-                    ( self.IsExpanded(max_expansion))
-                    and all(child.IsTerminal() or child.IsComplete(max_expansion) for child in self.Children))
+    def IsComplete(self) -> bool:
         return self.IsComplete_value
 
-    def GenIncompleteChildren(self,max_expansion:int = 1 ) -> list['MCTSNode']:
-        return [c for c in self.Children if not c.IsComplete(max_expansion)]
+    def UpdateCompleteness(self) -> None:
+        # called when the node gains a state, a child or a completed child; completion propagates upward iteratively
+        pending = [self]
+        while len(pending) > 0:
+            node = pending.pop()
+            if node.IsComplete_value or len(node.IncompleteChildren) > 0 or not node.IsExpanded(node.Store.MaxExpansion):
+                continue
+            node.IsComplete_value = True
+            for parent in node.Parents:
+                parent.IncompleteChildren.pop(node, None)
+                pending.append(parent)
+
+    def MarkIncomplete(self) -> None:
+        # a transposition gave the node new moves to expand, the nodes it completed are open again
+        pending = [self]
+        while len(pending) > 0:
+            node = pending.pop()
+            if not node.IsComplete_value:
+                continue
+            node.IsComplete_value = False
+            for parent in node.Parents:
+                parent.IncompleteChildren[node] = None
+                pending.append(parent)
+
+    def GenIncompleteChildren(self) -> list['MCTSNode']:
+        return list(self.IncompleteChildren)
 
     def GetChildrenNotAlreadyConsidered(self, possible_move: list[BasicMove]) -> list[BasicMove]:
-        considered_semantic_ids = [child.MoveSemanticId for child in self.Children]
-        considered_semantic_ids += [obtain_move_semantic_id(m) for m in self.UnexpandedPossibleMoves]
-        return [m for m in possible_move if obtain_move_semantic_id(m) not in considered_semantic_ids]
+        return [m for m in possible_move
+                if obtain_move_semantic_id(m) not in self.ChildIndex and obtain_move_semantic_id(m) not in self.PendingMoveIds]
+
+
+#=========================Batched expansion========================
+def ExpandNodes(requests: list[tuple[MCTSNode, int | None]], executor: Executor, transposition_table: TranspositionTable = None) -> int:
+    # one determinization for each of several nodes, e.g. the root children of every tree of DMultyTCTS;
+    # the engine calls run concurrently, the tree is only modified by the calling thread. Returns the states registered
+    requests = [(node, seed, node.ParentNode.GetGameState(node.MoveSeed)) for node, seed in requests if seed not in node.GameStates]
+    requests = [request for request in requests if request[2] is not None]
+    results = executor.map(lambda request: CachedApplyMove(request[2], request[0].Move, request[1]), requests)
+    registered = 0
+    for (node, seed, _), (game_state, possible_moves) in zip(requests, results):
+        if node.RegisterState(seed, game_state, possible_moves, transposition_table):
+            node.UpdateCompleteness()
+            registered += 1
+    return registered
+
+
+#=========================Memory budget========================
+def ReleaseUnreachable(root: MCTSNode) -> list[MCTSNode]:
+    # frees the nodes of the store the root cannot reach anymore, like the siblings left behind by Reroot
+    store = root.Store
+    reachable = {root}
+    pending = [root]
+    while len(pending) > 0:
+        node = pending.pop()
+        for child in node.Children:
+            if child not in reachable:
+                reachable.add(child)
+                pending.append(child)
+    released = [node for node in store.Nodes if node is not None and node not in reachable]
+    if len(released) == 0:
+        return released
+    # a transposed node keeps generating its states from its original parent, which may be left behind:
+    # that parent keeps its states, replayed now while its ancestors are still there, outside the budget
+    anchors = {node.ParentNode for node in reachable if node.ParentNode is not None and node.ParentNode not in reachable}
+    for anchor in anchors:
+        for seed in list(anchor.GameStates):
+            anchor.GetGameState(seed)
+    for node in released:
+        if node in anchors:
+            store.StateCount -= sum(1 for game_state in node.GameStates.values() if game_state is not None)
+        else:
+            node.ReleaseStates()
+    store.Free([node.Index for node in released])
+    released_set = set(released)
+    for node in reachable:
+        if len(node.Parents) > 1:
+            node.Parents = [parent for parent in node.Parents if parent not in released_set]
+    return released
+
+def CollapseSubtree(node: MCTSNode) -> list[MCTSNode] | None:
+    # drops the descendants of node, it keeps its statistics and is expanded again if the selection comes back;
+    # returns the dropped nodes, None when a transposition links the subtree to the rest of the tree
+    subtree = []
+    seen = {node}
+    pending = [node]
+    while len(pending) > 0:
+        current = pending.pop()
+        for child in current.Children:
+            if child not in seen:
+                seen.add(child)
+                subtree.append(child)
+                pending.append(child)
+    if any(parent not in seen for descendant in subtree for parent in descendant.Parents):
+        return None
+    for descendant in subtree:
+        descendant.ReleaseStates()
+    node.Store.Free([descendant.Index for descendant in subtree])
+    node.ReleaseStates()
+    node.Children = []
+    node.ChildIndex = {}
+    node.UnexpandedPossibleMoves = []
+    node.PendingMoveIds = {}
+    node.IncompleteChildren = {}
+    node.MarkIncomplete()
+    return subtree
+
+def EnforceMemoryBudget(root: MCTSNode) -> list[MCTSNode]:
+    # keeps the tree within the MaxNodes / MaxStates of its NodeStore: the least visited subtrees are collapsed
+    # and the GameStates of the least visited nodes are evicted, both down to 3/4 of the budget so the work is
+    # amortized over many iterations. Returns the nodes dropped or collapsed, the searches forget them in their
+    # TranspositionTable and SeedPool: a collapsed node is expanded again as if it were new.
+    store = root.Store
+    dropped = []
+    if store.MaxNodes is not None and store.LiveCount() > store.MaxNodes:
+        target = store.MaxNodes * 3 // 4
+        candidates = [node for node in store.Nodes if node is not None and node is not root and len(node.Children) > 0]
+        candidates.sort(key=lambda node: node.NumberOfVisits)
+        for node in candidates:
+            if store.LiveCount() <= target:
+                break
+            if store.Nodes[node.Index] is not node:
+                continue # dropped with an ancestor
+            descendants = CollapseSubtree(node)
+            if descendants is not None:
+                dropped += descendants
+                dropped.append(node)
+
+    if store.MaxStates is not None and store.StateCount > store.MaxStates:
+        target = store.MaxStates * 3 // 4
+        held = np.flatnonzero(store.CachedStates[:store.Size] > 0)
+        for index in held[np.argsort(store.Visits[held], kind="stable")]:
+            if store.StateCount <= target:
+                break
+            store.Nodes[index].EvictStates()
+    return dropped
 
 
 #=========================Selection========================
-def SelectChild(ListOfLeafNodes:list[MCTSNode]) -> MCTSNode | None:
+def SelectChild(ListOfLeafNodes:list[MCTSNode], parent: MCTSNode = None) -> MCTSNode | None:
     if len(ListOfLeafNodes) == 0:
         return None
-    ucb1s = {child:child.Ucb1Value() for child in ListOfLeafNodes}
-    max_val = max(ucb1s.values())
-    best = [c for c, v in ucb1s.items() if v == max_val]
-    return random.choice(best)
+    parent = parent if parent is not None else ListOfLeafNodes[0].ParentNode
+    store = parent.Store
+    indices = np.fromiter((child.Index for child in ListOfLeafNodes), dtype=np.int64, count=len(ListOfLeafNodes))
+    values = None
+    if store.Rave is not None:
+        values = store.Rave.Blend([child.MoveSemanticId for child in ListOfLeafNodes], store.Visits[indices], store.TotalUtility[indices])
+    return ListOfLeafNodes[store.SelectBest(indices, store.Visits[parent.Index], values)]
 
 
 #=========================Playout Policies========================
-def playout_policy_random(possible_moves:list[BasicMove]) -> BasicMove:
+def playout_policy_random(possible_moves:list[BasicMove], rng: random.Random = random) -> BasicMove:
     filter = [m for m in possible_moves if m.command != MoveEnum.END_TURN]
     if len(filter) == 0:
         return possible_moves[0]
-    return random.choice(filter)
-
-
-def playout_policy_greedy_heuristic(game_state:GameState, possible_move:list[BasicMove], eval_function:Callable, seed:int|None = None) -> BasicMove:
-    move_value = {m: float('-inf') for m in possible_move}
-    for move in possible_move:
-        gs1, _ = game_state.apply_move(move,seed)
-        val = eval_function(gs1)
-        if val > move_value[move]:
-            move_value[move] = val
-    return max(move_value, key=move_value.get)
-
-def playout_policy_greedy_heuristic_lookAhead(game_state:GameState, possible_move:list[BasicMove], eval_function:Callable, seed:int|None = None) -> BasicMove:
-    move_value = {m: float('-inf') for m in possible_move}
-    for move in possible_move:
-        gs1, ps1 = game_state.apply_move(move,seed)
-        for move2 in ps1:
-            gs2, _ = gs1.apply_move(move2,seed)
-            val = eval_function(gs2)
-            if val > move_value[move]:
-                move_value[move] = val
-
-    return max(move_value, key=move_value.get)
-
-def Playout(selected_node: MCTSNode, eval_function:Callable, seed: int | None = None) -> GameState:
-    random.seed(seed)
+    return rng.choice(filter)
+
+
+def Playout(selected_node: MCTSNode, eval_function:Callable, seed: int | None = None, rng: random.Random = None,
+            max_depth: int | None = None, policy: Callable = None, played: list[tuple] | None = None, stop: Event | None = None) -> GameState | None:
+    # concurrent playouts pass their own generator, the global one is shared by all threads
+    # with max_depth the playout is truncated after that many random moves, the caller scores the state reached
+    # played receives the semantic ids of the moves played, for the RaveTable
+    # stop is checked before every move: once it is set the playout is abandoned and None is returned
+    if rng is None:
+        random.seed(seed)
+        rng = random
     currentGameState, currentPossibleMove = selected_node.GenerateNextState(seed)
+    # the branching met along the playout is a sample for the BranchingModel used to split the turn time
+    startGameState, startPossibleMove, branching = currentGameState, currentPossibleMove, []
+    truncated = False
     while not len(currentPossibleMove)<=1 and currentPossibleMove[0].command != MoveEnum.END_TURN:
-        # randomly select semple the non-deterministic state space
-        selected_move = playout_policy_random(currentPossibleMove)
-        # selected_move = playout_policy_greedy_heuristic(currentGameState,currentPossibleMove,eval_function,seed=seed)
-        # selected_move = playout_policy_greedy_heuristic_lookAhead(currentGameState,currentPossibleMove,eval_function,seed=seed)
-        currentGameState, currentPossibleMove = currentGameState.apply_move(selected_move)
+        if max_depth is not None and len(branching) >= max_depth:
+            truncated = True
+            break
+        if stop is not None and stop.is_set():
+            return None
+        branching.append(len(currentPossibleMove) - 1)
+        # randomly select semple the non-deterministic state space, unless an informed policy is given (see PlayoutPolicy)
+        successor = None
+        if policy is None:
+            selected_move = playout_policy_random(currentPossibleMove, rng)
+        else:
+            selected_move, successor = policy(currentGameState, currentPossibleMove, rng, seed)
+        if played is not None:
+            played.append(obtain_move_semantic_id(selected_move))
+        # the state the policy scored is the one played on, not a new sample of the same move
+        currentGameState, currentPossibleMove = successor if successor is not None else CachedApplyMove(currentGameState, selected_move)
 
+    if len(branching) > 0 and not truncated: # a truncated turn would bias the model toward short turns
+        BRANCHING_MODEL.Observe(startGameState, startPossibleMove, branching)
     return currentGameState
 
+def ParallelPlayouts(nodes: list[MCTSNode], eval_function:Callable, executor: Executor, playouts_per_node: int,
+                     seed: int | None = None, timeout_s: float | None = None, max_depth: int | None = None,
+                     policy: Callable = None) -> list[tuple[MCTSNode, list[float]]]:
+    # leaf parallelization: the playouts are independent engine round-trips, they run concurrently on the executor
+    # and the ones not finished within timeout_s are dropped; the running ones are told to stop at their next move,
+    # cancel() only reaches those not started, the others would keep calling the engine into the next decision
+    futures = {}
+    stop = Event()
+    for node in nodes:
+        for _ in range(playouts_per_node):
+            rng = random.Random(random.getrandbits(32))
+            futures[executor.submit(Playout, node, eval_function, seed, rng, max_depth, policy, stop=stop)] = node
+
+    done, not_done = wait(futures, timeout=timeout_s)
+    stop.set()
+    for future in not_done:
+        future.cancel()
+
+    utilities: dict[MCTSNode, list[float]] = {node: [] for node in nodes}
+    for future in done:
+        terminal_game_state = future.result()
+        if terminal_game_state is not None:
+            utilities[futures[future]].append(eval_function(terminal_game_state))
+    return [(node, node_utilities) for node, node_utilities in utilities.items() if len(node_utilities) > 0]
+
 ##=========================Backpropagation========================
+def PathToRoot(node:MCTSNode) -> list[MCTSNode]:
+    # root first, iterative so deep single turn chains do not hit the recursion limit
+    path = []
+    while node is not None:
+        path.append(node)
+        node = node.ParentNode
+    path.reverse()
+    return path
+
 def Backpropagate(node:MCTSNode, utilityValue:float) -> None:
-    node.NumberOfVisits += 1
-    # Update the average value and max value
-    node.AverageUtility += (utilityValue - node.AverageUtility) / node.NumberOfVisits
-    # Update the max value
-    node.MaxUtility = utilityValue if utilityValue > node.MaxUtility else node.MaxUtility
-    # update the total value
-    node.TotalUtility += utilityValue
-
-    if node.ParentNode is not None:
-        Backpropagate(node.ParentNode, utilityValue)
+    BackpropagateBatch(PathToRoot(node), [utilityValue])
+
+def BackpropagatePath(path:list[MCTSNode], utilityValue:float) -> None:
+    # used when the tree can contain transpositions: a node's ParentNode is not necessarily the one the selection came from
+    BackpropagateBatch(path, [utilityValue])
+
+def BackpropagateBatch(path:list[MCTSNode], utilityValues:list[float]) -> None:
+    # a batch of playouts from the same leaf updates every node of the path once
+    store = path[0].Store
+    store.Update(np.fromiter((node.Index for node in path), dtype=np.int64, count=len(path)), utilityValues)
+
+def UpdateRave(path:list[MCTSNode], played:list[tuple] | None, utilityValues:list[float]) -> None:
+    # credits the moves of the tree path, then the ones of the playout, when the tree keeps a RaveTable
+    rave = path[0].Store.Rave
+    if rave is None:
+        return
+    rave.Update([node.MoveSemanticId for node in path[1:]] + (played if played is not None else []), utilityValues)
+
+def BackpropagatePaths(batch:list[tuple[list[MCTSNode], list[float]]]) -> None:
+    # playouts from different leaves of the same tree: the nodes of the shared prefix are written once for the whole batch
+    indices, counts, sums, squares, maxes = [], [], [], [], []
+    for path, utilityValues in batch:
+        count, total, best = len(utilityValues), sum(utilityValues), max(utilityValues)
+        square = sum(u * u for u in utilityValues)
+        for node in path:
+            indices.append(node.Index)
+            counts.append(count)
+            sums.append(total)
+            squares.append(square)
+            maxes.append(best)
+    if len(indices) == 0:
+        return
+    batch[0][0][0].Store.UpdatePaths(np.array(indices, dtype=np.int64), np.array(counts, dtype=np.int64),
+                                     np.array(sums, dtype=np.float64), np.array(squares, dtype=np.float64), np.array(maxes, dtype=np.float64))
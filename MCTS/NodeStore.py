@@ -0,0 +1,125 @@
+import math
+import random
+from typing import Any
+
+import numpy as np
+
+from MCTS.RaveTable import RaveTable
+
+
+# Statistics of the MCTSNode of a tree, stored in contiguous arrays indexed by MCTSNode.Index.
+# Selection over a set of children is a single vectorized UCB + argmax instead of one Python call per child.
+class NodeStore:
+    def __init__(self, capacity: int = 1024, max_expansion: int = 1):
+        self.Size = 0 # high-water mark, freed indices below it are reused first
+        self.Allocated = 0 # nodes ever allocated
+        self.Nodes: list[Any] = [] # index -> MCTSNode, None once freed
+        self.FreeIndices: list[int] = []
+        # number of determinizations a node needs before it can be complete, the same for the whole tree
+        self.MaxExpansion = max_expansion
+        # memory budget of the tree, None is unbounded: see EnforceMemoryBudget in MCTSNode
+        self.MaxNodes: int | None = None
+        self.MaxStates: int | None = None
+        self.Rave: RaveTable | None = None # AMAF statistics blended in the selection, None keeps plain UCB
+        self.StateCount = 0 # GameStates held by the nodes
+        self.PeakNodes = 0
+        self.PeakStates = 0
+        self.Visits         = np.zeros(capacity, dtype=np.int64)
+        self.TotalUtility   = np.zeros(capacity, dtype=np.float64)
+        self.AverageUtility = np.zeros(capacity, dtype=np.float64)
+        self.MaxUtility     = np.zeros(capacity, dtype=np.float64)
+        self.SquaredUtility = np.zeros(capacity, dtype=np.float64) # for the confidence bounds of the StoppingRule
+        self.ParentIndex    = np.full(capacity, -1, dtype=np.int64)
+        self.CachedStates   = np.zeros(capacity, dtype=np.int32) # GameStates a node holds that can be replayed, so evicted
+
+    def Allocate(self, parent_index: int = -1, node: Any = None) -> int:
+        if len(self.FreeIndices) > 0:
+            index = self.FreeIndices.pop()
+        else:
+            if self.Size == len(self.Visits):
+                self.Grow()
+            index = self.Size
+            self.Size += 1
+            self.Nodes.append(None)
+        self.Nodes[index] = node
+        self.ParentIndex[index] = parent_index
+        self.Allocated += 1
+        self.PeakNodes = max(self.PeakNodes, self.LiveCount())
+        return index
+
+    def Free(self, indices: list[int]) -> None:
+        if len(indices) == 0:
+            return
+        for index in indices:
+            self.Nodes[index] = None
+        rows = np.array(indices, dtype=np.int64)
+        self.Visits[rows] = 0
+        self.TotalUtility[rows] = 0
+        self.AverageUtility[rows] = 0
+        self.MaxUtility[rows] = 0
+        self.SquaredUtility[rows] = 0
+        self.ParentIndex[rows] = -1
+        self.CachedStates[rows] = 0
+        self.FreeIndices.extend(indices)
+
+    def LiveCount(self) -> int:
+        return self.Size - len(self.FreeIndices)
+
+    def ResetPeaks(self) -> None:
+        self.PeakNodes = self.LiveCount()
+        self.PeakStates = self.StateCount
+
+    def OverBudget(self) -> bool:
+        return (self.MaxNodes is not None and self.LiveCount() > self.MaxNodes) or (self.MaxStates is not None and self.StateCount > self.MaxStates)
+
+    def Grow(self) -> None:
+        capacity = 2 * len(self.Visits)
+        self.Visits         = np.resize(self.Visits, capacity)
+        self.TotalUtility   = np.resize(self.TotalUtility, capacity)
+        self.AverageUtility = np.resize(self.AverageUtility, capacity)
+        self.MaxUtility     = np.resize(self.MaxUtility, capacity)
+        self.SquaredUtility = np.resize(self.SquaredUtility, capacity)
+        self.ParentIndex    = np.resize(self.ParentIndex, capacity)
+        self.CachedStates   = np.resize(self.CachedStates, capacity)
+        # np.resize fills the new cells repeating the old content
+        self.Visits[self.Size:] = 0
+        self.TotalUtility[self.Size:] = 0
+        self.AverageUtility[self.Size:] = 0
+        self.MaxUtility[self.Size:] = 0
+        self.SquaredUtility[self.Size:] = 0
+        self.ParentIndex[self.Size:] = -1
+        self.CachedStates[self.Size:] = 0
+
+    def Update(self, indices: np.ndarray, utilityValues: list[float]) -> None:
+        # every node in indices receives the whole batch of utilities
+        self.Visits[indices] += len(utilityValues)
+        self.TotalUtility[indices] += sum(utilityValues)
+        self.SquaredUtility[indices] += sum(u * u for u in utilityValues)
+        self.AverageUtility[indices] = self.TotalUtility[indices] / self.Visits[indices]
+        self.MaxUtility[indices] = np.maximum(self.MaxUtility[indices], max(utilityValues))
+
+    def UpdatePaths(self, indices: np.ndarray, counts: np.ndarray, sums: np.ndarray, squares: np.ndarray, maxes: np.ndarray) -> None:
+        # indices may repeat (paths sharing a prefix), np.ufunc.at accumulates the repeated entries in a single write
+        np.add.at(self.Visits, indices, counts)
+        np.add.at(self.TotalUtility, indices, sums)
+        np.add.at(self.SquaredUtility, indices, squares)
+        np.maximum.at(self.MaxUtility, indices, maxes)
+        self.AverageUtility[indices] = self.TotalUtility[indices] / self.Visits[indices]
+
+    def UcbValues(self, indices: np.ndarray, parents_number_of_visit: int, c: float = math.sqrt(2), values: np.ndarray = None) -> np.ndarray:
+        # values replaces the average utility of the nodes as exploitation term, see RaveTable.Blend
+        visits = self.Visits[indices]
+        if parents_number_of_visit == 0:
+            return np.full(len(indices), np.inf)
+        ucb = np.full(len(indices), np.inf) # never seen nodes are explored first
+        seen = visits > 0
+        seen_visits = visits[seen]
+        exploitation = self.TotalUtility[indices[seen]] / seen_visits if values is None else values[seen]
+        ucb[seen] = exploitation + c * np.sqrt(math.log(parents_number_of_visit) / seen_visits)
+        return ucb
+
+    def SelectBest(self, indices: np.ndarray, parents_number_of_visit: int, values: np.ndarray = None) -> int:
+        # position in indices of the best UCB value, ties are broken at random
+        ucb = self.UcbValues(indices, parents_number_of_visit, values=values)
+        best = np.flatnonzero(ucb == ucb.max())
+        return int(best[0]) if len(best) == 1 else int(random.choice(best))
@@ -0,0 +1,88 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from threading import Lock
+from typing import Callable
+
+import numpy as np
+from scripts_of_tribute.board import GameState
+from scripts_of_tribute.enums import MoveEnum
+from scripts_of_tribute.move import BasicMove
+
+from MCTS.SimulationCache import CachedApplyMove
+
+
+# A playout policy picks the next move of a playout: policy(game_state, possible_moves, rng, seed) -> (move, successor).
+# successor is the (game_state, possible_moves) the policy already simulated for that move, the playout continues from
+# it instead of applying the move again; None when the policy did not simulate it.
+# The searches take one through their playout_policy argument, None keeps the uniform random playouts.
+
+class PlayoutPolicyEnum(Enum):
+    Random        = 1
+    Greedy        = 2
+    EpsilonGreedy = 3
+
+
+def NonEndTurnMoves(possible_moves: list[BasicMove]) -> list[BasicMove]:
+    moves = [m for m in possible_moves if m.command != MoveEnum.END_TURN]
+    return moves if len(moves) > 0 else possible_moves
+
+
+class RandomPolicy:
+    def __call__(self, game_state: GameState, possible_moves: list[BasicMove], rng: random.Random = random, seed: int | None = None) -> tuple[BasicMove, tuple | None]:
+        return rng.choice(NonEndTurnMoves(possible_moves)), None
+
+
+# Plays the move whose next state scores best. The candidate states are simulated concurrently (apply_move waits
+# on the engine and releases the GIL) and scored together: batch_evaluation_function maps a list of states to an
+# array of utilities in one call, without it the evaluation function is applied state by state.
+class GreedyPolicy:
+    def __init__(self, evaluation_function: Callable, batch_evaluation_function: Callable[[list[GameState]], np.ndarray] = None, max_workers: int = 8):
+        self.EvaluationFunction = evaluation_function
+        self.BatchEvaluationFunction = batch_evaluation_function
+        self.MaxWorkers = max_workers
+        self.Executor: ThreadPoolExecutor | None = None
+        self.Lock = Lock() # the concurrent playouts share the policy
+
+    def Evaluate(self, game_states: list[GameState]) -> np.ndarray:
+        if self.BatchEvaluationFunction is not None:
+            return np.asarray(self.BatchEvaluationFunction(game_states), dtype=np.float64)
+        return np.fromiter((self.EvaluationFunction(gs) for gs in game_states), dtype=np.float64, count=len(game_states))
+
+    def __call__(self, game_state: GameState, possible_moves: list[BasicMove], rng: random.Random = random, seed: int | None = None) -> tuple[BasicMove, tuple | None]:
+        moves = NonEndTurnMoves(possible_moves)
+        if len(moves) == 1:
+            return moves[0], None
+        with self.Lock:
+            if self.Executor is None:
+                self.Executor = ThreadPoolExecutor(max_workers=self.MaxWorkers)
+        successors = list(self.Executor.map(lambda move: CachedApplyMove(game_state, move, seed), moves))
+        utilities = self.Evaluate([gs for gs, _ in successors])
+        best = np.flatnonzero(utilities == utilities.max())
+        i = int(best[0]) if len(best) == 1 else int(rng.choice(best))
+        return moves[i], successors[i]
+
+
+class EpsilonGreedyPolicy:
+    def __init__(self, greedy_policy: GreedyPolicy, epsilon: float = 0.2):
+        self.Greedy = greedy_policy
+        self.Random = RandomPolicy()
+        self.Epsilon = epsilon
+
+    def __call__(self, game_state: GameState, possible_moves: list[BasicMove], rng: random.Random = random, seed: int | None = None) -> tuple[BasicMove, tuple | None]:
+        if rng.random() < self.Epsilon:
+            return self.Random(game_state, possible_moves, rng, seed)
+        return self.Greedy(game_state, possible_moves, rng, seed)
+
+
+def MakePlayoutPolicy(kind: PlayoutPolicyEnum, evaluation_function: Callable, epsilon: float = 0.2,
+                      batch_evaluation_function: Callable[[list[GameState]], np.ndarray] = None):
+    match kind:
+        case PlayoutPolicyEnum.Random:
+            return RandomPolicy()
+        case PlayoutPolicyEnum.Greedy:
+            return GreedyPolicy(evaluation_function, batch_evaluation_function)
+        case PlayoutPolicyEnum.EpsilonGreedy:
+            return EpsilonGreedyPolicy(GreedyPolicy(evaluation_function, batch_evaluation_function), epsilon)
+        case _:
+            raise ValueError("Unknown playout policy")
@@ -6,15 +6,37 @@ from scripts_of_tribute.board import GameState
 from scripts_of_tribute.move import BasicMove
 
 from Helper.Logging import PrintLog
-from MCTS.MCTSNode import MCTSNode, Backpropagate, Playout, SelectChild
+from MCTS.Common import playout_cutoff
+from MCTS.MCTSNode import MCTSNode, EnforceMemoryBudget, BackpropagatePath, Playout, SelectChild, UpdateRave
+from MCTS.RaveTable import RaveTable
+from MCTS.SearchMetrics import SearchMetrics
+from MCTS.StoppingRule import StoppingRule
+from MCTS.TranspositionTable import TranspositionTable
 
 
 class ProgressiveMCTS:
-    def __init__(self, game_state: GameState, possible_moves: list[BasicMove], eval_function : Callable, seed:int = None):
+    def __init__(self, game_state: GameState, possible_moves: list[BasicMove], eval_function : Callable, seed:int = None, use_transposition_table: bool = True, root_node: MCTSNode = None, stopping_rule: StoppingRule = None,
+                 playout_depth: int | None = None, adaptive_playout_depth: bool = False,
+                 playout_policy: Callable = None, max_nodes: int | None = None, max_states: int | None = None,
+                 rave: bool = False, rave_k: float = 50):
         self.EvaluationFunction = eval_function
         self.PossibleMoves = possible_moves
         self.GameState = game_state
         self.Seed = seed if seed is not None else int(time.time()*1000) % (2**30)
+        self.UseTranspositionTable = use_transposition_table
+        self.RootNode = root_node # a subtree kept from a previous search, see MCTSNode.Reroot
+        self.PlayoutDepth = playout_depth # random moves before a playout is cut and scored, None plays until END_TURN
+        self.AdaptivePlayoutDepth = adaptive_playout_depth
+        self.PlayoutPolicy = playout_policy # None plays uniformly random moves, see PlayoutPolicy
+        self.StoppingRule = stopping_rule # None searches until the iteration or time budget is spent
+        # memory budget of the tree, see EnforceMemoryBudget; None is unbounded
+        self.MaxNodes = max_nodes
+        self.MaxStates = max_states
+        self.Rave = rave # all-moves-as-first statistics blended in the selection, see RaveTable
+        self.RaveK = rave_k
+        self.StoppedEarly = False
+        self.IterationsDone = 0
+        self.Metrics = SearchMetrics()
         self.EarlyStopping = False
         self.ElapsedTimeMs = 0
 
@@ -28,9 +50,17 @@ class ProgressiveMCTS:
     def MonteCarloSearch(self, max_iterations: int, given_time_ms: int) -> BasicMove:
         PrintLog("MCTS", f"Starting MCTS with {max_iterations} iterations and {given_time_ms} ms time limit", 2)
         start_time = time.perf_counter()
-
-        root_node = MCTSNode(None, None)  # ;root has no parent
-        root_node.ExpandRoot(self.GameState, self.PossibleMoves)
+        metrics = self.Metrics
+        metrics.Begin(self.RootNode.Store.Allocated if self.RootNode is not None else 0)
+
+        if self.RootNode is None:
+            self.RootNode = MCTSNode(None, None)  # ;root has no parent
+            self.RootNode.ExpandRoot(self.GameState, self.PossibleMoves)
+        root_node = self.RootNode
+        root_node.Store.MaxNodes, root_node.Store.MaxStates = self.MaxNodes, self.MaxStates
+        root_node.Store.ResetPeaks()
+        root_node.Store.Rave = (root_node.Store.Rave or RaveTable(self.RaveK)) if self.Rave else None # kept with a reused tree
+        transposition_table = TranspositionTable() if self.UseTranspositionTable else None
         for i in range(max_iterations):  # selection, expansion, simulation(Playout), backpropagation
 
             if self.EarlyStopping or self.CheckForEarlyStopping(start_time, given_time_ms):
@@ -39,23 +69,51 @@ class ProgressiveMCTS:
                          2)
                 break
 
+            if self.StoppingRule is not None and self.StoppingRule.Check(i, root_node.Children):
+                PrintLog("MCTS", f"Decision settled at iteration {i + 1}/{max_iterations}, elapsed time: {int(self.ElapsedTimeMs)}/{given_time_ms} ms", 2)
+                self.StoppedEarly = True
+                break
+
+            if root_node.Store.OverBudget():
+                dropped = EnforceMemoryBudget(root_node)
+                if transposition_table is not None:
+                    transposition_table.Discard(dropped)
+
+            self.IterationsDone += 1
+            lap = time.perf_counter()
             # Selection
             selected_child_node = root_node
+            path = [root_node]
             while  selected_child_node is not None and (selected_child_node.IsExpanded() or selected_child_node.IsTerminal()):
-                selected_child_node = SelectChild(selected_child_node.GenIncompleteChildren())
+                selected_child_node = SelectChild(selected_child_node.GenIncompleteChildren(), selected_child_node)
+                path.append(selected_child_node)
 
 
             if selected_child_node is None:
                 PrintLog("MCTS",f"the tree is fully explored, stopping at iteration {i + 1}/{max_iterations}, elapsed time: {int(self.ElapsedTimeMs)}/{given_time_ms - 150} ms",2)
                 break
 
+            metrics.ObserveDepth(len(path))
+            lap = metrics.Lap("selection", lap)
+
             # Expansion
-            child = selected_child_node.ProgressiveExpand(self.Seed)
+            child = selected_child_node.ProgressiveExpand(self.Seed, transposition_table)
+            lap = metrics.Lap("expansion", lap)
+            if child is None:
+                continue
 
             # Simulation and Backpropagation
-            terminal_game_state = Playout(child, self.EvaluationFunction,self.Seed)
+            max_depth = playout_cutoff(self.PlayoutDepth, self.AdaptivePlayoutDepth, start_time, given_time_ms)
+            played = [] if root_node.Store.Rave is not None else None
+            terminal_game_state = Playout(child, self.EvaluationFunction,self.Seed, max_depth=max_depth, policy=self.PlayoutPolicy, played=played)
+            lap = metrics.Lap("playout", lap)
             utilityValue = self.EvaluationFunction(terminal_game_state)
-            Backpropagate(child, utilityValue)
+            lap = metrics.Lap("evaluation", lap)
+            BackpropagatePath(path + [child], utilityValue)
+            UpdateRave(path + [child], played, [utilityValue])
+            metrics.Lap("backpropagation", lap)
+        metrics.ObserveMemory(root_node.Store.PeakNodes, root_node.Store.PeakStates)
+        metrics.End(self.IterationsDone, root_node.Store.Allocated, self.StoppedEarly)
 
         best_move = max(root_node.Children, key=lambda c: (c.AverageUtility, c.NumberOfVisits))
         return best_move.Move
@@ -0,0 +1,50 @@
+import math
+
+import numpy as np
+
+
+# All-moves-as-first statistics of a tree, keyed by move semantic id: every simulation credits its utility to each
+# move it played, in the tree or in the playout, wherever it was played. The card plays of a turn mostly commute,
+# so what a move is worth in one branch is a prior for the same move everywhere else in the tree.
+# The selection blends it into the node average with beta = sqrt(k / (3n + k)), which fades as the n visits of the node grow.
+class RaveTable:
+    def __init__(self, k: float = 50, capacity: int = 256):
+        self.K = k
+        self.Slots: dict[tuple, int] = {}
+        self.Visits       = np.zeros(capacity, dtype=np.int64)
+        self.TotalUtility = np.zeros(capacity, dtype=np.float64)
+
+    def Slot(self, semantic_id: tuple) -> int:
+        slot = self.Slots.get(semantic_id)
+        if slot is None:
+            slot = self.Slots[semantic_id] = len(self.Slots)
+            if slot == len(self.Visits):
+                self.Visits = np.concatenate([self.Visits, np.zeros(slot, dtype=np.int64)])
+                self.TotalUtility = np.concatenate([self.TotalUtility, np.zeros(slot, dtype=np.float64)])
+        return slot
+
+    def Update(self, semantic_ids: list[tuple], utilityValues: list[float]) -> None:
+        # a move played twice in the same simulation is credited once, as when it was first played
+        slots = np.fromiter((self.Slot(semantic_id) for semantic_id in dict.fromkeys(semantic_ids)), dtype=np.int64)
+        self.Visits[slots] += len(utilityValues)
+        self.TotalUtility[slots] += sum(utilityValues)
+
+    def Blend(self, semantic_ids: list[tuple], visits: np.ndarray, total_utility: np.ndarray) -> np.ndarray:
+        # node averages blended with the AMAF averages of their moves, moves never seen keep the node average
+        slots = np.fromiter((self.Slots.get(semantic_id, -1) for semantic_id in semantic_ids), dtype=np.int64, count=len(semantic_ids))
+        known = slots >= 0
+        amaf_visits = np.where(known, self.Visits[slots], 0)
+        amaf_total = np.where(known, self.TotalUtility[slots], 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(visits > 0, total_utility / visits, 0.0)
+            amaf_mean = np.where(amaf_visits > 0, amaf_total / amaf_visits, mean)
+        beta = np.sqrt(self.K / (3 * visits + self.K))
+        return (1 - beta) * mean + beta * amaf_mean
+
+    def BlendOne(self, semantic_id: tuple, visits: int, total_utility: float) -> float:
+        slot = self.Slots.get(semantic_id)
+        mean = total_utility / visits if visits > 0 else 0.0
+        if slot is None or self.Visits[slot] == 0:
+            return mean
+        beta = math.sqrt(self.K / (3 * visits + self.K))
+        return (1 - beta) * mean + beta * float(self.TotalUtility[slot] / self.Visits[slot])
@@ -0,0 +1,98 @@
+import time
+from threading import Lock
+
+from MCTS.SimulationCache import SIMULATION_CACHE, LATENCY_BUCKETS_MS, SimulationCache
+
+PHASES = ("selection", "expansion", "playout", "evaluation", "backpropagation")
+
+
+# What a MonteCarloSearch did to find its move, every search exposes one as Metrics (metrics in MCTS2).
+# Phases are timed with laps: t = metrics.Lap("selection", t) charges the time since t and returns the new start,
+# the root and tree parallel searches lap from their workers. Engine calls are read from the simulation cache
+# (its misses), they include the calls of anything else running in the process during the search.
+# Merge adds up the searches of a game, AsDict is the record written by the bots.
+class SearchMetrics:
+    def __init__(self, cache: SimulationCache = SIMULATION_CACHE):
+        self.Cache = cache
+        self.Searches = 0
+        self.Iterations = 0
+        self.NodesAllocated = 0
+        self.MaxDepth = 0
+        # peak size of the tree during the search, nodes and the GameStates they hold
+        self.PeakNodes = 0
+        self.PeakStates = 0
+        self.ApplyMoveCalls = 0
+        self.ApplyMoveLatency = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.PhaseTimeS = dict.fromkeys(PHASES, 0.0)
+        self.SearchTimeS = 0.0
+        self.StoppedEarly = 0
+        self.Lock = Lock()
+        # snapshots taken by Begin
+        self.StartTime = 0.0
+        self.StartNodes = 0
+        self.StartCalls = 0
+        self.StartLatency = list(self.ApplyMoveLatency)
+
+    def Begin(self, node_count: int = 0) -> None:
+        self.StartTime = time.perf_counter()
+        self.StartNodes = node_count
+        with self.Cache.Lock:
+            self.StartCalls = self.Cache.EngineCalls
+            self.StartLatency = list(self.Cache.EngineLatency)
+
+    def End(self, iterations: int, node_count: int = 0, stopped_early: bool = False) -> None:
+        self.Searches = 1
+        self.SearchTimeS = time.perf_counter() - self.StartTime
+        self.Iterations = iterations
+        self.NodesAllocated = node_count - self.StartNodes
+        self.StoppedEarly = int(stopped_early)
+        with self.Cache.Lock:
+            self.ApplyMoveCalls = self.Cache.EngineCalls - self.StartCalls
+            self.ApplyMoveLatency = [now - start for now, start in zip(self.Cache.EngineLatency, self.StartLatency)]
+
+    def Lap(self, phase: str, since: float) -> float:
+        now = time.perf_counter()
+        with self.Lock:
+            self.PhaseTimeS[phase] += now - since
+        return now
+
+    def ObserveDepth(self, depth: int) -> None:
+        if depth > self.MaxDepth:
+            self.MaxDepth = depth
+
+    def ObserveMemory(self, nodes: int, states: int) -> None:
+        self.PeakNodes = max(self.PeakNodes, nodes)
+        self.PeakStates = max(self.PeakStates, states)
+
+    def Merge(self, other: "SearchMetrics") -> None:
+        self.Searches += other.Searches
+        self.Iterations += other.Iterations
+        self.NodesAllocated += other.NodesAllocated
+        self.MaxDepth = max(self.MaxDepth, other.MaxDepth)
+        self.ObserveMemory(other.PeakNodes, other.PeakStates)
+        self.ApplyMoveCalls += other.ApplyMoveCalls
+        self.ApplyMoveLatency = [a + b for a, b in zip(self.ApplyMoveLatency, other.ApplyMoveLatency)]
+        for phase in PHASES:
+            self.PhaseTimeS[phase] += other.PhaseTimeS[phase]
+        self.SearchTimeS += other.SearchTimeS
+        self.StoppedEarly += other.StoppedEarly
+
+    def IterationsPerSecond(self) -> float:
+        return self.Iterations / self.SearchTimeS if self.SearchTimeS > 0 else 0.0
+
+    def AsDict(self) -> dict:
+        return {
+            "searches": self.Searches,
+            "iterations": self.Iterations,
+            "iterations_per_s": round(self.IterationsPerSecond(), 1),
+            "nodes_allocated": self.NodesAllocated,
+            "max_depth": self.MaxDepth,
+            "peak_nodes": self.PeakNodes,
+            "peak_game_states": self.PeakStates,
+            "stopped_early": self.StoppedEarly,
+            "search_time_ms": round(self.SearchTimeS * 1000, 1),
+            "phase_time_ms": {phase: round(seconds * 1000, 1) for phase, seconds in self.PhaseTimeS.items()},
+            "apply_move_calls": self.ApplyMoveCalls,
+            "apply_move_latency_buckets_ms": list(LATENCY_BUCKETS_MS) + [None],
+            "apply_move_latency_histogram": list(self.ApplyMoveLatency),
+        }
@@ -0,0 +1,45 @@
+import random
+from typing import Any
+
+
+# The determinization seeds of a search and, for every node, which of them it has already drawn.
+# Each node draws from its own lazy Fisher-Yates shuffle of the pool: a draw is O(1) and only the swapped
+# positions are stored, so the pool can hold tens of thousands of seeds without slowing the selection.
+class SeedPool:
+    def __init__(self, seeds: list[int]):
+        self.Seeds = seeds
+        self.Draws: dict[Any, list] = {} # node -> [number of seeds drawn, swapped positions]
+
+    def __len__(self) -> int:
+        return len(self.Seeds)
+
+    def DrawnCount(self, node: Any) -> int:
+        state = self.Draws.get(node)
+        return 0 if state is None else state[0]
+
+    def HasUnused(self, node: Any) -> bool:
+        return self.DrawnCount(node) < len(self.Seeds)
+
+    def Draw(self, node: Any) -> int | None:
+        state = self.Draws.get(node)
+        if state is None:
+            state = self.Draws[node] = [0, {}]
+        swaps = state[1]
+        while state[0] < len(self.Seeds):
+            drawn = state[0]
+            j = random.randrange(drawn, len(self.Seeds))
+            seed = self.Seeds[swaps.get(j, j)]
+            swaps[j] = swaps.pop(drawn, drawn)
+            state[0] = drawn + 1
+            # a transposition can hand a node a determinization it never drew
+            if seed not in node.GameStates:
+                return seed
+        return None
+
+    def Forget(self, nodes: list[Any]) -> None:
+        # nodes dropped or collapsed by EnforceMemoryBudget, a collapsed node draws from the whole pool again
+        for node in nodes:
+            self.Draws.pop(node, None)
+
+    def Clear(self) -> None:
+        self.Draws.clear()
@@ -0,0 +1,84 @@
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from threading import Lock
+
+from scripts_of_tribute.board import GameState
+from scripts_of_tribute.move import BasicMove
+
+from BotCommon.CommonCheck import obtain_move_semantic_id
+from BotCommon.Heuristics import CarryHandFeatures
+
+# upper edges (ms) of the engine latency histogram buckets, the last bucket is open
+LATENCY_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100)
+
+# Memoized layer around GameState.apply_move, for the seeded determinizations only.
+# Entries are keyed by (parent state_id, move semantic id, seed): the engine assigns a new state_id to every
+# simulated state, so the same prefix replayed from the same parent on the same seed hits the cache all the way down
+# (the expansions and playouts of DSingleTMCTS, DMultyTCTS and the searches given a seed, the GreedyPolicy candidates).
+# Calls with seed None go straight to the engine: the outcome is sampled anew on every call, caching it would turn
+# every unseeded playout into the same determinization. give_time's probe, Common.playout (MCTS2, ISMCTS) and the
+# unseeded searches' playouts are therefore never served from the cache.
+class SimulationCache:
+    def __init__(self, max_size: int = 50000):
+        self.MaxSize = max_size
+        self.Entries: OrderedDict[tuple, tuple[GameState, list[BasicMove]]] = OrderedDict()
+        self.Hits = 0
+        self.Misses = 0
+        # engine calls actually made (the misses) and their latency, never reset: SearchMetrics reads the deltas
+        self.EngineCalls = 0
+        self.EngineLatency = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.Lock = Lock()
+
+    def ApplyMove(self, game_state: GameState, move: BasicMove, seed: int | None = None) -> tuple[GameState, list[BasicMove]]:
+        if seed is None:
+            return self.EngineApplyMove(game_state, move, None)
+        key = (game_state.state_id, obtain_move_semantic_id(move), seed)
+        with self.Lock:
+            entry = self.Entries.get(key)
+            if entry is not None:
+                self.Entries.move_to_end(key)
+                self.Hits += 1
+        if entry is not None:
+            CarryHandFeatures(game_state, move, entry[0])
+            return entry[0], list(entry[1])
+
+        new_game_state, possible_moves = self.EngineApplyMove(game_state, move, seed)
+        with self.Lock:
+            self.Misses += 1
+            self.Entries[key] = (new_game_state, possible_moves)
+            if len(self.Entries) > self.MaxSize:
+                self.Entries.popitem(last=False)
+        return new_game_state, list(possible_moves)
+
+    def EngineApplyMove(self, game_state: GameState, move: BasicMove, seed: int | None) -> tuple[GameState, list[BasicMove]]:
+        start = time.perf_counter()
+        new_game_state, possible_moves = game_state.apply_move(move, seed)
+        latency_ms = (time.perf_counter() - start) * 1000
+        CarryHandFeatures(game_state, move, new_game_state)
+        with self.Lock:
+            self.EngineCalls += 1
+            self.EngineLatency[bisect_right(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        return new_game_state, possible_moves
+
+    def HitRate(self) -> float:
+        total = self.Hits + self.Misses
+        return self.Hits / total if total > 0 else 0.0
+
+    def ResetStatistics(self) -> None:
+        with self.Lock:
+            self.Hits = 0
+            self.Misses = 0
+
+    def Clear(self) -> None:
+        with self.Lock:
+            self.Entries.clear()
+            self.Hits = 0
+            self.Misses = 0
+
+
+# shared by all the MCTS variants, so the seeded simulations of one search are reused by the next ones of the turn
+SIMULATION_CACHE = SimulationCache()
+
+def CachedApplyMove(game_state: GameState, move: BasicMove, seed: int | None = None) -> tuple[GameState, list[BasicMove]]:
+    return SIMULATION_CACHE.ApplyMove(game_state, move, seed)
@@ -0,0 +1,46 @@
+import numpy as np
+
+
+# Statistical stopping rule on the root children: the search can return as soon as the child with the best
+# average utility is separated from every other one, its lower confidence bound above all their upper bounds.
+# Moves closer than the tolerance (relative to the best average) are equivalent, otherwise ties would never settle.
+class StoppingRule:
+    def __init__(self, z: float = 1.96, min_visits: int = 8, check_every: int = 16, tolerance: float = 0.01):
+        self.Z = z
+        self.Tolerance = tolerance
+        self.MinVisits = min_visits
+        self.CheckEvery = check_every
+
+    def ShouldCheck(self, iteration: int) -> bool:
+        return iteration > 0 and iteration % self.CheckEvery == 0
+
+    def IsSettled(self, visits: np.ndarray, total_utility: np.ndarray, squared_utility: np.ndarray) -> bool:
+        if len(visits) < 2:
+            return True
+        if visits.min() == 0:
+            return False
+        means = total_utility / visits
+        best = int(np.argmax(means))
+        if visits[best] < self.MinVisits:
+            return False
+        variances = np.maximum(squared_utility / visits - means ** 2, 0)
+        # UCB rarely goes back to bad moves: the few samples of theirs borrow the largest variance of the sampled ones
+        sampled = visits >= self.MinVisits
+        variances[~sampled] = variances[sampled].max()
+        bounds = self.Z * np.sqrt(variances / visits)
+        upper = means + bounds
+        upper[best] = -np.inf
+        return means[best] - bounds[best] + self.Tolerance * abs(means[best]) >= upper.max()
+
+    def Check(self, iteration: int, children: list) -> bool:
+        return self.ShouldCheck(iteration) and self.IsSettledNodes(children)
+
+    def IsSettledNodes(self, children: list) -> bool:
+        # children of an MCTSNode tree, their statistics are read from the NodeStore;
+        # complete children never visited (an END_TURN the selection skips) cannot change anymore and are left out
+        children = [child for child in children if child.NumberOfVisits > 0 or not child.IsComplete()]
+        if len(children) < 2:
+            return True
+        store = children[0].Store
+        indices = np.fromiter((child.Index for child in children), dtype=np.int64, count=len(children))
+        return self.IsSettled(store.Visits[indices], store.TotalUtility[indices], store.SquaredUtility[indices])
@@ -0,0 +1,34 @@
+from typing import Any
+
+from scripts_of_tribute.board import GameState
+
+from BotCommon.CommonCheck import obtain_state_semantic_id
+
+
+# Maps a canonical state id to the first tree node that reached it.
+# Within one turn, playing card A then B usually reaches the same state as B then A: the searches use this table to
+# redirect the later edge to the known node, so the two move orders share statistics and children.
+class TranspositionTable:
+    def __init__(self):
+        self.Entries: dict[tuple, Any] = {}
+        self.Hits = 0
+
+    def GetOrRegister(self, game_state: GameState, node: Any) -> Any:
+        key = obtain_state_semantic_id(game_state)
+        known_node = self.Entries.get(key)
+        if known_node is None:
+            self.Entries[key] = node
+            return node
+        if known_node is not node:
+            self.Hits += 1
+        return known_node
+
+    def Discard(self, nodes: list[Any]) -> None:
+        # nodes dropped from the tree by EnforceMemoryBudget must not be handed out again
+        if len(nodes) == 0:
+            return
+        dropped = set(nodes)
+        self.Entries = {key: node for key, node in self.Entries.items() if node not in dropped}
+
+    def __len__(self) -> int:
+        return len(self.Entries)
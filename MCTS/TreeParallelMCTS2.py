@@ -0,0 +1,60 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from scripts_of_tribute.move import BasicMove
+
+from Helper.Logging import PrintLog
+from MCTS.StoppingRule import StoppingRule
+from MCTS.mcts2 import MCTS2, RootNode
+
+
+# Tree parallel MCTS2: several workers descend the same tree at once.
+# The tree is only modified under tree_lock, while the engine calls and the playouts run concurrently;
+# the virtual loss left on the path of a running playout steers the other workers to different branches.
+class TreeParallelMCTS2(MCTS2):
+    def __init__(self, game_state, possible_moves, player_id, evaluation_function, seed = None, use_transposition_table: bool = True, root: RootNode = None,
+                 workers: int = 4, virtual_loss: int = 1, stopping_rule: StoppingRule = None, playout_depth: int | None = None, adaptive_playout_depth: bool = False,
+                 playout_policy = None):
+        super().__init__(game_state, possible_moves, player_id, evaluation_function, seed, use_transposition_table, root, stopping_rule,
+                         playout_depth, adaptive_playout_depth, playout_policy)
+        self.workers = workers
+        self.virtual_loss = virtual_loss
+        self.tree_lock = Lock()
+        self.iterations_started = 0
+
+    def worker(self, max_iterations: int, given_time: int, start_time: float):
+        while True:
+            elapsed_time_ms = (time.perf_counter() - start_time) * 1000
+            if given_time - elapsed_time_ms < 50:
+                return
+            with self.tree_lock:
+                if self.iterations_started >= max_iterations:
+                    return
+                self.iterations_started += 1
+                iteration = self.iterations_started - 1
+            if self.check_settled_decision(iteration):
+                return
+
+            self.iteration()
+
+            with self.tree_lock:
+                self.iterations_done += 1
+
+    def MonteCarloSearch(self, max_iterations:int, given_time:int) -> BasicMove:
+        PrintLog(f"MCTS", f"start move choice with {len(self.root.possible_moves)} possible moves and {max_iterations} iterations with {given_time} ms time limit on {self.workers} workers",1)
+        start_time = time.perf_counter()
+        self.start_time, self.given_time = start_time, given_time
+        self.metrics.Begin(self.nodes_allocated)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.worker, max_iterations, given_time, start_time) for _ in range(self.workers)]
+            for future in futures:
+                future.result() # re-raise the errors of the workers
+        self.metrics.ObserveMemory(self.nodes_allocated, 1)
+        self.metrics.End(self.iterations_done, self.nodes_allocated, self.stopped_early)
+
+        if self.stopped_early:
+            PrintLog("MCTS", f"Decision settled after {self.iterations_done} iterations", 2)
+        self.log_iteration_rate(start_time)
+        return self.best_root_move(given_time)
@@ -1,15 +1,22 @@
 from __future__ import annotations
 
 import time
+from contextlib import nullcontext
 
 from scripts_of_tribute.board import GameState
 from scripts_of_tribute.move import BasicMove
 from scripts_of_tribute.enums import MoveEnum
 from BotCommon.CommonCheck import obtain_move_semantic_id
 from Helper.Logging import PrintLog
-from MCTS.Common import calculate_ucb, playout
+from MCTS.Common import calculate_ucb, playout, playout_cutoff
+from MCTS.SearchMetrics import SearchMetrics
+from MCTS.SimulationCache import CachedApplyMove
+from MCTS.StoppingRule import StoppingRule
+from MCTS.TranspositionTable import TranspositionTable
 import random
 
+import numpy as np
+
 
 class Node:
     def __init__(self):
@@ -17,6 +24,9 @@ class Node:
         # for ucb calculations
         self.number_of_playouts = 0
         self.total_utility = 0
+        self.squared_utility = 0 # for the confidence bounds of the StoppingRule
+        # playouts still running below this node, only used by the tree parallel search
+        self.virtual_loss = 0
 
     def expand(self, move: BasicMove, semantic_id: tuple):
         child = NotRootNode(self, move)
@@ -37,30 +47,40 @@ class NotRootNode(Node):
         super().__init__()
         self.parent: Node = parent
         self.parent_move: BasicMove = parent_move
+        # descents through the parent where this move was legal, the node is created on one; only ISMCTS reads it
+        self.availability = 1
 
-    def calculate_ucb(self):
-        return calculate_ucb(self.total_utility, self.number_of_playouts, self.parent.number_of_playouts)
+    def calculate_ucb(self, parent: Node = None):
+        # with transpositions a node can be reached from several parents, the one on the current path is used
+        parent = parent if parent is not None else self.parent
+        # virtual loss: running playouts count as visits with no utility, so parallel workers are steered apart
+        return calculate_ucb(self.total_utility, self.number_of_playouts + self.virtual_loss, parent.number_of_playouts + parent.virtual_loss)
 
     def back_propagation(self, utility):
-        current_node = self
-        while current_node is not None:
+        current_node: Node = self
+        while isinstance(current_node, NotRootNode):
             current_node.number_of_playouts += 1
             current_node.total_utility += utility
+            current_node.squared_utility += utility * utility
+            current_node = current_node.parent
+        current_node.number_of_playouts += 1 # the root
+        current_node.total_utility += utility
+        current_node.squared_utility += utility * utility
 
-            if hasattr(current_node, 'parent'):
-                current_node = current_node.parent
-            else:
-                current_node = None
-
-    def update_parent_move(self, moves: list[BasicMove]):
-        parent_move_semantic_id = obtain_move_semantic_id(self.parent_move)
-        for move in moves:
-            semantic_id = obtain_move_semantic_id(move)
-            if semantic_id == parent_move_semantic_id:
-                self.parent_move = move
-                return
-
-        raise ValueError("parent move not found")
+    @staticmethod
+    def back_propagation_path(path: list[Node], utility, virtual_loss: int = 0):
+        # used when the tree can contain transpositions: a node's parent is not necessarily the one the selection came from
+        for node in path:
+            node.number_of_playouts += 1
+            node.total_utility += utility
+            node.squared_utility += utility * utility
+            node.virtual_loss -= virtual_loss
+
+    def update_parent_move(self, moves_by_semantic_id: dict[tuple, BasicMove]):
+        move = moves_by_semantic_id.get(obtain_move_semantic_id(self.parent_move))
+        if move is None:
+            raise ValueError("parent move not found")
+        self.parent_move = move
 
 class RootNode(Node):
     def __init__(self, game_state, possible_moves):
@@ -68,60 +88,130 @@ class RootNode(Node):
         self.game_state: GameState = game_state
         self.possible_moves: list[BasicMove] = possible_moves
 
+    @staticmethod
+    def from_subtree(root: Node, moves: list[BasicMove], game_state: GameState, possible_moves: list[BasicMove]) -> RootNode | None:
+        # follows the moves played since root was searched and turns the reached subtree into the new root
+        node = root
+        for move in moves:
+            node = node.children.get(obtain_move_semantic_id(move))
+            if node is None:
+                return None
+
+        new_root = RootNode(game_state, possible_moves)
+        new_root.number_of_playouts = node.number_of_playouts
+        new_root.total_utility = node.total_utility
+        new_root.squared_utility = node.squared_utility
+        available_moves = {obtain_move_semantic_id(move): move for move in possible_moves}
+        for semantic_id, child in node.children.items():
+            if semantic_id not in available_moves:
+                continue
+            if child.parent is node: # transposed children keep the parent they were created from
+                child.update_parent_move(available_moves)
+                child.parent = new_root
+            new_root.children[semantic_id] = child
+        return new_root
+
 class MCTS2:
-    def __init__(self, game_state, possible_moves, player_id, evaluation_function, seed = None):
-        self.root = RootNode(game_state, possible_moves)
+    def __init__(self, game_state, possible_moves, player_id, evaluation_function, seed = None, use_transposition_table: bool = True, root: RootNode = None,
+                 stopping_rule: StoppingRule = None, playout_depth: int | None = None, adaptive_playout_depth: bool = False,
+                 playout_policy = None):
+        self.root = root if root is not None else RootNode(game_state, possible_moves)
+        self.transposition_table = TranspositionTable() if use_transposition_table else None
         self.player_id = player_id
         self.evaluation_function = evaluation_function
         self.seed = seed
+        # tree parallel searches replace these with a real lock and a positive virtual loss
+        self.tree_lock = nullcontext()
+        self.virtual_loss = 0
+        self.iterations_done = 0
+        self.nodes_allocated = 0
+        self.metrics = SearchMetrics()
+        self.stopping_rule = stopping_rule # None searches until the iteration or time budget is spent
+        self.stopped_early = False
+        self.playout_depth = playout_depth # random moves before a playout is cut and scored, None plays until END_TURN
+        self.adaptive_playout_depth = adaptive_playout_depth
+        self.playout_policy = playout_policy # None plays uniformly random moves, see PlayoutPolicy
+        self.start_time = time.perf_counter()
+        self.given_time = 0
         random.seed(16)
 
     def evaluation(self, game_state: GameState) -> float:
         return self.evaluation_function(game_state)
 
-    def playout_and_back_prop(self, node, game_state):
-        terminal_game_state = playout(node.parent_move, game_state, self.player_id)
+    def playout_and_back_prop(self, move, game_state, path, lap: float):
+        max_depth = playout_cutoff(self.playout_depth, self.adaptive_playout_depth, self.start_time, self.given_time)
+        terminal_game_state = playout(move, game_state, self.player_id, max_depth=max_depth, policy=self.playout_policy)
+        lap = self.metrics.Lap("playout", lap)
         utility = self.evaluation(terminal_game_state)
-        node.back_propagation(utility)
+        lap = self.metrics.Lap("evaluation", lap)
+        with self.tree_lock:
+            NotRootNode.back_propagation_path(path, utility, self.virtual_loss)
+        self.metrics.Lap("backpropagation", lap)
+
+    def enter_node(self, node: Node, path: list[Node]):
+        node.virtual_loss += self.virtual_loss
+        path.append(node)
 
     def iteration(self):
+        # the descent interleaves selection, expansion and the engine calls, it is timed as selection
+        lap = time.perf_counter()
         actual_node = self.root
         actual_game_state = self.root.game_state
         actual_possible_moves = self.root.possible_moves
 
-        new_child = None
-        while new_child is None:
+        path: list[Node] = []
+        with self.tree_lock:
+            self.enter_node(actual_node, path)
+
+        # the tree is only touched under tree_lock, the engine calls and the playout run outside of it
+        while True:
             if actual_game_state.current_player.player_id != self.player_id:
                 raise ValueError("Searching too deep")
 
-            new_child: NotRootNode | None = actual_node.search_unexpanded_child(actual_possible_moves)
-
-            if new_child is None:
-                actual_node = MCTS2.selection(actual_node.children, actual_possible_moves)
-
-                actual_node.update_parent_move(actual_possible_moves)
-
-                if actual_node.parent_move.command == MoveEnum.END_TURN:
-                    self.playout_and_back_prop(actual_node, actual_game_state)
+            with self.tree_lock:
+                new_child: NotRootNode | None = actual_node.search_unexpanded_child(actual_possible_moves)
+                if new_child is not None:
+                    self.nodes_allocated += 1
+                    self.enter_node(new_child, path)
+                    playout_move = new_child.parent_move
                     break
 
-                try:
-                    actual_game_state, actual_possible_moves = actual_game_state.apply_move(actual_node.parent_move, self.seed)
-                except Exception as e:
-                    print(e)
-                    raise ValueError (f"problems with apply_move, Move: {actual_node.parent_move} ")
+                parent_node = actual_node
+                actual_node, actual_move = self.selection(parent_node, actual_possible_moves)
+                self.enter_node(actual_node, path)
 
-            elif new_child is not None:
-                self.playout_and_back_prop(new_child, actual_game_state)
+            if actual_move.command == MoveEnum.END_TURN:
+                playout_move = actual_move
+                break
+
+            try:
+                actual_game_state, actual_possible_moves = CachedApplyMove(actual_game_state, actual_move, self.seed)
+            except Exception as e:
+                print(e)
+                raise ValueError (f"problems with apply_move, Move: {actual_move} ")
+
+            # root children are never merged, the best move is read from them
+            if self.transposition_table is not None and parent_node is not self.root:
+                with self.tree_lock:
+                    known_node = self.transposition_table.GetOrRegister(actual_game_state, actual_node)
+                    if known_node is not actual_node and known_node not in path: # a no-op move would otherwise close a cycle
+                        parent_node.children[obtain_move_semantic_id(actual_move)] = known_node
+                        actual_node.virtual_loss -= self.virtual_loss
+                        known_node.virtual_loss += self.virtual_loss
+                        actual_node = known_node
+                        path[-1] = known_node
+
+        self.metrics.ObserveDepth(len(path) - 1)
+        self.playout_and_back_prop(playout_move, actual_game_state, path, self.metrics.Lap("selection", lap))
 
     @staticmethod
-    def selection (nodes: dict[tuple, NotRootNode], possible_moves: list[BasicMove]) -> NotRootNode:
-        actual_children: list[NotRootNode] = []
+    def selection (parent: Node, possible_moves: list[BasicMove]) -> tuple[NotRootNode, BasicMove]:
+        nodes = parent.children
+        actual_children: list[tuple[NotRootNode, BasicMove]] = []
         for possible_move in possible_moves:
-            semantic_id = obtain_move_semantic_id(possible_move)
-            if semantic_id in nodes.keys():
-                actual_child = nodes[semantic_id]
-                actual_children.append(actual_child)
+            actual_child = nodes.get(obtain_move_semantic_id(possible_move))
+            if actual_child is not None:
+                actual_children.append((actual_child, possible_move))
 
         if len(actual_children) == 0:
             print(len(actual_children))
@@ -129,20 +219,40 @@ class MCTS2:
             print(len(possible_moves))
             raise ValueError("no actual child found")
 
-        best_node = actual_children[0]
+        best_node, best_move = actual_children[0]
         best_ucb = float('-inf')
 
-        for node in actual_children:
-            ucb = node.calculate_ucb()
+        for node, move in actual_children:
+            ucb = node.calculate_ucb(parent)
             if ucb > best_ucb:
-                best_node = node
+                best_node, best_move = node, move
                 best_ucb = ucb
 
-        return best_node
+        return best_node, best_move
+
+    def check_settled_decision(self, iteration: int) -> bool:
+        if self.stopping_rule is None or not self.stopping_rule.ShouldCheck(iteration):
+            return self.stopped_early
+        with self.tree_lock:
+            children = list(self.root.children.values())
+            if len(children) < len(self.root.possible_moves):
+                return False # some root moves were never tried
+            visits = np.array([child.number_of_playouts for child in children], dtype=np.float64)
+            total_utility = np.array([child.total_utility for child in children], dtype=np.float64)
+            squared_utility = np.array([child.squared_utility for child in children], dtype=np.float64)
+        self.stopped_early = self.stopped_early or self.stopping_rule.IsSettled(visits, total_utility, squared_utility)
+        return self.stopped_early
+
+    def log_iteration_rate(self, start_time: float):
+        elapsed_time_ms = (time.perf_counter() - start_time) * 1000
+        rate = self.iterations_done / (elapsed_time_ms / 1000) if elapsed_time_ms > 0 else 0
+        PrintLog("MCTS", f"{self.iterations_done} iterations in {int(elapsed_time_ms)} ms ({rate:.1f} iterations/s)", 2)
 
     def MonteCarloSearch(self, max_iterations:int, given_time:int) -> BasicMove:
         PrintLog(f"MCTS", f"start move choice with {len(self.root.possible_moves)} possible moves and {max_iterations} iterations with {given_time} ms time limit",1)
         start_time = time.perf_counter()
+        self.start_time, self.given_time = start_time, given_time
+        self.metrics.Begin(self.nodes_allocated)
         for i in range(max_iterations):
             elapsed_time_ms = (time.perf_counter() - start_time) * 1000
             if given_time - elapsed_time_ms < 50:
@@ -150,18 +260,28 @@ class MCTS2:
                          f"Early stopping at iteration {i + 1}/{max_iterations}, elapsed time: {int(elapsed_time_ms)}/{given_time} ms",
                          2)
                 break
+            if self.check_settled_decision(i):
+                PrintLog("MCTS", f"Decision settled at iteration {i + 1}/{max_iterations}, elapsed time: {int(elapsed_time_ms)}/{given_time} ms", 2)
+                break
             self.iteration()
+            self.iterations_done += 1
+
+        self.metrics.ObserveMemory(self.nodes_allocated, 1) # only the root holds a GameState, the others are replayed through the cache
+        self.metrics.End(self.iterations_done, self.nodes_allocated, self.stopped_early)
+        self.log_iteration_rate(start_time)
+        return self.best_root_move(given_time)
 
+    def best_root_move(self, given_time:int) -> BasicMove:
         best_move = random.choice(self.root.possible_moves)
         best_utility = float('-inf')
 
         if len(self.root.children.values()) != len(self.root.possible_moves):
             PrintLog(f"MCTS", f"didn't have time to check all the move, given time: {given_time}",1)
 
-        nodes = self.root.children.values()
-        for node in nodes:
+        moves = {obtain_move_semantic_id(move): move for move in self.root.possible_moves}
+        for semantic_id, node in self.root.children.items():
             if node.total_utility > best_utility:
                 best_utility = node.total_utility
-                best_move = node.parent_move
+                best_move = moves[semantic_id]
 
         return best_move
\ No newline at end of file
@@ -1,21 +1,32 @@
 import random
 import time
+
+import numpy as np
 from scripts_of_tribute.base_ai import BaseAI
 from scripts_of_tribute.board import GameState, EndGameState
 from scripts_of_tribute.enums import MoveEnum, PlayerEnum
 from scripts_of_tribute.move import BasicMove
 
-from BotCommon.CommonCheck import IsPriorMoves, MakePriorChoice
+from BotCommon.CommonCheck import BestMove, IsPriorMoves, MakePriorChoice
+from BotCommon.EvaluationCache import MakeEvaluationCache
+from BotCommon.Heuristics import BatchEvaluationFunction, PrimeHandFeatures
 from Helper.Logging import PrintLog
-from Helper.Logging import LogEndOfGame
+from Helper.Logging import LogEndOfGame, LogSearchMetrics
 from MCTS.DMultyTMCTS import DMultyTCTS
 from MCTS.DSingleTMCTS import DSingleTMCTS
 from MCTS.FlatMCTS import FlatMCTS
+from MCTS.ISMCTS import ISMCTS
 from MCTS.ClassicMCTS import MCTS
 from MCTS.ProgressiveMCTS import ProgressiveMCTS
 
-from MCTS.mcts2 import MCTS2
+from MCTS.mcts2 import MCTS2, RootNode
+from MCTS.TreeParallelMCTS2 import TreeParallelMCTS2
+from MCTS.BranchingModel import BRANCHING_MODEL, BranchingModel, TotalFactor
 from MCTS.Common import give_time
+from MCTS.SimulationCache import SIMULATION_CACHE
+from MCTS.SearchMetrics import SearchMetrics
+from MCTS.StoppingRule import StoppingRule
+from MCTS.PlayoutPolicy import PlayoutPolicyEnum, MakePlayoutPolicy
 
 from enum import Enum
 
@@ -26,22 +37,55 @@ class MCTSenum(Enum):
     ProgressiveMCTS     = 4
     DMultyTMCTS             = 5
     DSingleTMCTS             = 6
+    TreeParallelMCTS2   = 7
+    ISMCTS              = 8
 
 
 class AIFBotMCTS(BaseAI):
 
     ## ========================SET UP========================
-    def __init__(self, bot_name, evaluation_function, max_iteration = 200, weights=None, functions=None, seed=None, MCTSversion: MCTSenum = MCTSenum.MCTS2 ):
+    def __init__(self, bot_name, evaluation_function, max_iteration = 200, weights=None, functions=None, seed=None, MCTSversion: MCTSenum = MCTSenum.MCTS2, tree_reuse: bool = True, search_options: dict = None,
+                 early_stop: bool = False, stopping_rule: StoppingRule = None, playout_depth: int = None, adaptive_playout_depth: bool = False,
+                 playout_policy: PlayoutPolicyEnum = PlayoutPolicyEnum.Random, playout_epsilon: float = 0.2, batch_evaluation_function = None,
+                 evaluation_cache_size: int = 20000):
         super().__init__(bot_name)
         self.evaluation_function = evaluation_function
+        # scores a list of states in one call, derived from evaluation_function when not given
+        self.batch_evaluation_function = batch_evaluation_function if batch_evaluation_function is not None else BatchEvaluationFunction(evaluation_function)
+        # memoizes both by state fingerprint, only for the heuristics the fingerprint covers; 0 or None evaluates every state
+        self.EvaluationCache = MakeEvaluationCache(evaluation_function, self.batch_evaluation_function, evaluation_cache_size)
         self.MaxIteration = max_iteration
         self.player_id: PlayerEnum = PlayerEnum.NO_PLAYER_SELECTED
         self.start_of_game: bool = True
-        self.best_moves:list[BasicMove] = []
+        self.best_moves:list[BasicMove] = [] # moves played this turn since PreviousSearch was run
+        self.PreviousSearch = None
+        self.TreeReuse = tree_reuse
         self.seed      = seed
         self.Weights   = weights
         self.Functions = functions
         self.MCTSversion = MCTSversion
+        self.SearchOptions = search_options if search_options is not None else {} # extra arguments for the selected MCTS class
+
+        # branching actually met this turn, compared with the BranchingModel prediction made at its first move
+        self.TurnFeatures = None
+        self.TurnPrediction = None
+        self.TurnBranching: list[int] = []
+        BRANCHING_MODEL.Load()
+
+        # with early_stop or a stopping_rule the searches return once their decision is settled, the time they did not use goes to the next decisions of the turn
+        self.StoppingRule = stopping_rule if stopping_rule is not None else (StoppingRule() if early_stop else None)
+        self.BankedTimeMs = 0
+        self.EarlyStops = 0
+        self.TimeSavedMs = 0
+
+        # truncated playouts: random moves before a playout is cut and scored with the evaluation function, None plays the whole turn;
+        # informed playouts pick their moves with the bot's own utility function
+        policy = None if playout_policy == PlayoutPolicyEnum.Random else MakePlayoutPolicy(playout_policy, self.UtilityFunction, playout_epsilon, self.UtilityFunctions)
+        self.PlayoutOptions = {"playout_depth": playout_depth, "adaptive_playout_depth": adaptive_playout_depth, "playout_policy": policy}
+        self.PlayoutPolicyKind = playout_policy
+
+        # metrics of the searches of the current game, written out by game_end
+        self.GameMetrics = SearchMetrics()
 
     def select_patron(self, available_patrons):
         pick = random.choice(available_patrons)
@@ -50,16 +94,44 @@ class AIFBotMCTS(BaseAI):
 
     ## ========================Functionality========================
     def UtilityFunction(self, game_state: GameState) -> float:
+        if self.EvaluationCache is not None:
+            return self.EvaluationCache(game_state, self.Weights, self.Functions, self.player_id)
         return self.evaluation_function(game_state, self.Weights, self.Functions, self.player_id)
 
+    def UtilityFunctions(self, game_states: list[GameState]) -> np.ndarray:
+        if self.EvaluationCache is not None:
+            return self.EvaluationCache.Batch(game_states, self.Weights, self.Functions, self.player_id)
+        return self.batch_evaluation_function(game_states, self.Weights, self.Functions, self.player_id)
+
+    def ReuseSearchTree(self, game_state: GameState, possible_moves:list[BasicMove]):
+        # re-root the previous search tree at the moves played since then, None if nothing can be reused
+        previous_search, self.PreviousSearch = self.PreviousSearch, None
+        if previous_search is None or not self.TreeReuse:
+            return None
+
+        match self.MCTSversion:
+            case MCTSenum.MCTS2 | MCTSenum.TreeParallelMCTS2 | MCTSenum.ISMCTS:
+                return RootNode.from_subtree(previous_search.root, self.best_moves, game_state, possible_moves)
+            case MCTSenum.DMultyTMCTS:
+                return [root.Reroot(self.best_moves, game_state, possible_moves) for root in previous_search.RootNodes]
+            case _:
+                return previous_search.RootNode.Reroot(self.best_moves, game_state, possible_moves)
+
     def play(self, game_state: GameState, possible_moves:list[BasicMove], remaining_time: int) -> BasicMove:
         #Set Up
         if self.start_of_game:
             self.player_id = game_state.current_player.player_id
             self.start_of_game = False
+        PrimeHandFeatures(game_state, self.evaluation_function) # carried to the simulated states, see CarryHandFeatures
+
+        if self.TurnFeatures is None:
+            self.TurnFeatures = BranchingModel.Features(game_state, possible_moves)
+            self.TurnPrediction = BRANCHING_MODEL.Predict(self.TurnFeatures)
+        if len(possible_moves) > 1:
+            self.TurnBranching.append(len(possible_moves) - 1)
 
         if len(possible_moves) == 1 and possible_moves[0].command == MoveEnum.END_TURN:
-            AIFBotMCTS.checks_before_return(possible_moves[0], remaining_time)
+            self.checks_before_return(possible_moves[0], remaining_time)
             return possible_moves[0]
 
         for move in possible_moves:
@@ -69,13 +141,13 @@ class AIFBotMCTS(BaseAI):
                 PrintLog("STATE",
                          f"coin {game_state.current_player.coins}, prestige: {game_state.current_player.prestige}, power: {game_state.current_player.power}",
                          1)
-                AIFBotMCTS.checks_before_return(move, remaining_time)
+                self.checks_before_return(move, remaining_time)
                 return move
 
-        best_choice = MakePriorChoice(game_state, possible_moves, self.UtilityFunction)
+        best_choice = MakePriorChoice(game_state, possible_moves, self.UtilityFunctions)
         if best_choice is not None:
             PrintLog(f"PRIOR", f"selected move {best_choice.command} over {len(possible_moves)} with {remaining_time} ms remaining",1)
-            AIFBotMCTS.checks_before_return(best_choice, remaining_time)
+            self.checks_before_return(best_choice, remaining_time)
             PrintLog("STATE",
                      f"coin {game_state.current_player.coins}, prestige: {game_state.current_player.prestige}, power: {game_state.current_player.power}",
                      1)
@@ -85,42 +157,59 @@ class AIFBotMCTS(BaseAI):
             if remaining_time < 1000:
                 if self.MaxIteration > 30:
                     self.MaxIteration -= 5
-                best_move = None
-                best_utility = float('-inf')
-                for move in possible_moves:
-                    new_game_state,_ = game_state.apply_move(move)
-                    move_utility = self.UtilityFunction(new_game_state)
-                    if move_utility > best_utility:
-                        best_utility = move_utility
-                        best_move = move
+                best_move = BestMove(game_state, possible_moves, self.UtilityFunctions)
+                self.checks_before_return(best_move, remaining_time)
                 return best_move
             else:
                 #Move Evaluation
                 start_time = time.perf_counter()
+                SIMULATION_CACHE.ResetStatistics()
 
                 time_to_give = give_time(game_state, possible_moves, int(remaining_time * (4/5)), self.player_id)
+                if self.BankedTimeMs > 0:
+                    time_to_give = min(time_to_give + self.BankedTimeMs, int(remaining_time * (4/5)))
+                    self.BankedTimeMs = 0
+
+                previous_search = self.PreviousSearch
+                reused_tree = self.ReuseSearchTree(game_state, possible_moves)
+                PrintLog("MCTS", f"search tree {'reused' if reused_tree is not None else 'rebuilt'} after {len(self.best_moves)} moves", 1)
+                # a reused tree holds states keyed by the determinizations it was searched on, the new search keeps them
+                search_options = self.SearchOptions
+                if reused_tree is not None and self.MCTSversion == MCTSenum.DSingleTMCTS:
+                    search_options = {**search_options, "seeds": list(previous_search.Seeds)}
+                elif reused_tree is not None and self.MCTSversion == MCTSenum.DMultyTMCTS:
+                    search_options = {**search_options, "tree_seeds": list(previous_search.TreeSeeds)}
 
                 monte_carlo_tree_search = None
                 match self.MCTSversion:
                     case MCTSenum.MCTS2:
-                        monte_carlo_tree_search = MCTS2(game_state, possible_moves, self.player_id,self.UtilityFunction, self.seed)
+                        monte_carlo_tree_search = MCTS2(game_state, possible_moves, self.player_id,self.UtilityFunction, self.seed, root=reused_tree, stopping_rule=self.StoppingRule, **self.PlayoutOptions, **self.SearchOptions)
+                    case MCTSenum.TreeParallelMCTS2:
+                        monte_carlo_tree_search = TreeParallelMCTS2(game_state, possible_moves, self.player_id,self.UtilityFunction, self.seed, root=reused_tree, stopping_rule=self.StoppingRule, **self.PlayoutOptions, **self.SearchOptions)
+                    case MCTSenum.ISMCTS:
+                        monte_carlo_tree_search = ISMCTS(game_state, possible_moves, self.player_id,self.UtilityFunction, self.seed, root=reused_tree, stopping_rule=self.StoppingRule, **self.PlayoutOptions, **self.SearchOptions)
                     case MCTSenum.FlatMCTS:
-                        monte_carlo_tree_search = FlatMCTS(game_state, possible_moves, self.UtilityFunction)
+                        monte_carlo_tree_search = FlatMCTS(game_state, possible_moves, self.UtilityFunction, root_node=reused_tree, stopping_rule=self.StoppingRule, **self.PlayoutOptions, **self.SearchOptions)
                     case MCTSenum.MCTS:
-                        monte_carlo_tree_search = MCTS(game_state, possible_moves, self.UtilityFunction)
+                        monte_carlo_tree_search = MCTS(game_state, possible_moves, self.UtilityFunction, root_node=reused_tree, stopping_rule=self.StoppingRule, **self.PlayoutOptions, **self.SearchOptions)
                     case MCTSenum.ProgressiveMCTS:
-                        monte_carlo_tree_search = ProgressiveMCTS(game_state, possible_moves, self.UtilityFunction)
+                        monte_carlo_tree_search = ProgressiveMCTS(game_state, possible_moves, self.UtilityFunction, root_node=reused_tree, stopping_rule=self.StoppingRule, **self.PlayoutOptions, **self.SearchOptions)
                     case MCTSenum.DMultyTMCTS:
-                        monte_carlo_tree_search = DMultyTCTS(game_state, possible_moves, self.UtilityFunction)
+                        monte_carlo_tree_search = DMultyTCTS(game_state, possible_moves, self.UtilityFunction, root_nodes=reused_tree, stopping_rule=self.StoppingRule, **self.PlayoutOptions, **search_options)
                     case MCTSenum.DSingleTMCTS:
-                        monte_carlo_tree_search = DSingleTMCTS(game_state, possible_moves, self.UtilityFunction)
+                        monte_carlo_tree_search = DSingleTMCTS(game_state, possible_moves, self.UtilityFunction, root_node=reused_tree, stopping_rule=self.StoppingRule, **self.PlayoutOptions, **search_options)
                     case _:
                         raise ValueError("Unknown MCTS version")
 
+                search_start_time = time.perf_counter()
                 best_move = monte_carlo_tree_search.MonteCarloSearch(self.MaxIteration, time_to_give)
+                self.RecordSearch(monte_carlo_tree_search, time_to_give, (time.perf_counter() - search_start_time) * 1000)
+                self.PreviousSearch = monte_carlo_tree_search
+                self.best_moves = []
 
                 elapsed_time_ms = (time.perf_counter() - start_time) * 1000
                 PrintLog("MCTS",f"selected move {best_move.command} in {elapsed_time_ms:.2f} ms over the {remaining_time} ms remaining and over {len(possible_moves)} moves",1)
+                PrintLog("CACHE",f"simulation cache hits: {SIMULATION_CACHE.Hits}, misses: {SIMULATION_CACHE.Misses}, hit rate: {SIMULATION_CACHE.HitRate():.2%}",1)
                 PrintLog("STATE",f"coin {game_state.current_player.coins}, prestige: {game_state.current_player.prestige}, power: {game_state.current_player.power}",1)
         elif len(possible_moves) == 1:
             best_move = possible_moves[0]
@@ -134,15 +223,70 @@ class AIFBotMCTS(BaseAI):
             best_move = next(move for move in possible_moves if move.command == MoveEnum.END_TURN)
             PrintLog("MCTS","best_move was None, returning end of turn",1)
 
-        AIFBotMCTS.checks_before_return(best_move, remaining_time)
+        self.checks_before_return(best_move, remaining_time)
         return best_move
 
-    @staticmethod
-    def checks_before_return(move:BasicMove, remaining_time):
+    def checks_before_return(self, move:BasicMove, remaining_time):
+        if move.command == MoveEnum.END_TURN:
+            # the next search starts a new turn, the previous tree cannot be reused
+            self.PreviousSearch = None
+            self.best_moves = []
+            self.EndTurnBranching()
+            self.BankedTimeMs = 0
+        else:
+            self.best_moves.append(move)
+
         if remaining_time is not None and move.command == MoveEnum.END_TURN:
             PrintLog(f"END", f"remaining time: {remaining_time} ms", 0)
 
 
+    def RecordSearch(self, search, time_to_give: int, search_time_ms: float):
+        # metrics of the game and time banking of the turn
+        self.GameMetrics.Merge(search.metrics if isinstance(search, MCTS2) else search.Metrics)
+        stopped_early = search.stopped_early if isinstance(search, MCTS2) else search.StoppedEarly
+        if not stopped_early:
+            return
+        saved_ms = max(0, int(time_to_give - search_time_ms))
+        self.BankedTimeMs += saved_ms
+        self.EarlyStops += 1
+        self.TimeSavedMs += saved_ms
+        PrintLog("TIME", f"decision settled early, {saved_ms} ms banked for the rest of the turn", 1)
+
+    def EndTurnBranching(self):
+        if self.TurnFeatures is not None and len(self.TurnBranching) > 0:
+            actual = f"{len(self.TurnBranching)} moves (factor {TotalFactor(self.TurnBranching):.2f})"
+            if self.TurnPrediction is not None:
+                predicted_factor, predicted_moves = self.TurnPrediction
+                PrintLog("TIME", f"turn predicted {predicted_moves:.1f} moves (factor {predicted_factor:.2f}), actual {actual}", 1)
+            else:
+                PrintLog("TIME", f"turn without prediction, actual {actual}", 1)
+            BRANCHING_MODEL.Update(self.TurnFeatures, self.TurnBranching)
+        self.TurnFeatures = None
+        self.TurnPrediction = None
+        self.TurnBranching = []
+
     def game_end(self, end_game_state: EndGameState, final_state: GameState):
+        SIMULATION_CACHE.Clear()
+        BRANCHING_MODEL.Save()
+        PrintLog("TIME", f"{self.EarlyStops} searches stopped early, {self.TimeSavedMs} ms saved", 0)
+        metrics = self.GameMetrics
+        PrintLog("MCTS", f"{metrics.Iterations} iterations in {int(metrics.SearchTimeS * 1000)} ms of search ({metrics.IterationsPerSecond():.1f} iterations/s), playout depth {self.PlayoutOptions['playout_depth']}", 0)
+        LogSearchMetrics(self.bot_name, {
+            "mcts_version": self.MCTSversion.name,
+            "max_iterations": self.MaxIteration,
+            "playout_depth": self.PlayoutOptions["playout_depth"],
+            "adaptive_playout_depth": self.PlayoutOptions["adaptive_playout_depth"],
+            "playout_policy": self.PlayoutPolicyKind.name,
+            "winner": str(end_game_state.winner),
+            "time_saved_ms": self.TimeSavedMs,
+            **metrics.AsDict(),
+            **(self.EvaluationCache.AsDict() if self.EvaluationCache is not None else {}),
+        })
+        if self.EvaluationCache is not None:
+            cache = self.EvaluationCache
+            PrintLog("CACHE", f"evaluation cache hits: {cache.Hits}, misses: {cache.Misses}, hit rate: {cache.HitRate():.2%}, evictions: {cache.Evictions}", 0)
+            cache.Clear()
+        self.GameMetrics = SearchMetrics()
+        self.EarlyStops, self.TimeSavedMs = 0, 0
         LogEndOfGame(self.bot_name,end_game_state, final_state)
 
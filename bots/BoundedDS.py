@@ -8,20 +8,26 @@ from scripts_of_tribute.enums import MoveEnum, PlayerEnum
 from scripts_of_tribute.move import BasicMove
 
 from BotCommon.CommonCheck import NewPossibleMoveAvailable, CheckForGoalState, IsPriorMoves, MakePriorChoice
-from BotCommon.Heuristics import GameStateEvaluatorUtility
-from Helper.Logging import LogEndOfGame
+from BotCommon.Heuristics import BatchEvaluationFunction, CarryHandFeatures, GameStateEvaluatorUtility, GameStatesEvaluatorUtility, PrimeHandFeatures
+from BotCommon.EvaluationCache import MakeEvaluationCache
+from Helper.Logging import LogEndOfGame, PrintLog
 from HeuristicLearning import RESULTS_PATH
 
 
 class BoundedDS(BaseAI):
 
     ## ========================SET UP========================
-    def __init__(self, bot_name: str, depth:int, evaluation_function:GameStateEvaluatorUtility, weights:np.ndarray=None, functions:list[str] = None, use_prior_move: bool = False, seed=None):
+    def __init__(self, bot_name: str, depth:int, evaluation_function:GameStateEvaluatorUtility, weights:np.ndarray=None, functions:list[str] = None, use_prior_move: bool = False, seed=None,
+                 batch_evaluation_function:GameStatesEvaluatorUtility = None, evaluation_cache_size: int = 20000):
         super().__init__(bot_name)
         self.player_id: PlayerEnum = PlayerEnum.NO_PLAYER_SELECTED
         self.start_of_game: bool = True
         self.depth: int = depth
         self.evaluation_function =  evaluation_function
+        # scores the leaves below a node in one call, derived from evaluation_function when not given
+        self.batch_evaluation_function = batch_evaluation_function if batch_evaluation_function is not None else BatchEvaluationFunction(evaluation_function)
+        # memoizes both by state fingerprint, only for the heuristics the fingerprint covers; 0 or None evaluates every state
+        self.EvaluationCache = MakeEvaluationCache(evaluation_function, self.batch_evaluation_function, evaluation_cache_size)
         self.Weights = weights
         self.Functions = functions
         self.UsePriorMove = use_prior_move
@@ -39,12 +45,11 @@ class BoundedDS(BaseAI):
 
         best_move = None
         best_move_val = float("-inf")
-        for evaluating_move in possible_moves:
-            if evaluating_move.command == MoveEnum.END_TURN:
-                # skip the END_TURN command
-                continue
-
-            curr_val = self.EvaluateMove(evaluating_move, game_state, self.depth-1)
+        # skip the END_TURN command
+        evaluating_moves = [move for move in possible_moves if move.command != MoveEnum.END_TURN]
+        leaf_values = self.EvaluateLeafMoves(evaluating_moves, game_state) if self.depth == 1 else None
+        for i, evaluating_move in enumerate(evaluating_moves):
+            curr_val = leaf_values[i] if leaf_values is not None else self.EvaluateMove(evaluating_move, game_state, self.depth-1)
             if curr_val == float('inf'):
                 # Goal State founded can return early
                 return evaluating_move
@@ -57,6 +62,7 @@ class BoundedDS(BaseAI):
     def EvaluateMove(self,move, game_state, depth:int)->float:
         # Move Evaluation (Depth first approach)
         local_game_state, new_moves = game_state.apply_move(move,self.seed)
+        CarryHandFeatures(game_state, move, local_game_state) # the leaves below derive their features from this state
 
         if CheckForGoalState(local_game_state,self.player_id):
             return float('inf')
@@ -64,29 +70,50 @@ class BoundedDS(BaseAI):
         if depth == 0 or not NewPossibleMoveAvailable(new_moves):
             return self.UtilityFunction(local_game_state)
 
+        new_moves = [new_move for new_move in new_moves if new_move.command != MoveEnum.END_TURN]
+        if depth == 1:
+            return max(self.EvaluateLeafMoves(new_moves, local_game_state))
+
         move_value=[]
         for new_move in new_moves:
-            if new_move.command == MoveEnum.END_TURN:
-                continue
             move_value.append(self.EvaluateMove(new_move, local_game_state, depth-1))
 
         return max(move_value)
 
+    def EvaluateLeafMoves(self, moves: list[BasicMove], game_state: GameState) -> list[float]:
+        # EvaluateMove at depth 0 for all the moves: the leaf states are scored together by the batch evaluation
+        local_game_states = [game_state.apply_move(move, self.seed)[0] for move in moves]
+        for move, local_game_state in zip(moves, local_game_states):
+            CarryHandFeatures(game_state, move, local_game_state)
+        move_values = self.UtilityFunctions(local_game_states).tolist()
+        for i, local_game_state in enumerate(local_game_states):
+            if CheckForGoalState(local_game_state, self.player_id):
+                move_values[i] = float('inf')
+        return move_values
+
     def UtilityFunction(self, game_state: GameState) -> float:
+        if self.EvaluationCache is not None:
+            return self.EvaluationCache(game_state, self.Weights, self.Functions)
         return self.evaluation_function(game_state, self.Weights, self.Functions)
 
+    def UtilityFunctions(self, game_states: list[GameState]) -> np.ndarray:
+        if self.EvaluationCache is not None:
+            return self.EvaluationCache.Batch(game_states, self.Weights, self.Functions)
+        return self.batch_evaluation_function(game_states, self.Weights, self.Functions)
+
     def play(self, game_state: GameState, possible_moves:list[BasicMove], remaining_time: int) -> BasicMove:
         # Set Up
         if self.start_of_game:
             self.player_id = game_state.current_player.player_id
             self.start_of_game = False
+        PrimeHandFeatures(game_state, self.evaluation_function)
 
         if self.UsePriorMove:
             for move in possible_moves:
                 if IsPriorMoves(move):
                     return move
 
-            best_choice = MakePriorChoice(game_state, possible_moves, self.UtilityFunction)
+            best_choice = MakePriorChoice(game_state, possible_moves, self.UtilityFunctions)
             if best_choice is not None:
                 return best_choice
 
@@ -101,6 +128,10 @@ class BoundedDS(BaseAI):
         return best_move
 
     def game_end(self, end_game_state: EndGameState, final_state: GameState):
+        if self.EvaluationCache is not None:
+            cache = self.EvaluationCache
+            PrintLog("CACHE", f"evaluation cache hits: {cache.Hits}, misses: {cache.Misses}, hit rate: {cache.HitRate():.2%}, evictions: {cache.Evictions}", 0)
+            cache.Clear()
         LogEndOfGame(self.bot_name, end_game_state, final_state)
 
         won = 1 if self.player_id == final_state.current_player.player_id else 0
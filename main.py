@@ -1,5 +1,4 @@
-from BotCommon.Heuristics import utilityFunction_PrestigeAndPower, utilityFunction_MMHVR, \
-    WeightedUtilityFunction_MMHVR_plain
+from BotCommon.Heuristics import utilityFunction_PrestigeAndPower, utilityFunction_MMHVR
 from ExampleBot.RandomBot import RandomBot
 from Helper.GameManager import TryAsFirstAndSecondPlayer_PrintReasonFromLog
 from HeuristicLearning.EvolutionaryHeuristic import evolutionary_algorithm, Individual
@@ -41,14 +40,49 @@ def MakeRun():
 
     ind = Individual.LoadLatest("gen")
     bot_MCTS_WMMHVR_evolved = AIFBotMCTS                  (bot_name="MCTS2_WMMHVR_evolved", MCTSversion= MCTSenum.MCTS2,
-                                                           evaluation_function=WeightedUtilityFunction_MMHVR_plain,
-                                                           weights=ind.weights, functions=ind.activations)
+                                                           evaluation_function=ind.Compile())
 
     TryAsFirstAndSecondPlayer_PrintReasonFromLog(bot_DMultyTMCTS_WMMHVR, bot_BoundedDS_WMMHVR, runs=RUN_NUM, threads=THREAD_NUM, hide_print=HIDE_PRINT)
 
+def PlayoutCutoffBenchmark(cutoffs=(None, 2, 4, 8)):
+    # win rate of the same bot at several playout cutoffs, the iterations/s are logged by the bot at the end of every game
+    bot_BoundedDS_WMMHVR = BoundedDS(bot_name="BoundedDS_WMMHVR_2_Moves", depth=2, use_prior_move= False,
+                                     evaluation_function= utilityFunction_MMHVR)
+    bots = [AIFBotMCTS(bot_name=f"MCTS_WMMHVR_cut{depth}", MCTSversion= MCTSenum.MCTS,
+                       evaluation_function= utilityFunction_MMHVR, playout_depth=depth) for depth in cutoffs]
+    bots.append(AIFBotMCTS(bot_name=f"MCTS_WMMHVR_cut{max(d for d in cutoffs if d is not None)}_adaptive", MCTSversion= MCTSenum.MCTS,
+                           evaluation_function= utilityFunction_MMHVR, playout_depth=max(d for d in cutoffs if d is not None), adaptive_playout_depth=True))
+    for bot in bots:
+        TryAsFirstAndSecondPlayer_PrintReasonFromLog(bot, bot_BoundedDS_WMMHVR, runs=RUN_NUM, threads=THREAD_NUM, hide_print=HIDE_PRINT)
+
+def RaveBenchmark(iterations=(25, 50, 100), versions=(MCTSenum.MCTS, MCTSenum.ProgressiveMCTS, MCTSenum.DSingleTMCTS)):
+    # same iteration budget with and without the AMAF statistics, the stopping rule is off so every search runs all of them
+    bot_BoundedDS_WMMHVR = BoundedDS(bot_name="BoundedDS_WMMHVR_2_Moves", depth=2, use_prior_move= False,
+                                     evaluation_function= utilityFunction_MMHVR)
+    for version in versions:
+        for max_iteration in iterations:
+            for rave in (False, True):
+                bot = AIFBotMCTS(bot_name=f"{version.name}_WMMHVR_it{max_iteration}{'_rave' if rave else ''}", MCTSversion= version,
+                                 evaluation_function= utilityFunction_MMHVR, max_iteration=max_iteration, early_stop=False,
+                                 search_options={"rave": rave})
+                TryAsFirstAndSecondPlayer_PrintReasonFromLog(bot, bot_BoundedDS_WMMHVR, runs=RUN_NUM, threads=THREAD_NUM, hide_print=HIDE_PRINT)
+
+def InformationSetBenchmark():
+    # one information set tree against DMultyTCTS's independent trees under the same time budget:
+    # memory (peak nodes and GameStates) and iterations/s are in the metrics file written by the bots at every game end,
+    # enable it with METRICS_ENABLED_FILE in Helper
+    bot_BoundedDS_WMMHVR = BoundedDS(bot_name="BoundedDS_WMMHVR_2_Moves", depth=2, use_prior_move= False,
+                                     evaluation_function= utilityFunction_MMHVR)
+    for version in (MCTSenum.DMultyTMCTS, MCTSenum.ISMCTS):
+        bot = AIFBotMCTS(bot_name=f"{version.name}_WMMHVR", MCTSversion= version, evaluation_function= utilityFunction_MMHVR)
+        TryAsFirstAndSecondPlayer_PrintReasonFromLog(bot, bot_BoundedDS_WMMHVR, runs=RUN_NUM, threads=THREAD_NUM, hide_print=HIDE_PRINT)
+
 if __name__ == "__main__":
     # results_from_log()
     MakeRun()
+    # PlayoutCutoffBenchmark()
+    # RaveBenchmark()
+    # InformationSetBenchmark()
     # Evolve()
     # plot_convergence_from_checkpoints(20,13)
     # plotSingleWeight_from_checkpoints(20,13)
@@ -0,0 +1,67 @@
+import itertools
+import random
+from types import SimpleNamespace
+
+from scripts_of_tribute.enums import MoveEnum, PatronId, PlayerEnum
+from scripts_of_tribute.move import BasicMove, SimpleCardMove
+
+
+# A small stand-in for the engine: cards with a DRAW effect draw from the draw pile, which card is drawn depends on
+# the seed (a new random one without it), so the determinizations disagree on the hand and on the legal moves.
+# Playing a card that is not in the hand fails as the engine does.
+
+STATE_IDS = itertools.count()
+
+
+def Card(unique_id: int, effects: list[str]) -> SimpleNamespace:
+    return SimpleNamespace(unique_id=unique_id, name=f"card {unique_id}", effects=effects)
+
+
+class StubState:
+    def __init__(self, hand: list, draw_pile: list, played: list = None, coins: int = 0, ended: bool = False):
+        self.state_id = next(STATE_IDS)
+        self.current_player = SimpleNamespace(player_id=PlayerEnum.PLAYER1, hand=hand, draw_pile=draw_pile, played=played or [],
+                                              cooldown_pile=[], known_upcoming_draws=[], agents=[], coins=coins, power=0,
+                                              prestige=0, patron_calls=1)
+        self.enemy_player = SimpleNamespace(prestige=0, power=0, agents=[])
+        self.patron_states = SimpleNamespace(patrons={PatronId.TREASURY: PlayerEnum.NO_PLAYER_SELECTED})
+        self.end_game_state = None
+        self.board_state = 0
+        self.pending_choice = None
+        self.tavern_available_cards = []
+        self.upcoming_effects = []
+        self.ended = ended
+        self.calls = 0
+
+    def moves(self) -> list:
+        end_turn = BasicMove(0, MoveEnum.END_TURN)
+        if self.ended:
+            return [end_turn]
+        return [SimpleCardMove(i + 1, MoveEnum.PLAY_CARD, card.unique_id) for i, card in enumerate(self.current_player.hand)] + [end_turn]
+
+    def apply_move(self, move, seed=None):
+        self.calls += 1
+        player = self.current_player
+        if move.command == MoveEnum.END_TURN:
+            state = StubState(list(player.hand), list(player.draw_pile), list(player.played), player.coins, ended=True)
+            return state, state.moves()
+        card = next(card for card in player.hand if card.unique_id == move.cardUniqueId)
+        hand = [c for c in player.hand if c is not card]
+        draw_pile = list(player.draw_pile)
+        if "DRAW 1" in card.effects and len(draw_pile) > 0:
+            rng = random.Random(seed) if seed is not None else random
+            hand.append(draw_pile.pop(rng.randrange(len(draw_pile))))
+        state = StubState(hand, draw_pile, list(player.played) + [card], player.coins + 1)
+        return state, state.moves()
+
+
+def MakeStubRoot(hand_size: int = 3, draw_size: int = 6) -> tuple[StubState, list]:
+    # every card of the hand draws, the draw pile holds cards no other determinization may have drawn
+    hand = [Card(uid, ["DRAW 1", "GAIN_COIN 1"]) for uid in range(hand_size)]
+    draw_pile = [Card(uid, ["GAIN_COIN 2"]) for uid in range(hand_size, hand_size + draw_size)]
+    state = StubState(hand, draw_pile)
+    return state, state.moves()
+
+
+def CoinsUtility(game_state, *args, **kwargs) -> float:
+    return float(game_state.current_player.coins)
@@ -0,0 +1,55 @@
+import random
+
+from scripts_of_tribute.enums import MoveEnum
+
+from MCTS.DSingleTMCTS import DSingleTMCTS
+from MCTS.MCTSNode import MCTSNode
+from MCTS.SimulationCache import SIMULATION_CACHE
+from tests.stub_engine import CoinsUtility, MakeStubRoot
+
+
+def PlayedFromLegalState(node: MCTSNode) -> bool:
+    # every child move exists in the parent state it is played from
+    for child in node.Children:
+        if child.ParentNode is not node:
+            continue
+        parent_state = node.GetGameState(child.MoveSeed)
+        if child.Move.command != MoveEnum.END_TURN and child.Move.cardUniqueId not in {card.unique_id for card in parent_state.current_player.hand}:
+            return False
+        if not PlayedFromLegalState(child):
+            return False
+    return True
+
+
+def test_search_with_seed_dependent_draws():
+    # the determinizations draw different cards, a move drawn under one seed used to be expanded on another one
+    for search_seed in range(10):
+        random.seed(search_seed)
+        SIMULATION_CACHE.Clear()
+        game_state, possible_moves = MakeStubRoot()
+        search = DSingleTMCTS(game_state, possible_moves, CoinsUtility, visit_threshold=1, seed_count=2)
+        move = search.MonteCarloSearch(300, 60000)
+        assert move in possible_moves
+        assert PlayedFromLegalState(search.RootNode)
+
+
+def test_pop_prefers_the_moves_of_the_expanding_seed():
+    game_state, possible_moves = MakeStubRoot()
+    root = MCTSNode(None, None)
+    root.ExpandRoot(game_state, possible_moves)
+    node = root.Children[0]
+    first, first_moves = game_state.apply_move(node.Move, 1)
+    second, second_moves = game_state.apply_move(node.Move, 2)
+    node.RegisterState(1, first, first_moves)
+    node.RegisterState(2, second, second_moves)
+
+    first_ids = {m.cardUniqueId for m in first_moves if m.command != MoveEnum.END_TURN}
+    while len(node.UnexpandedPossibleMoves) > 0:
+        move, seed = node.PopUnexpandedMove(random.Random(0), 1)
+        if move.command == MoveEnum.END_TURN:
+            continue
+        if move.cardUniqueId in first_ids:
+            assert seed == 1
+            first_ids.discard(move.cardUniqueId)
+        else:
+            assert len(first_ids) == 0 and seed == 2 # only drawn under the other seed, played from its state
@@ -0,0 +1,52 @@
+import random
+
+from MCTS.SeedPool import SeedPool
+
+
+# SeedPool only reads the seeds a node already holds a state for, and keys its draws by node
+class Node:
+    def __init__(self, *seeds):
+        self.GameStates = {seed: None for seed in seeds}
+
+
+def test_draws_every_seed_once_then_exhausts():
+    random.seed(0)
+    pool = SeedPool(list(range(100)))
+    node = Node()
+    drawn = []
+    while pool.HasUnused(node):
+        seed = pool.Draw(node)
+        node.GameStates[seed] = None
+        drawn.append(seed)
+    assert sorted(drawn) == list(range(100))
+    assert pool.DrawnCount(node) == 100
+    assert pool.Draw(node) is None
+
+
+def test_nodes_draw_independently():
+    pool = SeedPool(list(range(10)))
+    first, second = Node(), Node()
+    for _ in range(10):
+        pool.Draw(first)
+    assert not pool.HasUnused(first)
+    assert pool.HasUnused(second) and pool.DrawnCount(second) == 0
+
+
+def test_skips_the_seeds_a_transposition_supplied():
+    pool = SeedPool(list(range(20)))
+    supplied = set(range(0, 20, 2))
+    node = Node(*supplied)
+    drawn = set()
+    while (seed := pool.Draw(node)) is not None:
+        drawn.add(seed)
+    assert drawn == set(range(20)) - supplied
+
+
+def test_forgotten_node_draws_from_the_whole_pool_again():
+    pool = SeedPool(list(range(5)))
+    node = Node()
+    for _ in range(5):
+        pool.Draw(node)
+    pool.Forget([node])
+    assert pool.DrawnCount(node) == 0
+    assert pool.Draw(node) in range(5)
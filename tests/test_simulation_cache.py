@@ -0,0 +1,41 @@
+import random
+from types import SimpleNamespace
+
+from scripts_of_tribute.enums import MoveEnum
+
+from MCTS.SimulationCache import SimulationCache
+
+
+# stands in for the engine: the outcome of a move is drawn from the seed, a new random one without it
+class DrawingState:
+    def __init__(self, state_id: int = 0, hand: int = 0):
+        self.state_id = state_id
+        self.hand = hand
+        self.calls = 0
+
+    def apply_move(self, move, seed=None):
+        self.calls += 1
+        rng = random.Random(seed) if seed is not None else random
+        return DrawingState(self.state_id * 100 + self.calls, rng.randrange(1000)), []
+
+
+def DrawMove():
+    return SimpleNamespace(command=MoveEnum.PLAY_CARD, cardUniqueId=7)
+
+
+def test_unseeded_calls_still_vary():
+    cache = SimulationCache()
+    game_state, move = DrawingState(), DrawMove()
+    hands = {cache.ApplyMove(game_state, move, None)[0].hand for _ in range(50)}
+    assert len(hands) > 1
+    assert game_state.calls == 50
+    assert len(cache.Entries) == 0 and cache.EngineCalls == 50
+
+
+def test_seeded_calls_are_cached():
+    cache = SimulationCache()
+    game_state, move = DrawingState(), DrawMove()
+    first = cache.ApplyMove(game_state, move, 3)[0]
+    assert all(cache.ApplyMove(game_state, move, 3)[0] is first for _ in range(10))
+    assert game_state.calls == 1
+    assert cache.Hits == 10 and cache.Misses == 1